@@ -1,5 +1,7 @@
 
+import numpy as np
 import pandas as pd
+import re
 
 
 NAN = float('nan')
@@ -133,55 +135,70 @@ def contains_pattern(s, *args):
     return False
 
 
-def normalize_control(row):
-    ctrl = row['control_type']
-    if not ctrl:
-        return None
-    if ctrl in ['ctrl cities']:
-        return 'background_control'
-    if ctrl in ['positive_control', 'poszymo']:
-        return 'positive_control'
-    if ctrl in ['negative_control', 'dry tube', 'dry tube & swab', 'tube & rna/dna out', 'tube & rna/dna out & swab']:
-        return 'lab_negative_control'
-    return None
+CONTROL_TYPES = {
+    'ctrl cities': 'background_control',
+    'positive_control': 'positive_control',
+    'poszymo': 'positive_control',
+    'negative_control': 'lab_negative_control',
+    'dry tube': 'lab_negative_control',
+    'dry tube & swab': 'lab_negative_control',
+    'tube & rna/dna out': 'lab_negative_control',
+    'tube & rna/dna out & swab': 'lab_negative_control',
+}
 
 
-def id_control(row, col):
-    if row[col]:
-        return row[col]
-    msub_name = row['metasub_name']
-    if contains_pattern(msub_name, 'positive'):
-        return 'positive_control'
-    elif contains_pattern(msub_name, 'control', 'copan'):
-        return 'background_control'
-    if contains_pattern(row['surface_material'], 'negative_control', 'air'):
-        return 'background_control'
-    if contains_pattern(row['city'], 'neg_control'):
-        return 'background_control'
-    if contains_pattern(row['city'], 'pos_control'):
-        return 'positive_control'
+def contains_any(column, *args):
+    """Return a boolean series, True where column holds a string containing any of args.
 
+    Matching ignores case, as contains_pattern does.
+    """
+    pattern = '|'.join(re.escape(arg) for arg in args)
+    return column.str.contains(pattern, case=False, regex=True).fillna(False).astype(bool)
 
-def add_lab_controls_fine(row):
-    for (fine, coarse, col), samples in lab_controls.items():
-        if contains_pattern(row[col], *samples):
-            return fine
 
+def lab_control_types(tbl):
+    """Return the fine control type of each sample from the barcodes, uuids etc in lab_controls.
 
-def add_lab_controls_coarse(row):
-    for (fine, coarse, col), samples in lab_controls.items():
-        if contains_pattern(row[col], *samples):
-            return coarse
+    The first entry of lab_controls matching a sample wins, None if none match.
+    """
+    fine = pd.Series(None, index=tbl.index, dtype=object)
+    unmatched = pd.Series(True, index=tbl.index)
+    for (fine_type, _, col), samples in lab_controls.items():
+        matched = unmatched & contains_any(tbl[col], *samples)
+        fine[matched] = fine_type
+        unmatched &= ~matched
+    return fine
+
+
+def id_controls(tbl, control_types):
+    """Return control_types with missing values guessed from sample names, surfaces and cities."""
+    guessed = np.select(
+        [
+            contains_any(tbl['metasub_name'], 'positive'),
+            contains_any(tbl['metasub_name'], 'control', 'copan'),
+            contains_any(tbl['surface_material'], 'negative_control', 'air'),
+            contains_any(tbl['city'], 'neg_control'),
+            contains_any(tbl['city'], 'pos_control'),
+        ],
+        [
+            'positive_control',
+            'background_control',
+            'background_control',
+            'background_control',
+            'positive_control',
+        ],
+        default=None,
+    )
+    return control_types.where(control_types.notna(), pd.Series(guessed, index=tbl.index))
 
 
 def controlify(tbl):
-    tbl['control_type_fine'] = tbl.apply(add_lab_controls_fine, axis=1)
-    tbl['control_type_coarse'] = tbl.apply(add_lab_controls_coarse, axis=1)
-
-    tbl['control_type_fine'] = tbl.apply(lambda r: id_control(r, 'control_type_fine'), axis=1)
-    tbl['control_type_coarse'] = tbl.apply(lambda r: id_control(r, 'control_type_coarse'), axis=1)
+    """Add the fine and coarse control type of each sample.
 
-    tbl['control_type_coarse'] = tbl.apply(normalize_control, axis=1)
+    Coarse types come from the control_type column alone.
+    """
+    tbl['control_type_fine'] = id_controls(tbl, lab_control_types(tbl))
+    tbl['control_type_coarse'] = tbl['control_type'].map(CONTROL_TYPES)
     return tbl
 
 
@@ -211,24 +228,22 @@ def add_surface_ontology(metadata):
 def add_place_ontology(metadata):
     """Return a pandas dataframe with metadata and place ontologies."""
     metadata = metadata.copy()
-    metadata['coastal'] = metadata.apply(lambda r: coastal(r)[1], reduce=True, axis=1)
-    metadata['city_elevation'] = metadata.apply(lambda r: coastal(r)[0], reduce=True, axis=1)
+    is_coastal = metadata['coastal_city'] == 'yes'
+    high = metadata['city_elevation_meters'].astype(float) > 1000
+    metadata['coastal'] = np.where(is_coastal, 'coastal', 'not_coastal')
+    metadata['city_elevation'] = np.select(
+        [is_coastal, high], ['coastal', 'high_altitude'], default='low_altitude'
+    )
     return metadata
 
 
-def coastal(row):
-    if row['coastal_city'] == 'yes':
-        return ('coastal', 'coastal')
-    if float(row['city_elevation_meters']) > 1000:
-        return ('high_altitude', 'not_coastal')
-    return ('low_altitude', 'not_coastal')
+def duplicates(tbl, col='ha_id'):
+    """Return a boolean series, True for rows whose col is a string seen in an earlier row.
 
-
-def deduper(row, mems, col='ha_id'):
-    if row[col] and isinstance(row[col], str) and (row[col] in mems):
-        return False
-    mems.add(row[col])
-    return True
+    Missing and empty values are never duplicates.
+    """
+    values = tbl[col]
+    return values.duplicated(keep='first') & values.notna() & (values != '')
 
 
 def clean_metadata_table(tbl):
@@ -236,17 +251,16 @@ def clean_metadata_table(tbl):
 
     All values are pandas dataframes/series.
     """
-    tbl = tbl.query('project != "CSD17_AIR"')
-    tbl['city'] = tbl['city'].map(lambda val: 'honolulu' if val == 'antarctica' else val)
+    tbl = tbl.query('project != "CSD17_AIR"').copy()
+    tbl['city'] = tbl['city'].where(tbl['city'] != 'antarctica', 'honolulu')
     tbl = controlify(tbl)
     tbl = add_surface_ontology(tbl)
     tbl = add_place_ontology(tbl)
 
-    mems = set()
-    deduped = tbl.loc[tbl.apply(lambda r: deduper(r, mems), axis=1)]
+    is_dupe = duplicates(tbl)
+    deduped = tbl.loc[~is_dupe]
     cntrls = deduped.loc[~deduped['control_type_coarse'].isna()]
-    mems = set()
-    dupes = tbl.loc[tbl.apply(lambda r: not deduper(r, mems), axis=1)]
+    dupes = tbl.loc[is_dupe]
     dupe_primary = deduped.loc[deduped['ha_id'].isin(dupes['ha_id'])]
 
     dupe_map = dupe_primary[['uuid', 'ha_id']].join(
@@ -2,13 +2,16 @@
 import click
 import pandas as pd
 from os.path import join
+from time import time
 
 from metasub_utils.data_packet.filter_data_packet import (
-    make_city_packet,
+    PacketFilter,
+    make_city_packets,
     make_sub_packet,
 )
 
 from .clean_metadata import clean_metadata_table
+from .compression import KEEP, GZIP, ZSTD, with_compression
 
 
 @click.group()
@@ -16,21 +19,60 @@ def packet():
     pass
 
 
+try:
+    from metasub_utils.packet_parse.cli import cache as cli_cache, figures as cli_figures
+    packet.add_command(cli_cache)
+    packet.add_command(cli_figures)
+except ImportError:
+    pass
+
+
+def echo_table_time(record):
+    click.echo(
+        f'{record["table"]}\t{record["sub_packets"]} sub packets\t{record["seconds"]:.1f}s',
+        err=True,
+    )
+
+
+jobs_option = click.option('-j', '--jobs', default=1, help='Number of tables to filter at once.')
+compress_option = click.option(
+    '-c', '--compress', default=KEEP, type=click.Choice([KEEP, 'none', GZIP, ZSTD]),
+    callback=lambda ctx, param, value: None if value == 'none' else value,
+    help='Compression of the tables written, by default that of each source table.',
+)
+
+
 @packet.command('generic-sub-packet')
+@jobs_option
+@compress_option
 @click.option('-p', '--packet-dir', default='.')
 @click.argument('sample_names')
 @click.argument('sub_packet_dir')
-def cli_make_generic_sub_packet(packet_dir, sample_names, sub_packet_dir):
+def cli_make_generic_sub_packet(jobs, compress, packet_dir, sample_names, sub_packet_dir):
     """Make tables for a sub packet given a list of sample names."""
-    make_sub_packet(sub_packet_dir, sample_names, data_packet_dir=packet_dir)
+    make_sub_packet(
+        sub_packet_dir, sample_names, data_packet_dir=packet_dir,
+        jobs=jobs, compress=compress, callback=echo_table_time,
+    )
 
 
 @packet.command('city-sub-packet')
+@jobs_option
+@compress_option
 @click.option('-p', '--packet-dir', default='.')
-@click.argument('city_name')
-def cli_make_city_packet(packet_dir, city_name):
-    """Make a data packet with only samples from the specified city."""
-    make_city_packet(city_name, data_packet_dir=packet_dir)
+@click.option('--all-cities/--no-all-cities', default=False, help='Make a packet for every city.')
+@click.argument('city_names', nargs=-1)
+def cli_make_city_packet(jobs, compress, packet_dir, all_cities, city_names):
+    """Make a data packet for each specified city, with only samples from that city.
+
+    Every city packet is written in one pass over each table of the packet.
+    """
+    if not all_cities and not city_names:
+        raise click.UsageError('Give at least one city name or --all-cities')
+    make_city_packets(
+        None if all_cities else city_names, data_packet_dir=packet_dir,
+        jobs=jobs, compress=compress, callback=echo_table_time,
+    )
 
 
 @packet.command('release-metadata')
@@ -47,28 +89,40 @@ def cli_make_release_metadata(raw_metadata):
 
 
 @packet.command('release-packet')
+@jobs_option
+@compress_option
 @click.argument('raw_packet')
 @click.argument('raw_metadata', type=click.File('r'))
 @click.argument('new_packet')
-def cli_make_release_packet(raw_packet, raw_metadata, new_packet):
-    """Make a data packet suitable for release."""
+def cli_make_release_packet(jobs, compress, raw_packet, raw_metadata, new_packet):
+    """Make a data packet suitable for release.
+
+    The main, control and duplicate packets are written together, in one
+    pass over each table of the raw packet.
+    """
+    start = time()
     raw_meta = pd.read_csv(raw_metadata, dtype=str)
     meta, cntrl_meta, dupe_meta, dupe_map = clean_metadata_table(raw_meta)
-    make_sub_packet(new_packet, meta['uuid'], data_packet_dir=raw_packet, copy_metadata=False)
-    meta.to_csv(join(new_packet, 'metadata', 'complete_metadata.csv'))
-    click.echo('Built main packet', err=True)
-
     cntrl_packet = join(new_packet, 'controls')
-    make_sub_packet(cntrl_packet, cntrl_meta['uuid'], data_packet_dir=new_packet, copy_metadata=False)
-    cntrl_meta.to_csv(join(cntrl_packet, 'metadata', 'complete_metadata.csv'))
-    click.echo('Built control packet', err=True)
-
     dupe_packet = join(new_packet, 'duplicates')
     all_dupes = set(dupe_map.iloc[:, 0]) | set(dupe_map.iloc[:, 1])
-    make_sub_packet(dupe_packet, all_dupes, data_packet_dir=raw_packet, copy_metadata=False)
-    dupe_meta.to_csv(join(dupe_packet, 'metadata', 'complete_metadata.csv'))
-    dupe_map.to_csv(join(dupe_packet, 'metadata', 'duplicate_map.csv'))
-    click.echo('Built duplicate packet', err=True)
+
+    packet_filter = PacketFilter(data_packet_dir=raw_packet)
+    packet_filter.add_sub_packet(new_packet, meta['uuid'], copy_metadata=False)
+    packet_filter.add_sub_packet(cntrl_packet, cntrl_meta['uuid'], copy_metadata=False)
+    packet_filter.add_sub_packet(dupe_packet, all_dupes, copy_metadata=False)
+    packet_filter.run(jobs=jobs, compress=compress, callback=echo_table_time)
+
+    def metadata_path(packet_dir, filename):
+        return with_compression(
+            join(packet_dir, 'metadata', filename), None if compress == KEEP else compress
+        )
+
+    meta.to_csv(metadata_path(new_packet, 'complete_metadata.csv'))
+    cntrl_meta.to_csv(metadata_path(cntrl_packet, 'complete_metadata.csv'))
+    dupe_meta.to_csv(metadata_path(dupe_packet, 'complete_metadata.csv'))
+    dupe_map.to_csv(metadata_path(dupe_packet, 'duplicate_map.csv'))
+    click.echo(f'Built main, control and duplicate packets in {time() - start:.1f}s', err=True)
 
 
 if __name__ == '__main__':
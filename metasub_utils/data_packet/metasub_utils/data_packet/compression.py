@@ -0,0 +1,67 @@
+"""Open packet tables as text whether they are plain, gzip or zstd compressed."""
+
+import gzip
+import io
+from os.path import isfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP, ZSTD = 'gzip', 'zstd'
+KEEP = 'keep'  # write a table compressed as its source is
+SUFFIXES = {GZIP: '.gz', ZSTD: '.zst'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+ZSTD_THREADS = -1  # one compression thread per core
+
+
+def compression_of(path):
+    """Return the compression of a file from its suffix, or None if it is plain."""
+    for compression, suffix in SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_compression(path):
+    """Return path without its compression suffix."""
+    compression = compression_of(path)
+    return path[:-len(SUFFIXES[compression])] if compression else path
+
+
+def with_compression(path, compression):
+    """Return path, without any compression suffix, with the suffix of compression."""
+    return strip_compression(path) + (SUFFIXES[compression] if compression else '')
+
+
+def find_table(path):
+    """Return path, or a compressed version of it if only that exists, or None."""
+    for candidate in [path] + [path + suffix for suffix in SUFFIXES.values()]:
+        if isfile(candidate):
+            return candidate
+    return None
+
+
+def open_table(path, mode='r', compression='infer'):
+    """Open a table in text mode, compressed as its suffix says unless compression is given.
+
+    Text is read and written with newline='' so lines are copied as they are.
+    Zstd needs the zstandard package and compresses with one thread per core.
+    """
+    if compression == 'infer':
+        compression = compression_of(path)
+    if compression is None:
+        return open(path, mode, newline='')
+    if compression == GZIP:
+        return gzip.open(path, mode + 't', compresslevel=GZIP_LEVEL, newline='')
+    if zstandard is None:
+        raise ImportError('Reading and writing zstd tables needs the zstandard package')
+    if 'r' in mode:
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS).stream_writer(
+            open(path, 'wb'), closefd=True
+        )
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
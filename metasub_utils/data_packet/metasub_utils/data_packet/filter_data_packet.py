@@ -1,61 +1,232 @@
 
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from glob import glob
-from subprocess import call
-from os import makedirs
-from os.path import join, basename, isfile
-from tempfile import NamedTemporaryFile
+from itertools import islice
+from os import makedirs, replace
+from os.path import join, basename, isfile, relpath
+from time import time
 
 from metasub_utils.metadata import get_complete_metadata
 
+from .compression import (
+    KEEP, SUFFIXES, compression_of, open_table, strip_compression, with_compression,
+)
+from .packet_manifest import COLUMNS, PacketManifest, detect_layout, packet_samples, sample_id
 
-def filter_file(source_file, sample_names_filename, out_filename, no_overwrite=True):
-    if no_overwrite and isfile(out_filename):
-        return
-    cmd = (
-        f'cat {source_file} | head -1 > {out_filename} && '
-        f'cat {source_file} | grep -Ff {sample_names_filename} >> {out_filename}'
-    )
-    call(cmd, shell=True)
+PACKET_SUB_DIRS = ['antimicrobial_resistance', 'metadata', 'other', 'taxonomy', 'pathways']
+CHUNK_ROWS = 1024
 
 
-def get_samples_in_city(city_name):
-    metadata = get_complete_metadata()
-    return metadata[metadata['city'] == city_name].index
+def read_sample_names(sample_names):
+    """Return a set of sample names from a file of names, one per line, or an iterable."""
+    if isinstance(sample_names, str):
+        with open(sample_names) as snf:
+            return {line.strip() for line in snf if line.strip()}
+    return {str(sample_name) for sample_name in sample_names}
 
 
-def make_city_packet(city_name, data_packet_dir='.'):
-    """Make a data packet for a given city."""
-    city_name = city_name.lower()
-    city_packet_dir = join(data_packet_dir, f'city_packets/{city_name}')
-    makedirs(city_packet_dir, exist_ok=True)
+def filter_rows(source, outs, routes, layout):
+    """Copy the header lines, and each row to the outs its sample ID is routed to."""
+    header = ''.join(islice(source, layout['header_lines']))
+    for out in outs:
+        out.write(header)
+    column = layout['sample_column']
+    for line in source:
+        for i in routes.get(sample_id(line, column), ()):
+            outs[i].write(line)
+
+
+def filter_columns(source, outs, sample_names, layout):
+    """Copy the leading columns, and the sample columns of each out's samples, to each out.
+
+    Lines are parsed and written CHUNK_ROWS at a time, so memory use does
+    not grow with the length of the table.
+    """
+    reader = csv.reader(source)
+    header = next(reader, [])
+    first = layout['first_sample_column']
+    selected = [
+        list(range(first)) + [
+            j for j in range(first, len(header)) if header[j].strip() in names
+        ]
+        for names in sample_names
+    ]
+    writers = [csv.writer(out, lineterminator='\n') for out in outs]
+    for writer, columns in zip(writers, selected):
+        writer.writerow([header[j] for j in columns])
+    while True:
+        chunk = list(islice(reader, CHUNK_ROWS))
+        if not chunk:
+            break
+        for writer, columns in zip(writers, selected):
+            writer.writerows([row[j] if j < len(row) else '' for j in columns] for row in chunk)
+
+
+def filter_table(source_file, sinks, layout=None):
+    """Write the part of a table belonging to the samples of each sink to that sink's file.
 
-    sample_names = get_samples_in_city(city_name)
-    sample_names_filename = join(city_packet_dir, f'{city_name}_sample_names.txt')
-    with open(sample_names_filename, 'w') as snf:
+    `sinks` is a list of (out_filename, sample_names) pairs. The source is
+    read once. Tables are read and written compressed as their filenames
+    say, see compression.open_table. If samples are rows (see packet_manifest.detect_layout) each
+    row goes to every sink which wants its sample, found by matching the
+    sample ID column exactly. If samples are columns each sink gets its
+    samples' columns.
+    """
+    if layout is None:
+        layout = detect_layout(source_file, set().union(*[names for _, names in sinks]))
+    routes = {}
+    for i, (_, sample_names) in enumerate(sinks):
         for sample_name in sample_names:
-            print(sample_name, file=snf)
+            routes.setdefault(sample_name, []).append(i)
+    outs = [
+        open_table(out_filename + '.tmp', 'w', compression=compression_of(out_filename))
+        for out_filename, _ in sinks
+    ]
+    try:
+        with open_table(source_file) as source:
+            if layout['orientation'] == COLUMNS:
+                filter_columns(source, outs, [names for _, names in sinks], layout)
+            else:
+                filter_rows(source, outs, routes, layout)
+    finally:
+        for out in outs:
+            out.close()
+    for out_filename, _ in sinks:
+        replace(out_filename + '.tmp', out_filename)
+
+
+def timed_filter_table(source_file, sinks, layout=None):
+    """Run filter_table and return the number of seconds it took."""
+    start = time()
+    filter_table(source_file, sinks, layout=layout)
+    return time() - start
+
+
+class PacketFilter:
+    """Make many sub packets of a data packet, reading each table of the packet once.
+
+    How samples are laid out in each table is read from, or detected and
+    recorded in, the packet's PacketManifest. Tables are independent jobs
+    which may run across a pool of processes.
+    """
+
+    def __init__(self, data_packet_dir='.'):
+        self.data_packet_dir = data_packet_dir
+        self.sub_packets = []
+
+    def add_sub_packet(self, sub_packet_dir, sample_names, copy_metadata=True):
+        """Add a sub packet to make, given a file of sample names or an iterable of them."""
+        self.sub_packets.append((sub_packet_dir, read_sample_names(sample_names), copy_metadata))
+
+    def tables(self):
+        """Yield (packet sub directory, table filename) for each table in the packet.
 
-    make_sub_packet(city_packet_dir, sample_names_filename, data_packet_dir=data_packet_dir)
+        A table kept both plain and compressed is yielded once, preferring
+        the plain copy, then gzip, then zstd.
+        """
+        for packet_sub_dir in PACKET_SUB_DIRS:
+            tables = {}
+            for suffix in [''] + list(SUFFIXES.values()):
+                for table in glob(join(self.data_packet_dir, packet_sub_dir, '*.csv' + suffix)):
+                    tables.setdefault(strip_compression(table), table)
+            for _, table in sorted(tables.items()):
+                yield packet_sub_dir, table
 
+    def run(self, no_overwrite=True, jobs=1, compress=KEEP, callback=lambda record: None):
+        """Write the tables of every sub packet, `jobs` tables at a time.
 
-def make_sub_packet(sub_packet_dir, sample_names_file, data_packet_dir='.', copy_metadata=True):
-    """Make a sub packet given a directory and a list of sample names."""
+        Tables are written compressed with `compress`, 'gzip', 'zstd' or
+        None for plain CSV, or by default as their source table is.
+        Existing tables are kept if no_overwrite. Return a list of records,
+        dicts of the table, the number of sub packets it was written to and
+        the seconds it took, each also passed to callback when done.
+        """
+        for sub_packet_dir, _, _ in self.sub_packets:
+            for packet_sub_dir in PACKET_SUB_DIRS:
+                makedirs(join(sub_packet_dir, packet_sub_dir), exist_ok=True)
+        manifest = PacketManifest(self.data_packet_dir)
+        known_samples = packet_samples(self.data_packet_dir).union(
+            *[sample_names for _, sample_names, _ in self.sub_packets]
+        )
+        todo = []
+        for packet_sub_dir, table in self.tables():
+            sinks = []
+            for sub_packet_dir, sample_names, copy_metadata in self.sub_packets:
+                if packet_sub_dir == 'metadata' and not copy_metadata:
+                    continue
+                out_filename = with_compression(
+                    join(sub_packet_dir, packet_sub_dir, basename(table)),
+                    compression_of(table) if compress == KEEP else compress,
+                )
+                if no_overwrite and isfile(out_filename):
+                    continue
+                sinks.append((out_filename, sample_names))
+            if sinks:
+                todo.append((table, sinks, manifest.layout(table, known_samples)))
+        manifest.save()
 
-    if isinstance(sample_names_file, str):
-        sample_names_filename = sample_names_file
-    else:
-        with NamedTemporaryFile(mode='w', delete=False) as snf:
-            for sample_name in sample_names_file:
+        records = []
+
+        def finish(table, sinks, seconds):
+            record = {
+                'table': relpath(table, self.data_packet_dir),
+                'sub_packets': len(sinks),
+                'seconds': seconds,
+            }
+            records.append(record)
+            callback(record)
+
+        if jobs <= 1:
+            for table, sinks, layout in todo:
+                finish(table, sinks, timed_filter_table(table, sinks, layout=layout))
+            return records
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(timed_filter_table, table, sinks, layout=layout): (table, sinks)
+                for table, sinks, layout in todo
+            }
+            for future in as_completed(futures):
+                finish(*futures[future], future.result())
+        return records
+
+
+def get_samples_in_city(city_name, metadata=None):
+    metadata = get_complete_metadata() if metadata is None else metadata
+    return metadata[metadata['city'] == city_name].index
+
+
+def make_city_packets(city_names=None, data_packet_dir='.', **kwargs):
+    """Make a data packet for each given city, or for every city, in one pass over the packet."""
+    metadata = get_complete_metadata()
+    if city_names is None:
+        city_names = metadata['city'].dropna().unique()
+    packet_filter = PacketFilter(data_packet_dir=data_packet_dir)
+    for city_name in city_names:
+        city_name = city_name.lower()
+        city_packet_dir = join(data_packet_dir, f'city_packets/{city_name}')
+        makedirs(city_packet_dir, exist_ok=True)
+
+        sample_names = get_samples_in_city(city_name, metadata=metadata)
+        sample_names_filename = join(city_packet_dir, f'{city_name}_sample_names.txt')
+        with open(sample_names_filename, 'w') as snf:
+            for sample_name in sample_names:
                 print(sample_name, file=snf)
-            sample_names_filename = snf.name
-
-    for packet_sub_dir in ['antimicrobial_resistance', 'metadata', 'other', 'taxonomy', 'pathways']:
-        sub_packet_sub_dir = join(sub_packet_dir, packet_sub_dir)
-        makedirs(sub_packet_sub_dir, exist_ok=True)
-        packet_sub_dir = join(data_packet_dir, packet_sub_dir)
-        if packet_sub_dir == 'metadata' and not copy_metadata:
-            continue
-        tables = glob(packet_sub_dir + '/*.csv')
-        for table in tables:
-            sub_table_filename = join(sub_packet_sub_dir, basename(table))
-            filter_file(table, sample_names_filename, sub_table_filename)
+        packet_filter.add_sub_packet(city_packet_dir, sample_names)
+    return packet_filter.run(**kwargs)
+
+
+def make_city_packet(city_name, data_packet_dir='.', **kwargs):
+    """Make a data packet for a given city."""
+    return make_city_packets([city_name], data_packet_dir=data_packet_dir, **kwargs)
+
+
+def make_sub_packet(sub_packet_dir, sample_names_file, data_packet_dir='.', copy_metadata=True,
+                    **kwargs):
+    """Make a sub packet given a directory and a list of sample names.
+
+    Keyword arguments, e.g. `jobs`, are passed to PacketFilter.run.
+    """
+    packet_filter = PacketFilter(data_packet_dir=data_packet_dir)
+    packet_filter.add_sub_packet(sub_packet_dir, sample_names_file, copy_metadata=copy_metadata)
+    return packet_filter.run(**kwargs)
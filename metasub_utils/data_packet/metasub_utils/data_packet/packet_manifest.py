@@ -0,0 +1,140 @@
+"""Detect and record how samples are laid out in each table of a data packet."""
+
+import csv
+import hashlib
+import json
+from itertools import islice
+from os import replace, stat
+from os.path import join, isfile, relpath
+
+from .compression import find_table, open_table
+
+ROWS, COLUMNS = 'rows', 'columns'  # orientations, samples as rows or as columns
+MANIFEST_FILENAME = 'packet_manifest.json'
+MAX_HEADER_LINES = 16
+SAMPLE_COLUMNS = ['uuid', 'sample_name', 'sample']  # header names of sample ID columns
+METADATA_TABLE = 'metadata/complete_metadata.csv'
+DETECTOR_VERSION = 2  # bump when detect_layout changes so recorded layouts are detected again
+
+
+def sample_column(header):
+    """Return the position of the sample ID column in a header line, by default the first."""
+    fields = [field.strip().strip('"').lower() for field in next(csv.reader([header]))]
+    for name in SAMPLE_COLUMNS:
+        if name in fields:
+            return fields.index(name)
+    return 0
+
+
+def sample_id(line, column):
+    """Return the field at position column of a CSV line."""
+    if '"' in line:
+        fields = next(csv.reader([line]))
+    else:
+        fields = line.rstrip('\r\n').split(',', column + 1)
+    if column >= len(fields):
+        return None
+    return fields[column].strip().strip('"')
+
+
+def is_number(field):
+    try:
+        float(field)
+        return True
+    except ValueError:
+        return False
+
+
+def detect_layout(source_file, known_samples):
+    """Return a dict describing how samples are laid out in a table, from its first lines.
+
+    A table is oriented by COLUMNS if its header names a known sample,
+    in which case `first_sample_column` is the position of the first of
+    them. Otherwise samples are ROWS identified by `sample_column`. If
+    the header does not name its sample column, lines after it are also
+    header lines, counted in `header_lines`, while they have as many
+    fields as the header and neither name a known sample nor hold a
+    number. They are only counted if a data line of the same shape,
+    naming a known sample or holding a number, follows them.
+    """
+    with open_table(source_file) as source:
+        lines = list(islice(source, MAX_HEADER_LINES + 1))
+    if not lines:
+        return {'orientation': ROWS, 'sample_column': 0, 'header_lines': 1}
+    header = [field.strip() for field in next(csv.reader([lines[0]]))]
+    column = sample_column(lines[0])
+    named = header[column].lower() in SAMPLE_COLUMNS
+    sample_positions = [
+        i for i, field in enumerate(header) if i != column and field in known_samples
+    ]
+    if sample_positions and not named:
+        return {'orientation': COLUMNS, 'first_sample_column': sample_positions[0]}
+    header_lines = 1 if named else count_header_lines(lines, len(header), column, known_samples)
+    return {'orientation': ROWS, 'sample_column': column, 'header_lines': header_lines}
+
+
+def count_header_lines(lines, n_fields, column, known_samples):
+    """Return the number of header lines at the start of lines, see detect_layout."""
+    header_lines = 1
+    for line in lines[1:MAX_HEADER_LINES]:
+        fields = next(csv.reader([line]))
+        if len(fields) != n_fields:
+            return 1
+        if sample_id(line, column) in known_samples or any(map(is_number, fields)):
+            return header_lines
+        header_lines += 1
+    return 1  # no data line follows, treat as a single header line
+
+
+def samples_hash(known_samples):
+    """Return a hash of the sample names a layout is detected with."""
+    return hashlib.sha256('\n'.join(sorted(map(str, known_samples))).encode()).hexdigest()
+
+
+def packet_samples(data_packet_dir):
+    """Return the set of sample names in the packet metadata, empty if it has none."""
+    path = find_table(join(data_packet_dir, METADATA_TABLE))
+    if path is None:
+        return set()
+    with open_table(path) as f:
+        header = f.readline()
+        column = sample_column(header)
+        return {sample_id(line, column) for line in f}
+
+
+class PacketManifest:
+    """The layout of each table in a data packet, kept in `packet_manifest.json`.
+
+    Layouts are detected once per version of a table, identified by its
+    size and modification time, and reused until the table, the known
+    samples it was detected with or DETECTOR_VERSION change.
+    """
+
+    def __init__(self, data_packet_dir):
+        self.data_packet_dir = data_packet_dir
+        self.path = join(data_packet_dir, MANIFEST_FILENAME)
+        self.tables = {}
+        if isfile(self.path):
+            with open(self.path) as f:
+                self.tables = json.load(f)
+
+    def layout(self, source_file, known_samples):
+        """Return the layout of a table, detecting it if the table is new or changed."""
+        name = relpath(source_file, self.data_packet_dir)
+        info = stat(source_file)
+        version = {
+            'size': info.st_size,
+            'mtime_ns': info.st_mtime_ns,
+            'samples': samples_hash(known_samples),
+            'detector': DETECTOR_VERSION,
+        }
+        entry = self.tables.get(name)
+        if entry is None or entry.get('version') != version:
+            entry = {'version': version, 'layout': detect_layout(source_file, known_samples)}
+            self.tables[name] = entry
+        return entry['layout']
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.tables, f, indent=2, sort_keys=True)
+        replace(self.path + '.tmp', self.path)
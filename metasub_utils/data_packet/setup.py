@@ -25,4 +25,5 @@ setup(
     namespace_packages=['metasub_utils'],
     packages=[microlib_name],
     install_requires=requirements,
+    extras_require={'zstd': ['zstandard>=0.15']},
 )
@@ -0,0 +1,43 @@
+"""Test suite for cleaning release metadata."""
+
+import pandas as pd
+from unittest import TestCase
+
+from metasub_utils.data_packet.clean_metadata import clean_metadata_table
+
+
+def raw_metadata():
+    return pd.DataFrame({
+        'uuid': ['s1', 's2', 's3', 's4', 's5', 's6'],
+        'ha_id': ['h1', 'h1', '5080-CEM-0079', None, None, 'h2'],
+        'barcode': ['1', '2', '3', 'x235082297x', '5', '6'],
+        'metasub_name': ['CSD16-NYC-1', 'CSD16-NYC-2', 'a', 'b', 'Copan swab', 'c'],
+        'surface_material': ['Steel', 'wood', None, None, None, 'AIR'],
+        'city': ['antarctica', 'new_york', 'new_york', None, 'pos_control', 'oslo'],
+        'project': ['CSD16', 'CSD16', 'CSD17', 'CSD17', 'PILOT', 'CSD17_AIR'],
+        'control_type': [None, None, 'dry tube', 'poszymo', 'ctrl cities', None],
+        'coastal_city': ['yes', 'no', 'no', 'no', 'no', 'no'],
+        'city_elevation_meters': ['10', '2240', '10', None, '10', '10'],
+    }, dtype=object)
+
+
+class TestCleanMetadata(TestCase):
+    """Test suite for cleaning release metadata."""
+
+    def test_clean_metadata_table(self):
+        """Test that controls, places and duplicates are found."""
+        meta, cntrl_meta, dupe_meta, dupe_map = clean_metadata_table(raw_metadata())
+        self.assertEqual(list(meta['uuid']), ['s1', 's3', 's4', 's5'])
+        self.assertEqual(meta['city'].tolist()[0], 'honolulu')
+        self.assertEqual(meta['control_type_fine'].fillna('').tolist(), [
+            '', 'zymo_extraction_lab_water_negative_control',
+            'zymoshield_positive_control', 'background_control',
+        ])
+        self.assertEqual(list(cntrl_meta['uuid']), ['s3', 's4', 's5'])
+        self.assertEqual(cntrl_meta['control_type_coarse'].tolist(), [
+            'lab_negative_control', 'positive_control', 'background_control',
+        ])
+        self.assertEqual(meta['coastal'].tolist(), ['coastal'] + ['not_coastal'] * 3)
+        self.assertEqual(meta['city_elevation'].tolist(), ['coastal'] + ['low_altitude'] * 3)
+        self.assertEqual(list(dupe_meta['uuid']), ['s1', 's2'])
+        self.assertEqual(dupe_map.values.tolist(), [['s1', 's2', 'h1']])
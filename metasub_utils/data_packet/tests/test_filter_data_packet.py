@@ -0,0 +1,210 @@
+"""Test suite for filtering data packets."""
+
+from os import makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
+
+from metasub_utils.data_packet.filter_data_packet import PacketFilter, make_sub_packet
+from metasub_utils.data_packet.compression import GZIP, ZSTD, open_table, zstandard
+from metasub_utils.data_packet.packet_manifest import (
+    PacketManifest, COLUMNS, ROWS, detect_layout,
+)
+
+TAXA_TABLE = (
+    ',Escherichia coli,"Homo sapiens, reference"\n'
+    'sample_1,1,2\n'
+    'sample_10,3,4\n'
+    '"sample_2",5,"6"\n'
+)
+MASH_TABLE = (
+    'hmp_sample,sample_name,jaccard\n'
+    'sample_1_hmp,sample_2,0.1\n'
+    'sample_2_hmp,sample_1,0.2\n'
+)
+
+WIDE_TABLE = (
+    'taxon,rank,sample_1,sample_10,sample_2\n'
+    'Escherichia coli,species,1,2,3\n'
+    '"Homo sapiens, reference",species,4,5,6\n'
+)
+MULTI_HEADER_TABLE = (
+    ',Escherichia coli,Homo sapiens\n'
+    'kingdom,bacteria,eukaryota\n'
+    'sample_10,7,8\n'
+    'sample_1,1,2\n'
+)
+
+
+def make_packet(packet_dir):
+    for sub_dir, filename, contents in [
+        ('taxonomy', 'species.csv', TAXA_TABLE),
+        ('taxonomy', 'wide.csv', WIDE_TABLE),
+        ('taxonomy', 'multi_header.csv', MULTI_HEADER_TABLE),
+        ('other', 'mash.csv', MASH_TABLE),
+        ('metadata', 'complete_metadata.csv', 'uuid,city\nsample_1,oslo\nsample_2,paris\n'),
+    ]:
+        makedirs(join(packet_dir, sub_dir), exist_ok=True)
+        with open(join(packet_dir, sub_dir, filename), 'w') as f:
+            f.write(contents)
+
+
+def read(path):
+    with open_table(path) as f:
+        return f.read()
+
+
+class TestFilterDataPacket(TestCase):
+    """Test suite for filtering data packets."""
+
+    def test_exact_sample_match(self):
+        """Test that rows are kept only if their sample ID column matches exactly."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            sub_packet_dir = join(packet_dir, 'sub')
+            make_sub_packet(sub_packet_dir, ['sample_1'], data_packet_dir=packet_dir)
+            self.assertEqual(
+                read(join(sub_packet_dir, 'taxonomy', 'species.csv')),
+                ',Escherichia coli,"Homo sapiens, reference"\nsample_1,1,2\n'
+            )
+            self.assertEqual(
+                read(join(sub_packet_dir, 'other', 'mash.csv')),
+                'hmp_sample,sample_name,jaccard\nsample_2_hmp,sample_1,0.2\n'
+            )
+
+    def test_many_sub_packets(self):
+        """Test that every sub packet is written from one pass over each table."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            packet_filter = PacketFilter(data_packet_dir=packet_dir)
+            packet_filter.add_sub_packet(join(packet_dir, 'a'), ['sample_1', 'sample_2'])
+            packet_filter.add_sub_packet(
+                join(packet_dir, 'b'), ['sample_2'], copy_metadata=False
+            )
+            packet_filter.run()
+            self.assertEqual(
+                read(join(packet_dir, 'a', 'taxonomy', 'species.csv')),
+                ',Escherichia coli,"Homo sapiens, reference"\nsample_1,1,2\n"sample_2",5,"6"\n'
+            )
+            self.assertEqual(
+                read(join(packet_dir, 'b', 'taxonomy', 'species.csv')),
+                ',Escherichia coli,"Homo sapiens, reference"\n"sample_2",5,"6"\n'
+            )
+            self.assertEqual(
+                read(join(packet_dir, 'a', 'metadata', 'complete_metadata.csv')),
+                'uuid,city\nsample_1,oslo\nsample_2,paris\n'
+            )
+            with self.assertRaises(FileNotFoundError):
+                read(join(packet_dir, 'b', 'metadata', 'complete_metadata.csv'))
+
+    def test_wide_tables(self):
+        """Test that tables with samples as columns are subset by column."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            sub_packet_dir = join(packet_dir, 'sub')
+            make_sub_packet(sub_packet_dir, ['sample_1', 'sample_2'], data_packet_dir=packet_dir)
+            self.assertEqual(
+                read(join(sub_packet_dir, 'taxonomy', 'wide.csv')),
+                'taxon,rank,sample_1,sample_2\n'
+                'Escherichia coli,species,1,3\n'
+                '"Homo sapiens, reference",species,4,6\n'
+            )
+            self.assertEqual(
+                read(join(sub_packet_dir, 'taxonomy', 'multi_header.csv')),
+                ',Escherichia coli,Homo sapiens\nkingdom,bacteria,eukaryota\nsample_1,1,2\n'
+            )
+            manifest = PacketManifest(packet_dir)
+            self.assertEqual(manifest.tables['taxonomy/wide.csv']['layout'], {
+                'orientation': COLUMNS, 'first_sample_column': 2,
+            })
+            self.assertEqual(manifest.tables['taxonomy/multi_header.csv']['layout'], {
+                'orientation': ROWS, 'sample_column': 0, 'header_lines': 2,
+            })
+
+    def test_header_lines(self):
+        """Test that rows of text are only header lines when shaped and placed like them."""
+        with TemporaryDirectory() as packet_dir:
+            path = join(packet_dir, 'table.csv')
+            for contents, header_lines in [
+                (MULTI_HEADER_TABLE, 2),
+                ('uuid,city\nsample_9,oslo\nsample_1,paris\n', 1),
+                (',city,n\nsample_9,oslo,n/a\nsample_1,paris\n', 1),
+                (',city\nsample_9,oslo\nsample_8,paris\n', 1),
+            ]:
+                with open(path, 'w') as f:
+                    f.write(contents)
+                self.assertEqual(detect_layout(path, {'sample_1'}), {
+                    'orientation': ROWS, 'sample_column': 0, 'header_lines': header_lines,
+                })
+
+    def test_manifest_known_samples(self):
+        """Test that a recorded layout is detected again when the known samples change."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            path = join(packet_dir, 'taxonomy', 'wide.csv')
+            manifest = PacketManifest(packet_dir)
+            self.assertEqual(manifest.layout(path, set())['orientation'], ROWS)
+            self.assertEqual(manifest.layout(path, {'sample_1'})['orientation'], COLUMNS)
+
+    def test_parallel_jobs(self):
+        """Test that tables filtered across processes match those filtered in order."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            records = make_sub_packet(
+                join(packet_dir, 'serial'), ['sample_2'], data_packet_dir=packet_dir
+            )
+            self.assertEqual(len(records), 5)
+            make_sub_packet(
+                join(packet_dir, 'parallel'), ['sample_2'], data_packet_dir=packet_dir, jobs=3
+            )
+            for record in records:
+                self.assertEqual(
+                    read(join(packet_dir, 'serial', record['table'])),
+                    read(join(packet_dir, 'parallel', record['table'])),
+                )
+
+    def compressed_round_trip(self, compression, suffix):
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            make_sub_packet(join(packet_dir, 'plain'), ['sample_1'], data_packet_dir=packet_dir)
+            make_sub_packet(
+                join(packet_dir, 'compressed'), ['sample_1'], data_packet_dir=packet_dir,
+                compress=compression,
+            )
+            make_sub_packet(
+                join(packet_dir, 'from_compressed'), ['sample_1'],
+                data_packet_dir=join(packet_dir, 'compressed'),
+            )
+            for table in ['taxonomy/species.csv', 'taxonomy/wide.csv', 'other/mash.csv']:
+                expected = read(join(packet_dir, 'plain', table))
+                self.assertEqual(read(join(packet_dir, 'compressed', table + suffix)), expected)
+                self.assertEqual(
+                    read(join(packet_dir, 'from_compressed', table + suffix)), expected
+                )
+
+    def test_plain_and_compressed_copies(self):
+        """Test that a table kept plain and compressed is filtered once, from the plain copy."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            with open_table(join(packet_dir, 'taxonomy', 'species.csv.gz'), 'w') as f:
+                f.write(',Escherichia coli\nsample_1,9\n')
+            records = make_sub_packet(
+                join(packet_dir, 'sub'), ['sample_1'], data_packet_dir=packet_dir,
+                compress=GZIP, jobs=2,
+            )
+            tables = [record['table'] for record in records]
+            self.assertEqual(tables.count('taxonomy/species.csv'), 1)
+            self.assertNotIn('taxonomy/species.csv.gz', tables)
+            self.assertEqual(
+                read(join(packet_dir, 'sub', 'taxonomy', 'species.csv.gz')),
+                ',Escherichia coli,"Homo sapiens, reference"\nsample_1,1,2\n'
+            )
+
+    def test_gzip(self):
+        """Test that packets are written gzip compressed and filtered from gzip tables."""
+        self.compressed_round_trip(GZIP, '.gz')
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        """Test that packets are written zstd compressed and filtered from zstd tables."""
+        self.compressed_round_trip(ZSTD, '.zst')
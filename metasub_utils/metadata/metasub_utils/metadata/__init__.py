@@ -4,4 +4,7 @@ from .metadata import (
     get_canonical_city_names,
     get_samples_from_city,
     normalize_sample_name,
+    SampleNameResolver,
+    get_sample_name_resolver,
 )
+from .cache import MetadataCache, MetadataUnavailable, DEFAULT_CACHE
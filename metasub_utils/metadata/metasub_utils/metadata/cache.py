@@ -0,0 +1,162 @@
+"""Local cache of the metadata tables."""
+
+import json
+import pandas as pd
+from hashlib import sha1
+from io import BytesIO
+from os import close, makedirs, replace
+from os.path import join, isfile
+from sys import stderr
+from tempfile import mkstemp
+from time import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from .constants import CACHE_DIR, CACHE_TTL, OFFLINE
+
+try:
+    import pyarrow  # noqa: F401
+    BINARY_FORMAT = 'parquet'
+except ImportError:
+    BINARY_FORMAT = 'pickle'
+
+
+class MetadataUnavailable(Exception):
+    """Raised when a table is neither cached nor downloadable."""
+
+
+def categorize(tbl, max_fraction=0.5):
+    """Convert text columns with few distinct values to categoricals, in place."""
+    for column in tbl.columns:
+        if tbl[column].dtype.kind in 'OU' or pd.api.types.is_string_dtype(tbl[column]):
+            if tbl[column].nunique() <= max_fraction * len(tbl):
+                tbl[column] = tbl[column].astype('category')
+    return tbl
+
+
+def decategorize(tbl):
+    """Return a copy of tbl with categorical columns converted back to their categories' type."""
+    return tbl.astype({
+        column: tbl[column].cat.categories.dtype
+        for column in tbl.columns
+        if isinstance(tbl[column].dtype, pd.CategoricalDtype)
+    })
+
+
+class MetadataCache:
+    """Keep parsed copies of the metadata tables in a local directory.
+
+    Each table is stored in a binary form (parquet, or a pickle if pyarrow
+    is not installed) with low cardinality columns as categoricals. Beside
+    it a small JSON file records the ETag of the version downloaded and
+    when it was last checked. Copies checked less than `ttl` seconds ago
+    are used as they are, older ones are revalidated with a conditional
+    request and only downloaded again if the table has changed. Offline,
+    the cached copy is always used. Tables are also kept in memory so
+    repeated calls in one process are free.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, offline=OFFLINE, timeout=30):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        self.timeout = timeout
+        self.memo = {}
+
+    def paths(self, url):
+        """Return the paths of the table and info files for url."""
+        name = sha1(url.encode()).hexdigest()[:16]
+        return join(self.cache_dir, f'{name}.{BINARY_FORMAT}'), join(self.cache_dir, f'{name}.json')
+
+    def info(self, url):
+        """Return the info recorded for the cached copy of url or None."""
+        table_path, info_path = self.paths(url)
+        if not (isfile(table_path) and isfile(info_path)):
+            return None
+        with open(info_path) as f:
+            return json.load(f)
+
+    def is_fresh(self, info):
+        return self.offline or time() - info['checked_at'] < self.ttl
+
+    def get(self, url, index_col=0, refresh=False):
+        """Return the table at url. Do not modify it, it is shared with later callers."""
+        if not refresh and url in self.memo:
+            info, tbl = self.memo[url]
+            if self.is_fresh(info):
+                return tbl
+        info = self.info(url)
+        if info and not refresh and self.is_fresh(info):
+            tbl = self._read(self.paths(url)[0])
+        elif self.offline:
+            raise MetadataUnavailable(f'{url} is not cached and offline mode is on')
+        else:
+            tbl, info = self._revalidate(url, info, index_col)
+        self.memo[url] = (info, tbl)
+        return tbl
+
+    def _revalidate(self, url, info, index_col):
+        """Download url unless it still has the cached ETag. Return the table and its info."""
+        table_path, info_path = self.paths(url)
+        headers = {'If-None-Match': info['etag']} if info and info.get('etag') else {}
+        try:
+            with urlopen(Request(url, headers=headers), timeout=self.timeout) as response:
+                body, etag = response.read(), response.headers.get('ETag')
+        except HTTPError as exc:
+            if exc.code != 304:
+                return self._stale(url, info, exc)
+            body = None
+        except URLError as exc:
+            return self._stale(url, info, exc)
+
+        if body is None:
+            tbl = self._read(table_path)
+        else:
+            tbl = categorize(pd.read_csv(BytesIO(body), dtype=str, index_col=index_col))
+            makedirs(self.cache_dir, exist_ok=True)
+            self._write(tbl, table_path)
+            info = {
+                'url': url,
+                'etag': etag,
+                'sha1': sha1(body).hexdigest(),
+                'downloaded_at': time(),
+            }
+        info['checked_at'] = time()
+        tmp_path = self._tmp_path()
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        replace(tmp_path, info_path)
+        return tbl, info
+
+    def _stale(self, url, info, exc):
+        """Fall back on an old cached copy when url cannot be checked."""
+        if info is None:
+            raise MetadataUnavailable(f'Could not download {url}: {exc}') from exc
+        print(f'METADATA using cached copy of {url}: {exc}', file=stderr)
+        return self._read(self.paths(url)[0]), info
+
+    def _read(self, table_path):
+        if BINARY_FORMAT == 'parquet':
+            return pd.read_parquet(table_path)
+        return pd.read_pickle(table_path, compression=None)
+
+    def _tmp_path(self):
+        """Return a new temporary file in the cache, unique to this writer."""
+        fd, tmp_path = mkstemp(dir=self.cache_dir, suffix='.tmp')
+        close(fd)
+        return tmp_path
+
+    def _write(self, tbl, table_path):
+        tmp_path = self._tmp_path()
+        if BINARY_FORMAT == 'parquet':
+            tbl.to_parquet(tmp_path)
+        else:
+            tbl.to_pickle(tmp_path, compression=None)
+        replace(tmp_path, table_path)
+
+    def clear(self):
+        """Forget tables held in memory."""
+        self.memo = {}
+
+
+DEFAULT_CACHE = MetadataCache()
@@ -1,17 +1,23 @@
 """CLI for commands metadata commands."""
 
 import click
+from datetime import datetime
 
+from .cache import DEFAULT_CACHE
+from .constants import COMPLETE_TABLE_URL, UPLOADABLE_TABLE_URL, CANONICAL_CITIES_URL
 from .metadata import (
     get_canonical_city_names,
     get_complete_metadata,
     get_samples_from_city,
+    get_sample_name_resolver,
 )
 
 
 @click.group()
-def metadata():
-    pass
+@click.option('--offline/--online', default=DEFAULT_CACHE.offline,
+              help='Only use cached copies of the metadata tables.')
+def metadata(offline):
+    DEFAULT_CACHE.offline = offline
 
 
 @metadata.command('version')
@@ -43,3 +49,37 @@ def cli_get_samples_from_city(project_name, city_name):
     sample_names = get_samples_from_city(city_name, project_name=project_name)
     for sample_name in sample_names:
         click.echo(sample_name)
+
+
+@metadata.command('normalize-names')
+@click.option('--keep-unknown/--blank-unknown', default=False,
+              help='Print names with no match unchanged instead of leaving them blank.')
+@click.argument('names', type=click.File('r'))
+def cli_normalize_names(keep_unknown, names):
+    """Print each name in NAMES (one per line) and its canonical sample name."""
+    names = [line.strip() for line in names if line.strip()]
+    normalized = get_sample_name_resolver().resolve_many(names)
+    n_unknown = 0
+    for name, canonical in zip(names, normalized):
+        if canonical is None:
+            n_unknown += 1
+            canonical = name if keep_unknown else ''
+        click.echo(f'{name}\t{canonical}')
+    click.echo(f'{n_unknown} of {len(names)} names could not be normalized', err=True)
+
+
+@metadata.command('cache')
+@click.option('--refresh/--no-refresh', default=False,
+              help='Check for new versions of the tables now.')
+def cli_cache(refresh):
+    """Print the version of each cached metadata table."""
+    for url in [COMPLETE_TABLE_URL, UPLOADABLE_TABLE_URL, CANONICAL_CITIES_URL]:
+        if refresh:
+            DEFAULT_CACHE.get(url, index_col=None if url == CANONICAL_CITIES_URL else 0,
+                              refresh=True)
+        info = DEFAULT_CACHE.info(url)
+        if info is None:
+            click.echo(f'{url}\tnot cached')
+            continue
+        checked_at = datetime.fromtimestamp(info['checked_at']).isoformat(timespec='seconds')
+        click.echo(f'{url}\t{info["etag"]}\t{info["sha1"]}\tchecked {checked_at}')
@@ -1,9 +1,16 @@
 """Constants for working with MetaSUB Metadata."""
 
+from os import environ
+from os.path import expanduser, join
+
 COMPLETE_TABLE_URL = 'https://raw.githubusercontent.com/dcdanko/MetaSUB-metadata/master/complete_metadata.csv'
 UPLOADABLE_TABLE_URL = 'https://raw.githubusercontent.com/dcdanko/MetaSUB-metadata/master/upload_metadata.csv'
 CANONICAL_CITIES_URL = 'https://raw.githubusercontent.com/dcdanko/MetaSUB-metadata/master/spreadsheets/city_names.csv'
 
+CACHE_DIR = environ.get('METASUB_METADATA_CACHE', join(expanduser('~'), '.metasub', 'metadata'))
+CACHE_TTL = int(environ.get('METASUB_METADATA_TTL', 24 * 60 * 60))
+OFFLINE = environ.get('METASUB_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
 
 HAUID = 'hudson_alpha_uid'
 HA_ID = 'ha_id'
@@ -12,3 +19,4 @@ SL_NAME = 'sl_name'
 OTHER_PROJ_UID = 'other_project_uid'
 BC = 'barcode'
 IDS = set([HAUID, HA_ID, BC, METASUB_NAME, SL_NAME, OTHER_PROJ_UID])
+ID_COLUMNS = [HAUID, HA_ID, BC, METASUB_NAME, SL_NAME, OTHER_PROJ_UID]  # in order of precedence
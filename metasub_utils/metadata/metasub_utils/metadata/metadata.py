@@ -1,30 +1,83 @@
 """Functions for handling metadata."""
 
+import numpy as np
 import pandas as pd
 
-from .constants import UPLOADABLE_TABLE_URL, COMPLETE_TABLE_URL, CANONICAL_CITIES_URL, IDS
+from .cache import DEFAULT_CACHE, decategorize
+from .constants import (
+    UPLOADABLE_TABLE_URL,
+    COMPLETE_TABLE_URL,
+    CANONICAL_CITIES_URL,
+    ID_COLUMNS,
+)
+
+
+class SampleNameResolver:
+    """Map any ID of a sample to its canonical name.
+
+    Values of every ID column are put in one hash index pointing at the
+    index of the metadata table. Where an ID appears more than once the
+    earliest column in ID_COLUMNS, then the earliest row, wins.
+    """
+
+    def __init__(self, tbl=None):
+        tbl = get_complete_metadata(categorical=True) if tbl is None else tbl
+        ids = pd.concat([
+            tbl[id_type].dropna().astype(str) for id_type in ID_COLUMNS if id_type in tbl.columns
+        ])
+        lookup = pd.Series(ids.index, index=ids.values)
+        self.lookup = lookup[~lookup.index.duplicated()]
+        self.names = self.lookup.to_dict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def resolve(self, name, default=None):
+        """Return the canonical name for name or default."""
+        return self.names.get(name, default)
+
+    def resolve_many(self, names, default=None):
+        """Return a list of canonical names, or default, for each of names."""
+        positions = self.lookup.index.get_indexer(pd.Index(names, dtype=object))
+        canonical = self.lookup.to_numpy(dtype=object)[positions]
+        return list(np.where(positions >= 0, canonical, default))
+
+
+_default_resolver = (None, None)
+
+
+def get_sample_name_resolver():
+    """Return a SampleNameResolver for the complete metadata, rebuilt only when it changes."""
+    global _default_resolver
+    tbl = DEFAULT_CACHE.get(COMPLETE_TABLE_URL)
+    if _default_resolver[0] is not tbl:
+        _default_resolver = (tbl, SampleNameResolver(tbl))
+    return _default_resolver[1]
 
 
 def normalize_sample_name(name_in, default=None, tbl=None):
-    tbl = get_complete_metadata() if tbl is None else tbl
-    for id_type in IDS:
-        mytbl = tbl.query(f'{id_type} == "{name_in}"')
-        if mytbl.shape[0]:
-            return list(mytbl.index)[0]
-    return default
+    """Return the canonical name of a sample from any of its IDs, or default."""
+    resolver = get_sample_name_resolver() if tbl is None else SampleNameResolver(tbl)
+    return resolver.resolve(name_in, default=default)
+
 
+def get_complete_metadata(uploadable=False, categorical=False):
+    """Return the complete metadata file as a pandas dataframe.
 
-def get_complete_metadata(uploadable=False):
-    """Return the complete metadata file as a pandas dataframe."""
-    if uploadable:
-        return pd.read_csv(UPLOADABLE_TABLE_URL, dtype=str, index_col=0)
-    return pd.read_csv(COMPLETE_TABLE_URL, dtype=str, index_col=0)
+    The table is read from the local metadata cache, see MetadataCache.
+    If categorical is True low cardinality columns are left as categoricals.
+    """
+    tbl = DEFAULT_CACHE.get(UPLOADABLE_TABLE_URL if uploadable else COMPLETE_TABLE_URL)
+    return tbl.copy() if categorical else decategorize(tbl)
 
 
 def get_canonical_city_names(lower=False):
     """Return a set of canonical city names."""
-    city_tbl = pd.read_csv(CANONICAL_CITIES_URL, dtype=str)
-    city_names = set(city_tbl.ix[:, 0])
+    city_tbl = DEFAULT_CACHE.get(CANONICAL_CITIES_URL, index_col=None)
+    city_names = set(city_tbl.iloc[:, 0])
     if lower:
         city_names = {city_name.lower() for city_name in city_names}
     return city_names
@@ -35,7 +88,7 @@ def get_samples_from_city(city_name, project_name=None):
 
     If city_name is False return a list with all sample names.
     """
-    metadata = get_complete_metadata()
+    metadata = get_complete_metadata(categorical=True)
     filtered = metadata
     if city_name:
         city_name = city_name.lower()
@@ -1,12 +1,21 @@
 """Test suite for metadata."""
 
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import TemporaryDirectory
+from threading import Thread
 from unittest import TestCase
 
+import pandas as pd
+
 from metasub_utils.metadata import (
+    MetadataCache,
+    MetadataUnavailable,
+    SampleNameResolver,
     get_complete_metadata,
     get_samples_from_city,
     normalize_sample_name,
 )
+from metasub_utils.metadata.cache import decategorize
 
 
 class TestMetadata(TestCase):
@@ -36,3 +45,111 @@ class TestMetadata(TestCase):
     def test_normalize_sample_name(self):
         normed = normalize_sample_name('CSD16-DOH-066')
         self.assertEqual('haib17KIU4866_HMCMJCCXY_SL335923', normed)
+
+
+class TableHandler(BaseHTTPRequestHandler):
+    """Serve one CSV with an ETag, counting full downloads."""
+
+    body = b'uuid,city,barcode\ns1,paris,b1\ns2,paris,b2\ns3,oslo,b3\ns4,paris,b4\n'
+    downloads = 0
+
+    def do_GET(self):
+        etag = '"v1"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        TableHandler.downloads += 1
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMetadataCache(TestCase):
+    """Test suite for the local metadata cache."""
+
+    def setUp(self):
+        TableHandler.downloads = 0
+        self.server = HTTPServer(('localhost', 0), TableHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://localhost:{self.server.server_port}/complete_metadata.csv'
+
+    def tearDown(self):
+        self.stop_server()
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def test_cache_revalidate(self):
+        """Test that tables are downloaded once and revalidated after the ttl."""
+        with TemporaryDirectory() as cache_dir:
+            cache = MetadataCache(cache_dir=cache_dir, ttl=60)
+            tbl = cache.get(self.url)
+            self.assertEqual(list(tbl.index), ['s1', 's2', 's3', 's4'])
+            self.assertEqual(tbl['city'].dtype.name, 'category')
+            self.assertIs(cache.get(self.url), tbl)
+            self.assertEqual(MetadataCache(cache_dir=cache_dir).get(self.url).shape, (4, 2))
+            self.assertEqual(TableHandler.downloads, 1)
+
+            stale = MetadataCache(cache_dir=cache_dir, ttl=0)
+            self.assertEqual(stale.get(self.url).shape, (4, 2))
+            self.assertEqual(TableHandler.downloads, 1)
+            self.assertEqual(stale.info(self.url)['etag'], '"v1"')
+
+    def test_cache_tmp_files(self):
+        """Test that writing the cache leaves temporary files of other writers alone."""
+        with TemporaryDirectory() as cache_dir:
+            cache = MetadataCache(cache_dir=cache_dir)
+            cache.get(self.url)
+            table_path, info_path = cache.paths(self.url)
+            for path in [table_path, info_path]:
+                with open(path + '.tmp', 'w') as f:
+                    f.write('another writer')
+            MetadataCache(cache_dir=cache_dir, ttl=0).get(self.url)
+            for path in [table_path, info_path]:
+                with open(path + '.tmp') as f:
+                    self.assertEqual(f.read(), 'another writer')
+
+    def test_cache_offline(self):
+        """Test that cached tables are read offline and uncached ones are unavailable."""
+        with TemporaryDirectory() as cache_dir:
+            MetadataCache(cache_dir=cache_dir).get(self.url)
+            self.stop_server()
+            offline = MetadataCache(cache_dir=cache_dir, ttl=0, offline=True)
+            self.assertEqual(offline.get(self.url).shape, (4, 2))
+            with self.assertRaises(MetadataUnavailable):
+                offline.get(self.url + '?missing')
+
+    def test_decategorize(self):
+        """Test that categorical columns convert back to plain text."""
+        with TemporaryDirectory() as cache_dir:
+            tbl = decategorize(MetadataCache(cache_dir=cache_dir).get(self.url))
+            self.assertNotEqual(tbl['city'].dtype.name, 'category')
+            self.assertEqual(list(tbl['city']), ['paris', 'paris', 'oslo', 'paris'])
+
+
+class TestSampleNameResolver(TestCase):
+    """Test suite for resolving sample names."""
+
+    def test_resolve_many(self):
+        """Test that IDs from any column resolve and earlier columns take precedence."""
+        tbl = pd.DataFrame({
+            'hudson_alpha_uid': ['s1', 's2', None],
+            'barcode': ['b1', 'b2', 's1'],
+            'metasub_name': ['m1', None, 'm3'],
+        }, index=['s1', 's2', 's3'])
+        resolver = SampleNameResolver(tbl)
+        self.assertEqual(resolver.resolve('m3'), 's3')
+        self.assertEqual(resolver.resolve('s1'), 's1')
+        self.assertEqual(
+            resolver.resolve_many(['b2', 'missing', 'm1', 'b2']),
+            ['s2', None, 's1', 's2']
+        )
+        self.assertEqual(resolver.resolve_many(['missing'], default='x'), ['x'])
@@ -0,0 +1,84 @@
+"""CLI for cached tables and figures built from data packets."""
+
+import click
+from datetime import datetime
+from os.path import join
+from time import time
+
+from .derived_cache import DerivedTableCache, CACHE_DIRNAME, CACHE_BYTES, remove_legacy_caches
+
+
+@click.group('cache')
+def cache():
+    """Manage derived tables cached in a data packet."""
+    pass
+
+
+@cache.command('ls')
+@click.option('-p', '--packet-dir', default='.')
+def cli_cache_ls(packet_dir):
+    """List cached tables, most recently used first."""
+    entries = DerivedTableCache(join(packet_dir, CACHE_DIRNAME)).entries()
+    for entry in entries:
+        last_used = datetime.fromtimestamp(entry['last_used']).isoformat(timespec='seconds')
+        params = ','.join(f'{k}={v}' for k, v in sorted(entry.get('params', {}).items()))
+        click.echo(
+            f'{entry["key"][:16]}\t{entry.get("name")}\t{entry["size"] / 1e6:.1f}MB\t'
+            f'{last_used}\t{params}'
+        )
+    click.echo(f'{len(entries)} tables, {sum(e["size"] for e in entries) / 1e6:.1f}MB', err=True)
+
+
+@cache.command('gc')
+@click.option('-p', '--packet-dir', default='.')
+@click.option('-m', '--max-gb', default=CACHE_BYTES / 1024 ** 3,
+              help='Remove least recently used tables until the cache is this size.')
+@click.option('--legacy/--no-legacy', default=True,
+              help='Also remove taxa tables cached by older versions.')
+def cli_cache_gc(packet_dir, max_gb, legacy):
+    """Shrink the cache of derived tables."""
+    table_cache = DerivedTableCache(join(packet_dir, CACHE_DIRNAME))
+    removed = table_cache.gc(max_bytes=int(max_gb * 1024 ** 3))
+    for entry in removed:
+        click.echo(f'removed\t{entry["key"][:16]}\t{entry.get("name")}\t{entry["size"] / 1e6:.1f}MB')
+    if legacy:
+        for path in remove_legacy_caches(packet_dir):
+            click.echo(f'removed\t{path}')
+
+
+@click.group('figures')
+def figures():
+    """Build the MetaSUB paper figures from a data packet."""
+    pass
+
+
+@figures.command('build')
+@click.option('-p', '--packet-dir', default='.')
+@click.option('-o', '--out-dir', default='figures')
+@click.option('-j', '--jobs', default=1, help='Number of panels to draw at once.')
+@click.option('--force/--no-force', default=False, help='Draw panels even if unchanged.')
+@click.option('--panel', multiple=True, help='Only build these panels. May be repeated.')
+def cli_figures_build(packet_dir, out_dir, jobs, force, panel):
+    """Draw every panel whose code or input tables changed since the last build."""
+    from .figs import MetaSUBFigures
+    from .figure_build import FigureBuild, PANELS
+
+    unknown = set(panel) - set(PANELS)
+    if unknown:
+        raise click.BadParameter(f'Unknown panels: {", ".join(sorted(unknown))}', param_hint='--panel')
+    panels = {name: tables for name, tables in PANELS.items() if not panel or name in panel}
+
+    def echo_record(record):
+        click.echo(
+            f'{record["kind"]}\t{record["name"]}\t{record["status"]}\t{record["seconds"]:.1f}s'
+            + (f'\t{record["error"]}' if 'error' in record else ''),
+            err=True,
+        )
+
+    start = time()
+    build = FigureBuild(MetaSUBFigures(packet_dir), out_dir, panels=panels, jobs=jobs, force=force)
+    records = build.run(callback=echo_record)
+    failed = [record['name'] for record in records if record['status'] == 'failed']
+    click.echo(f'Built figures in {time() - start:.1f}s, {len(failed)} panels failed', err=True)
+    if failed:
+        raise click.ClickException(f'Failed panels: {", ".join(failed)}')
@@ -0,0 +1,73 @@
+"""Group the columns of a table which are strongly correlated with each other."""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def sparse_correlation(tbl, threshold, block_size=1024):
+    """Return the Pearson correlations between columns of tbl which are at least threshold.
+
+    Correlations are computed `block_size` columns at a time so the dense
+    correlation matrix is never held, only the entries over the threshold,
+    as a sparse matrix. Constant columns correlate with nothing.
+    """
+    values = tbl.to_numpy(dtype=float)
+    values = values - values.mean(axis=0)
+    norms = np.sqrt((values ** 2).sum(axis=0))
+    constant = norms == 0
+    norms[constant] = 1
+    values = values / norms
+    values[:, constant] = 0
+    n_cols = values.shape[1]
+    rows, cols, data = [], [], []
+    for start in range(0, n_cols, block_size):
+        block = values[:, start:start + block_size].T @ values
+        block_rows, block_cols = np.nonzero(block >= threshold)
+        rows.append(block_rows + start)
+        cols.append(block_cols)
+        data.append(block[block_rows, block_cols])
+    return coo_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_cols, n_cols),
+    ).tocsr()
+
+
+def correlated_groups(tbl, threshold):
+    """Return arrays of the positions of columns of tbl connected by correlations >= threshold.
+
+    Groups of one column are left out. Groups are ordered by their first
+    column, as networkx orders the components of a graph built from the
+    melted correlation matrix.
+    """
+    n_groups, labels = connected_components(
+        sparse_correlation(tbl, threshold), directed=False
+    )
+    sizes = np.bincount(labels, minlength=n_groups)
+    first = np.full(n_groups, len(labels))
+    np.minimum.at(first, labels, np.arange(len(labels)))
+    positions = np.argsort(labels, kind='stable')
+    members = np.split(positions, np.cumsum(sizes)[:-1])
+    return [members[group] for group in np.argsort(first) if sizes[group] > 1]
+
+
+def collapse_groups(tbl, groups, names):
+    """Replace each group of columns of tbl by one column, called from names, of their sum.
+
+    The sums are one product with a sparse membership matrix. Columns not
+    in a group keep their order and the new columns are added after them.
+    """
+    n_cols = tbl.shape[1]
+    group_ids = np.concatenate([np.full(len(group), i) for i, group in enumerate(groups)] + [[]])
+    grouped = np.concatenate(list(groups) + [[]]).astype(int)
+    membership = csr_matrix(
+        (np.ones(len(grouped)), (grouped, group_ids.astype(int))), shape=(n_cols, len(groups))
+    )
+    summed = membership.T.dot(tbl.to_numpy(dtype=float).T).T
+    keep = np.ones(n_cols, dtype=bool)
+    keep[grouped] = False
+    return pd.concat([
+        tbl.iloc[:, keep],
+        pd.DataFrame(summed, index=tbl.index, columns=names),
+    ], axis=1)
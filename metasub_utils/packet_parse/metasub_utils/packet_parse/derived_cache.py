@@ -0,0 +1,145 @@
+"""Content addressed, size bounded cache of tables derived from a data packet."""
+
+import hashlib
+import json
+from glob import glob
+from os import environ, makedirs, remove, stat, utime, walk
+from os.path import join, isdir, isfile, basename, relpath
+from time import time
+
+import pandas as pd
+
+from .taxa_cache import cache_paths, has_table, save_table, load_table, load_info
+
+CACHE_DIRNAME = 'derived_table_cache'
+CACHE_BYTES = int(environ.get('METASUB_PACKET_CACHE_BYTES', 20 * 1024 ** 3))
+LEGACY_CACHE_GLOB = 'taxonomy/*_cached_taxa_table.*'
+TMP_GRACE_SECONDS = 24 * 60 * 60  # temporary files older than this are left from failed writes
+
+
+def sample_hash(index):
+    """Return a hash of the sample names in index, cheap even for large indices."""
+    hashes = pd.util.hash_pandas_object(pd.Index(index).astype(str), index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def fingerprint(packet_dir, sources):
+    """Return (path, size, mtime) for every file under the packet relative paths in sources.
+
+    The derived table cache and old cache files are left out.
+    """
+    legacy = set(glob(join(packet_dir, LEGACY_CACHE_GLOB)))
+    paths = []
+    for source in sources:
+        path = join(packet_dir, source)
+        if isdir(path):
+            for dirpath, dirnames, filenames in walk(path):
+                dirnames[:] = sorted(name for name in dirnames if name != CACHE_DIRNAME)
+                paths += [join(dirpath, filename) for filename in sorted(filenames)]
+        elif isfile(path):
+            paths.append(path)
+    out = []
+    for path in paths:
+        if path in legacy:
+            continue
+        info = stat(path)
+        out.append((relpath(path, packet_dir), info.st_size, info.st_mtime_ns))
+    return out
+
+
+class DerivedTableCache:
+    """Store derived tables under keys hashed from everything they depend on.
+
+    A key covers the name of the table, a hash of the sample index, the
+    size and modification time of its source files and the parameters it
+    was built with, so any change to these misses the cache instead of
+    returning a stale table. Tables are stored with taxa_cache and loaded
+    memory mapped. Once the store holds more than `max_bytes` the least
+    recently used tables are removed.
+    """
+
+    def __init__(self, cache_dir, max_bytes=CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(name, samples, sources, params):
+        blob = json.dumps(
+            {'name': name, 'samples': samples, 'sources': sources, 'params': params},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def prefix(self, key):
+        return join(self.cache_dir, key)
+
+    def get(self, key):
+        """Return the table stored under key, or None, and mark it as recently used."""
+        prefix = self.prefix(key)
+        if not has_table(prefix):
+            return None
+        utime(cache_paths(prefix)[1])
+        return load_table(prefix)
+
+    def put(self, key, tbl, name=None, params=None):
+        """Store tbl under key, evict old tables if over budget and return the stored table."""
+        makedirs(self.cache_dir, exist_ok=True)
+        prefix = self.prefix(key)
+        save_table(tbl, prefix, info={
+            'name': name,
+            'params': {k: str(v) for k, v in (params or {}).items()},
+            'created': time(),
+        })
+        self.gc(keep=key)
+        return load_table(prefix)
+
+    def entries(self):
+        """Return a list of dicts describing each stored table, most recently used first."""
+        entries = []
+        for labels_path in glob(join(self.cache_dir, '*.json')):
+            key = basename(labels_path)[:-len('.json')]
+            prefix = self.prefix(key)
+            if not has_table(prefix):
+                continue
+            entries.append(dict(
+                load_info(prefix),
+                key=key,
+                size=sum(stat(path).st_size for path in cache_paths(prefix)),
+                last_used=stat(labels_path).st_mtime,
+            ))
+        return sorted(entries, key=lambda entry: -entry['last_used'])
+
+    def gc(self, max_bytes=None, keep=None):
+        """Remove least recently used tables until the store fits max_bytes. Return them.
+
+        Temporary files of failed writes are removed once older than
+        TMP_GRACE_SECONDS, younger ones may belong to a concurrent writer.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        for tmp_path in glob(join(self.cache_dir, '*.tmp')):
+            try:
+                if stat(tmp_path).st_mtime < time() - TMP_GRACE_SECONDS:
+                    remove(tmp_path)
+            except FileNotFoundError:
+                pass
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        removed = []
+        for entry in reversed(entries):
+            if total <= max_bytes:
+                break
+            if entry['key'] == keep:
+                continue
+            for path in cache_paths(self.prefix(entry['key'])):
+                remove(path)
+            total -= entry['size']
+            removed.append(entry)
+        return removed
+
+
+def remove_legacy_caches(packet_dir):
+    """Remove taxa tables cached by older versions, keyed on the metadata. Return their paths."""
+    paths = glob(join(packet_dir, LEGACY_CACHE_GLOB))
+    for path in paths:
+        remove(path)
+    return paths
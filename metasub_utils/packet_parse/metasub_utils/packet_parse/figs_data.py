@@ -23,6 +23,9 @@ from matplotlib import pyplot as plt
 
 from capalyzer.constants import MICROBE_DIR
 
+from .coabundance import correlated_groups, collapse_groups
+from .table_memo import TableMemo, memoized_table, MEMO_BYTES
+
 
 def to_title(el):
     sel = str(el)
@@ -34,8 +37,13 @@ def to_title(el):
 
 
 class MetaSUBFiguresData:
+    """Tables behind the MetaSUB figures.
+
+    Derived tables such as `wide_taxa` are built on first use and held in
+    a TableMemo of at most `memo_bytes`, see `invalidate`.
+    """
 
-    def __init__(self, packet_dir, ncbi_tree=None):
+    def __init__(self, packet_dir, ncbi_tree=None, memo_bytes=MEMO_BYTES):
         self.tabler = DataTableFactory(packet_dir, metadata_tbl='metadata/complete_metadata.csv')
         self.tabler.metadata = add_ontology(self.tabler.metadata)
         self.tabler.metadata['continent'] = pd.Categorical(
@@ -54,6 +62,7 @@ class MetaSUBFiguresData:
         self.tabler.metadata['city'] = self.tabler.metadata['city'].amp(to_title)
         self.meta = self.tabler.metadata
         self._ncbi_tree = ncbi_tree
+        self.table_memo = TableMemo(max_bytes=memo_bytes)
 
     @property
     def ncbi_tree(self):
@@ -61,46 +70,49 @@ class MetaSUBFiguresData:
             self._ncbi_tree = NCBITaxaTree.parse_files()
         return self._ncbi_tree
 
-    @property
+    @memoized_table
     def wide_taxa(self):
         return self.build_wide_taxonomy()
 
-    @property
+    @memoized_table
     def wide_taxa_rel(self):
         return proportions(self.wide_taxa)
 
-    @property
+    @memoized_table
     def wide_phyla(self):
         return self.tabler.taxonomy(rank='phylum')
 
-    @property
+    @memoized_table
     def wide_phyla_rel(self):
         return proportions(self.wide_phyla)
 
-    @property
+    @memoized_table
     def function_groups(self):
         return self.build_functional_groups()
 
-    @property
+    @memoized_table
     def amrs(self):
         return self.build_amrs()
 
-    @property
+    @memoized_table
     def amr_genes(self):
         return self.build_amr_genes()
 
-    @property
+    @memoized_table
     def emp(self):
         return self.build_soil_comparison()
 
-    @property
+    @memoized_table
     def hmp(self):
         return self.build_hmp_comparison()
 
-    @property
+    @memoized_table
     def rps(self):
         return self.build_rps()
-    
+
+    def invalidate(self, name=None):
+        """Drop a memoized table, e.g. 'wide_taxa', or all of them, so they are rebuilt."""
+        self.table_memo.invalidate(name)
 
     def build_soil_comparison(self):
         emp = pd.read_csv(
@@ -133,39 +145,8 @@ class MetaSUBFiguresData:
     def build_functional_groups(self):
         paths = self.tabler.pathways()
         mypaths = paths[[el for el in paths.columns if 'unclassified' not in el and 'UNINTEG' not in el]]
-        co = mypaths.corr()
-        co['path_1'] = co.index
-        co = co.melt(id_vars=['path_1'])
-        co.columns = ['path_1', 'path_2', 'value']
-        co = co.query('value > = 0.75')
-
-        def wordcloud(paths):
-            tbl = {}
-            for path in paths:
-                for word in path.split():
-                    tbl[word] = 1 + tbl.get(word, 0)
-            otbl = sorted([(k, v) for k, v in tbl.items()], key=lambda x: -x[1])
-            tbl = [k for k, v in otbl if v > 1]
-            tbl = [k for k in tbl if len(k) > 3 and 'PWY' not in k]
-            if len(tbl) < 3:
-                tbl = [k for k, _ in otbl if 'PWY' not in k]
-            return tbl[:10]
-
-        G = nx.Graph()
-        for _, row in co.iterrows():
-            G.add_edge(row['path_1'], row['path_2'])
-
-        n, p = 0, 0
-        comps = [comp for comp in nx.connected_components(G) if len(comp) > 1]
-        wcs = {f'COMP_{i}': (comp, wordcloud(comp)) for i, comp in enumerate(comps)}
-        for name, (comp, wc) in wcs.items():
-            if len(comp) == 1:
-                continue
-            n += 1
-            p += len(comp)
-            these_paths = mypaths[comp].sum(axis=1)
-            mypaths = mypaths.drop(columns=comp)
-            mypaths[name] = these_paths
+        groups = correlated_groups(mypaths, 0.75)
+        mypaths = collapse_groups(mypaths, groups, [f'COMP_{i}' for i in range(len(groups))])
 
         mypaths = (mypaths.T / mypaths.T.sum()).T.dropna()
         low_abundance_paths = mypaths.columns[mypaths.mean() < 0.01]
@@ -0,0 +1,222 @@
+"""Render figure panels to disk, skipping panels whose inputs and code are unchanged."""
+
+import hashlib
+import inspect
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from os import makedirs, replace
+from os.path import join, isfile
+from time import time
+
+import pandas as pd
+
+MANIFEST_FILENAME = 'figures_manifest.json'
+
+# Panels of MetaSUBFigures and the tables each is drawn from
+PANELS = {
+    'tbl1': ['meta'],
+    'fig1_prevalence_curve': ['wide_taxa', 'meta'],
+    'fig1_major_taxa_curves': ['wide_taxa_rel', 'meta'],
+    'fig1_species_rarefaction': ['wide_taxa'],
+    'fig1_reference_comparisons': ['emp', 'hmp'],
+    'fig1_fraction_unclassified': ['rps'],
+    'fig2_umap': ['wide_taxa', 'meta'],
+    'fig2_pca_flows': ['wide_taxa_rel', 'meta'],
+    'fig2_region_blocks': ['wide_phyla_rel', 'function_groups', 'amrs', 'meta'],
+    'fig5_amr_cooccur': ['amr_genes', 'amrs'],
+    'fig5_amr_richness_by_city': ['amr_genes', 'meta'],
+    'fig5_amr_rarefaction': ['amr_genes'],
+}
+
+
+def table_hash(tbl):
+    """Return a hash of the values and labels of a table."""
+    try:
+        values = pd.util.hash_pandas_object(tbl, index=True).to_numpy().tobytes()
+    except TypeError:  # unhashable cells, e.g. lists
+        values = tbl.to_json().encode()
+    columns = json.dumps([str(col) for col in getattr(tbl, 'columns', [])]).encode()
+    return hashlib.sha256(values + columns).hexdigest()
+
+
+def code_modules(figures):
+    """Return the modules whose code a figures object draws its panels with, by name.
+
+    These are the modules of every class it inherits from, so of the data
+    building methods of MetaSUBFiguresData as well as the panels, and the
+    modules of their own package they import helpers from.
+    """
+    modules = {}
+    for cls in type(figures).__mro__[:-1]:  # all but object
+        module = inspect.getmodule(cls)
+        if module is None:
+            continue
+        modules[module.__name__] = module
+        package = module.__name__.rpartition('.')[0]
+        for value in vars(module).values():
+            helper = inspect.getmodule(value)
+            if helper is not None and package and helper.__name__.startswith(package + '.'):
+                modules[helper.__name__] = helper
+    return modules
+
+
+def code_hash(figures):
+    """Return a hash of the source of the code_modules of a figures object."""
+    modules = code_modules(figures)
+    sources = [inspect.getsource(modules[name]) for name in sorted(modules)]
+    return hashlib.sha256(json.dumps(sources).encode()).hexdigest()
+
+
+def panel_hash(figures, name, table_hashes, panels=PANELS, code=None):
+    """Return a hash of the code a panel is drawn with and of the tables it is drawn from.
+
+    The code is the panel method and every module in code_modules, whose
+    hash may be passed as `code` to compute it once for many panels.
+    """
+    blob = json.dumps({
+        'panel': inspect.getsource(getattr(type(figures), name)),
+        'code': code_hash(figures) if code is None else code,
+        'tables': {table: table_hashes[table] for table in panels[name]},
+    }, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def save_panel(panel, prefix):
+    """Write a panel, or each of a list of panels, to files starting with prefix. Return their paths."""
+    if panel is None:
+        return []
+    if isinstance(panel, (list, tuple)):
+        paths = []
+        for i, sub_panel in enumerate(panel):
+            paths += save_panel(sub_panel, f'{prefix}_{i}')
+        return paths
+    if isinstance(panel, pd.DataFrame):
+        path = prefix + '.csv'
+        panel.to_csv(path)
+    elif hasattr(panel, 'save'):  # plotnine
+        path = prefix + '.png'
+        panel.save(path, verbose=False)
+    else:  # seaborn grids and matplotlib figures
+        path = prefix + '.png'
+        panel.savefig(path)
+    return [path]
+
+
+_FIGURES = None
+
+
+def _set_figures(figures):
+    global _FIGURES
+    _FIGURES = figures
+
+
+def render_panel(name, out_dir):
+    """Draw and save one panel of the figures set by _set_figures. Return (name, paths, seconds)."""
+    start = time()
+    paths = save_panel(getattr(_FIGURES, name)(), join(out_dir, name))
+    return name, paths, time() - start
+
+
+class FigureBuild:
+    """Render the panels of a figures object to `out_dir`.
+
+    Each panel is keyed by a hash of its source code, of the modules of
+    the figures class and the helpers it uses, and of the tables it is
+    drawn from, recorded in a manifest in `out_dir`. Panels whose key is
+    unchanged and whose files exist are skipped. The input tables are built
+    and hashed once in this process, then the remaining panels are drawn
+    across `jobs` forked processes, which share those tables.
+    """
+
+    def __init__(self, figures, out_dir, panels=PANELS, jobs=1, force=False):
+        self.figures = figures
+        self.out_dir = out_dir
+        self.panels = panels
+        self.jobs = jobs
+        self.force = force
+        self.manifest_path = join(out_dir, MANIFEST_FILENAME)
+        self.manifest = {}
+        if isfile(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def save_manifest(self):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def is_current(self, name, key):
+        entry = self.manifest.get(name, {})
+        return entry.get('hash') == key and all(isfile(path) for path in entry.get('paths', []))
+
+    def hash_tables(self, callback):
+        table_hashes = {}
+        for panel_tables in self.panels.values():
+            for table in panel_tables:
+                if table in table_hashes:
+                    continue
+                start = time()
+                table_hashes[table] = table_hash(getattr(self.figures, table))
+                callback({'kind': 'table', 'name': table, 'status': 'hashed',
+                          'seconds': time() - start})
+        return table_hashes
+
+    def run(self, callback=lambda record: None):
+        """Render every changed panel and return a list of records of what was done.
+
+        Each record, a dict of kind, name, status and seconds, is also
+        passed to callback as soon as it is made.
+        """
+        makedirs(self.out_dir, exist_ok=True)
+        records = []
+
+        def report(record):
+            records.append(record)
+            callback(record)
+
+        table_hashes = self.hash_tables(report)
+        keys, todo = {}, []
+        code = code_hash(self.figures)
+        for name in self.panels:
+            keys[name] = panel_hash(
+                self.figures, name, table_hashes, panels=self.panels, code=code
+            )
+            if not self.force and self.is_current(name, keys[name]):
+                report({'kind': 'panel', 'name': name, 'status': 'skipped', 'seconds': 0})
+            else:
+                todo.append(name)
+
+        def finish(name, paths, seconds):
+            self.manifest[name] = {'hash': keys[name], 'paths': paths, 'seconds': seconds}
+            self.save_manifest()
+            report({'kind': 'panel', 'name': name, 'status': 'built', 'seconds': seconds})
+
+        def fail(name, exc):
+            self.manifest.pop(name, None)
+            self.save_manifest()
+            report({'kind': 'panel', 'name': name, 'status': 'failed', 'seconds': 0,
+                    'error': repr(exc)})
+
+        _set_figures(self.figures)
+        if self.jobs <= 1 or len(todo) <= 1:
+            for name in todo:
+                try:
+                    finish(*render_panel(name, self.out_dir))
+                except Exception as exc:
+                    fail(name, exc)
+            return records
+
+        with ProcessPoolExecutor(
+            max_workers=self.jobs,
+            mp_context=get_context('fork'),
+            initializer=_set_figures,
+            initargs=(self.figures,),
+        ) as pool:
+            futures = {pool.submit(render_panel, name, self.out_dir): name for name in todo}
+            for future in as_completed(futures):
+                try:
+                    finish(*future.result())
+                except Exception as exc:
+                    fail(futures[future], exc)
+        return records
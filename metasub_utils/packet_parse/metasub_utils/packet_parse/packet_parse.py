@@ -1,45 +1,70 @@
 
-import hashlib
-import pandas as pd
-
 from capalyzer.packet_parser import DataTableFactory
 from os import environ
 from os.path import join, isfile
 
 from .metadata_ontology import add_ontology, clean_city_names
+from .derived_cache import DerivedTableCache, CACHE_DIRNAME, sample_hash, fingerprint
+
+COMPRESSED_SUFFIXES = ['.gz', '.zst']
+
 
-CACHED_TAXA_TABLE_FILENAME = 'taxonomy/{checksum}_cached_taxa_table.csv'
+def packet_table(packet_dir, fname):
+    """Return fname, or a compressed version of it if only that is in the packet."""
+    for suffix in [''] + COMPRESSED_SUFFIXES:
+        if isfile(join(packet_dir, fname + suffix)):
+            return fname + suffix
+    return fname
 
 
 class MetaSUBTableFactory(DataTableFactory):
+    """Tables from a MetaSUB data packet, whose tables may be gzip or zstd compressed."""
 
-    def __init__(self, *args, **kwargs):
-        super(MetaSUBTableFactory, self).__init__(*args, **kwargs)
+    def __init__(self, packet_dir, *args, **kwargs):
+        if 'metadata_tbl' in kwargs:
+            kwargs['metadata_tbl'] = packet_table(packet_dir, kwargs['metadata_tbl'])
+        super(MetaSUBTableFactory, self).__init__(packet_dir, *args, **kwargs)
         self.metadata = add_ontology(self.metadata)
         self.metadata = clean_city_names(self.metadata)
 
+    def csv_in_dir(self, fname, *args, **kwargs):
+        """Read a table of the packet, compressed or not. Pandas decompresses by suffix."""
+        return super(MetaSUBTableFactory, self).csv_in_dir(
+            packet_table(self.packet_dir, fname), *args, **kwargs
+        )
+
+    @property
+    def table_cache(self):
+        return DerivedTableCache(join(self.packet_dir, CACHE_DIRNAME))
+
+    def cached_table(self, name, build, sources, force_rebuild=False, **params):
+        """Return build(**params) from the packet's DerivedTableCache, building it on a miss.
+
+        `sources` are the packet relative files or directories the table is
+        built from, a change to any of them makes a new table.
+        """
+        key = DerivedTableCache.key(
+            name, sample_hash(self.metadata.index), fingerprint(self.packet_dir, sources), params
+        )
+        tbl = None if force_rebuild else self.table_cache.get(key)
+        if tbl is None:
+            tbl = self.table_cache.put(key, build(**params), name=name, params=params)
+        return tbl
+
     def taxonomy(self, *args, **kwargs):
         """Provide a default."""
         force_rebuild = kwargs.pop('force_rebuild', False)
         if args or kwargs:
             return super(MetaSUBTableFactory, self).taxonomy(*args, **kwargs)
-
-        cached_name = CACHED_TAXA_TABLE_FILENAME.format(
-            checksum=hashlib.sha256(self.metadata.to_json().encode()).hexdigest()
-        )
-        cached_taxa_path = join(self.packet_dir, cached_name)
-        if force_rebuild or not isfile(cached_taxa_path):
-            tbl = super(MetaSUBTableFactory, self).taxonomy(
-                min_reads=3,
-                strict=64,
-                max_read_slope=10,
-                rank='species'
-            )
-            tbl.to_csv(cached_taxa_path)
-        return pd.read_csv(
-            cached_taxa_path,
-            header=0,
-            index_col=0,
+        return self.cached_table(
+            'taxonomy',
+            super(MetaSUBTableFactory, self).taxonomy,
+            ['taxonomy'],
+            force_rebuild=force_rebuild,
+            min_reads=3,
+            strict=64,
+            max_read_slope=10,
+            rank='species',
         )
 
     @classmethod
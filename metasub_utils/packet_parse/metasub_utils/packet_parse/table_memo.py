@@ -0,0 +1,84 @@
+"""Keep derived tables in memory between uses, within a memory budget."""
+
+from collections import OrderedDict
+from functools import wraps
+from sys import getsizeof
+from threading import RLock
+
+import pandas as pd
+
+MEMO_BYTES = 4 * 1024 ** 3
+
+
+def table_bytes(tbl):
+    """Return the approximate memory used by a table."""
+    if isinstance(tbl, pd.DataFrame):
+        return int(tbl.memory_usage(index=True, deep=True).sum())
+    if isinstance(tbl, pd.Series):
+        return int(tbl.memory_usage(index=True, deep=True))
+    return getsizeof(tbl)
+
+
+class TableMemo:
+    """A least recently used cache of named tables with a memory budget.
+
+    Tables are built on first use and kept until they are invalidated or
+    evicted, least recently used first, to keep the total under
+    `max_bytes`. The table just built is never evicted, so a single table
+    larger than the budget is still only built once per use. `builds`
+    counts how many times each table has been built.
+    """
+
+    def __init__(self, max_bytes=MEMO_BYTES):
+        self.max_bytes = max_bytes
+        self.tables = OrderedDict()
+        self.sizes = {}
+        self.builds = {}
+        self.lock = RLock()
+
+    @property
+    def n_bytes(self):
+        return sum(self.sizes.values())
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def get(self, name, build):
+        """Return the table called name, calling build() to make it if it is not held."""
+        with self.lock:
+            if name in self.tables:
+                self.tables.move_to_end(name)
+                return self.tables[name]
+            tbl = build()
+            self.builds[name] = 1 + self.builds.get(name, 0)
+            self.tables[name] = tbl
+            self.sizes[name] = table_bytes(tbl)
+            self._evict(keep=name)
+            return tbl
+
+    def _evict(self, keep):
+        while self.n_bytes > self.max_bytes and len(self.tables) > 1:
+            name = next(iter(self.tables))
+            if name == keep:
+                self.tables.move_to_end(name)
+                continue
+            self.invalidate(name)
+
+    def invalidate(self, name=None):
+        """Drop the table called name, or every table."""
+        with self.lock:
+            names = list(self.tables) if name is None else [name]
+            for name in names:
+                self.tables.pop(name, None)
+                self.sizes.pop(name, None)
+
+
+def memoized_table(build):
+    """Turn a method building a table into a property held in `self.table_memo`."""
+
+    @property
+    @wraps(build)
+    def table(self):
+        return self.table_memo.get(build.__name__, lambda: build(self))
+
+    return table
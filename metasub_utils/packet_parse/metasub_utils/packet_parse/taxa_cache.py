@@ -0,0 +1,64 @@
+"""Binary, memory mapped cache of numeric tables."""
+
+import json
+import numpy as np
+import pandas as pd
+from os import replace
+from os.path import isfile
+from uuid import uuid4
+
+
+def cache_paths(prefix):
+    """Return the paths of the matrix and label files of the cache at prefix."""
+    return prefix + '.npy', prefix + '.json'
+
+
+def has_table(prefix):
+    return all(isfile(path) for path in cache_paths(prefix))
+
+
+def save_table(tbl, prefix, info=None):
+    """Write a numeric table as a float matrix (.npy) and its labels (.json).
+
+    info, a JSON serializable dict describing the table, is kept with the labels.
+    Each writer uses its own temporary files, so tables can be saved concurrently.
+    """
+    matrix_path, labels_path = cache_paths(prefix)
+    tmp_suffix = f'.{uuid4().hex}.tmp'
+    with open(matrix_path + tmp_suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(tbl.to_numpy(dtype=np.float64)))
+    with open(labels_path + tmp_suffix, 'w') as f:
+        json.dump({
+            'index': [str(el) for el in tbl.index],
+            'columns': [str(el) for el in tbl.columns],
+            'index_name': tbl.index.name,
+            'columns_name': tbl.columns.name,
+            'info': info or {},
+        }, f)
+    replace(matrix_path + tmp_suffix, matrix_path)
+    replace(labels_path + tmp_suffix, labels_path)
+
+
+def load_info(prefix):
+    """Return the info saved with the table cached at prefix."""
+    with open(cache_paths(prefix)[1]) as f:
+        return json.load(f).get('info', {})
+
+
+def load_table(prefix):
+    """Return the table cached at prefix without reading its values into memory.
+
+    The matrix is memory mapped copy-on-write, so pages are read as they
+    are used and changes to the table never reach the file.
+    """
+    matrix_path, labels_path = cache_paths(prefix)
+    with open(labels_path) as f:
+        labels = json.load(f)
+    matrix = np.load(matrix_path, mmap_mode='c')
+    return pd.DataFrame(
+        matrix,
+        index=pd.Index(labels['index'], name=labels['index_name']),
+        columns=pd.Index(labels['columns'], name=labels['columns_name']),
+        copy=False,
+    )
+
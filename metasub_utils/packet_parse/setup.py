@@ -5,6 +5,8 @@ microlib_name = 'metasub_utils.packet_parse'
 requirements = [
     'capalyzer>=2.15.7',
     'pandas',
+    'click',
+    'scipy',
 ]
 
 setup(
@@ -0,0 +1,57 @@
+"""Test suite for grouping co-abundant columns."""
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from unittest import TestCase
+
+from metasub_utils.packet_parse.coabundance import (
+    correlated_groups,
+    collapse_groups,
+    sparse_correlation,
+)
+
+
+def random_pathways(n_samples=50, n_paths=60, group_size=4):
+    signals = np.random.rand(n_samples, n_paths // group_size + 1)
+    values = signals[:, np.arange(n_paths) // group_size]
+    values = values * (np.random.rand(n_paths) < 0.5)
+    values = values + 0.2 * np.random.rand(n_samples, n_paths)
+    values[:, 3] = 1  # a constant pathway
+    order = np.random.permutation(n_paths)
+    return pd.DataFrame(values[:, order], columns=[f'PWY-{i}' for i in order])
+
+
+class TestCoabundance(TestCase):
+    """Test suite for grouping co-abundant columns."""
+
+    def test_sparse_correlation(self):
+        """Test that the sparse correlation holds the dense correlations over the threshold."""
+        tbl = random_pathways()
+        dense = tbl.corr().fillna(0).to_numpy(copy=True)
+        dense[dense < 0.5] = 0
+        np.testing.assert_allclose(sparse_correlation(tbl, 0.5, block_size=7).toarray(), dense)
+
+    def test_matches_networkx(self):
+        """Test that collapsed groups match those of a networkx graph of the melted correlations."""
+        tbl = random_pathways()
+        co = tbl.corr()
+        co['path_1'] = co.index
+        co = co.melt(id_vars=['path_1'])
+        co.columns = ['path_1', 'path_2', 'value']
+        co = co.query('value >= 0.75')
+        G = nx.Graph()
+        for _, row in co.iterrows():
+            G.add_edge(row['path_1'], row['path_2'])
+        expected = tbl.copy()
+        comps = [comp for comp in nx.connected_components(G) if len(comp) > 1]
+        for i, comp in enumerate(comps):
+            comp = [path for path in tbl.columns if path in comp]
+            these_paths = expected[comp].sum(axis=1)
+            expected = expected.drop(columns=comp)
+            expected[f'COMP_{i}'] = these_paths
+
+        groups = correlated_groups(tbl, 0.75)
+        self.assertEqual(len(groups), len(comps))
+        collapsed = collapse_groups(tbl, groups, [f'COMP_{i}' for i in range(len(groups))])
+        pd.testing.assert_frame_equal(collapsed, expected)
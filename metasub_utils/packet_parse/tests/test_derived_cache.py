@@ -0,0 +1,101 @@
+"""Test suite for the content addressed cache of derived tables."""
+
+from os import makedirs, utime
+from os.path import join, isfile
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import pandas as pd
+
+from metasub_utils.packet_parse.derived_cache import (
+    DerivedTableCache,
+    fingerprint,
+    remove_legacy_caches,
+    sample_hash,
+)
+
+from .test_taxa_cache import random_table
+
+
+def make_packet(packet_dir):
+    makedirs(join(packet_dir, 'taxonomy'))
+    with open(join(packet_dir, 'taxonomy', 'refseq.krakenhll_species.csv'), 'w') as f:
+        f.write('sample,taxon\nsample_0,1\n')
+    return packet_dir
+
+
+class TestDerivedTableCache(TestCase):
+    """Test suite for the content addressed cache of derived tables."""
+
+    def test_key_changes(self):
+        """Test that keys change with parameters, samples and source files."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            samples = sample_hash(['sample_0', 'sample_1'])
+            sources = fingerprint(packet_dir, ['taxonomy'])
+            key = DerivedTableCache.key('taxonomy', samples, sources, {'min_reads': 3})
+            self.assertEqual(
+                key, DerivedTableCache.key('taxonomy', samples, sources, {'min_reads': 3})
+            )
+            self.assertNotEqual(
+                key, DerivedTableCache.key('taxonomy', samples, sources, {'min_reads': 4})
+            )
+            other_samples = sample_hash(['sample_0'])
+            self.assertNotEqual(
+                key, DerivedTableCache.key('taxonomy', other_samples, sources, {'min_reads': 3})
+            )
+            source_path = join(packet_dir, 'taxonomy', 'refseq.krakenhll_species.csv')
+            utime(source_path, ns=(0, 0))
+            changed = fingerprint(packet_dir, ['taxonomy'])
+            self.assertNotEqual(
+                key, DerivedTableCache.key('taxonomy', samples, changed, {'min_reads': 3})
+            )
+
+    def test_get_put(self):
+        """Test that a stored table is returned and a missing key is not."""
+        tbl = random_table()
+        with TemporaryDirectory() as cache_dir:
+            table_cache = DerivedTableCache(cache_dir)
+            self.assertIsNone(table_cache.get('abc'))
+            table_cache.put('abc', tbl, name='taxonomy', params={'min_reads': 3})
+            pd.testing.assert_frame_equal(table_cache.get('abc'), tbl)
+            entry, = table_cache.entries()
+            self.assertEqual(entry['name'], 'taxonomy')
+            self.assertEqual(entry['params'], {'min_reads': '3'})
+
+    def test_gc_least_recently_used(self):
+        """Test that the least recently used tables are removed first."""
+        tbl = random_table()
+        with TemporaryDirectory() as cache_dir:
+            table_cache = DerivedTableCache(cache_dir)
+            for i, key in enumerate(['a', 'b', 'c']):
+                table_cache.put(key, tbl)
+                utime(join(cache_dir, key + '.json'), (i, i))
+            table_cache.get('a')
+            total = sum(entry['size'] for entry in table_cache.entries())
+            removed = table_cache.gc(max_bytes=total - 1)
+            self.assertEqual([entry['key'] for entry in removed], ['b'])
+            self.assertEqual(sorted(e['key'] for e in table_cache.entries()), ['a', 'c'])
+
+    def test_gc_keeps_live_tmp_files(self):
+        """Test that only stale temporary files are removed."""
+        with TemporaryDirectory() as cache_dir:
+            table_cache = DerivedTableCache(cache_dir)
+            live, stale = join(cache_dir, 'a.npy.1.tmp'), join(cache_dir, 'b.npy.2.tmp')
+            for path in [live, stale]:
+                open(path, 'w').close()
+            utime(stale, (0, 0))
+            table_cache.put('c', random_table())
+            self.assertTrue(isfile(live))
+            self.assertFalse(isfile(stale))
+
+    def test_remove_legacy_caches(self):
+        """Test that taxa tables cached by older versions are removed and not fingerprinted."""
+        with TemporaryDirectory() as packet_dir:
+            make_packet(packet_dir)
+            legacy_path = join(packet_dir, 'taxonomy', 'abc_cached_taxa_table.csv')
+            with open(legacy_path, 'w') as f:
+                f.write('')
+            self.assertEqual(len(fingerprint(packet_dir, ['taxonomy'])), 1)
+            self.assertEqual(remove_legacy_caches(packet_dir), [legacy_path])
+            self.assertFalse(isfile(legacy_path))
@@ -0,0 +1,102 @@
+"""Test suite for building figure panels."""
+
+import sys
+from importlib.util import module_from_spec, spec_from_file_location
+from os.path import join, isfile
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import pandas as pd
+
+from metasub_utils.packet_parse.figure_build import FigureBuild, panel_hash
+
+PANELS = {
+    'counts': ['meta'],
+    'totals': ['meta', 'taxa'],
+    'broken': ['taxa'],
+}
+
+
+FIGURES_MODULE = """
+def scale(values):
+    return values * {factor}
+
+
+class Figures:
+
+    def counts(self):
+        return scale(self.meta)
+"""
+
+
+def load_figures(dirname, name, factor):
+    """Return a Figures object from a module written to dirname with the given helper."""
+    path = join(dirname, f'{name}.py')
+    with open(path, 'w') as f:
+        f.write(FIGURES_MODULE.format(factor=factor))
+    spec = spec_from_file_location(name, path)
+    module = sys.modules[name] = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Figures()
+
+
+class MockFigures:
+
+    def __init__(self):
+        self.meta = pd.DataFrame({'city': ['paris', 'oslo']}, index=['s1', 's2'])
+        self.taxa = pd.DataFrame({'ecoli': [1, 2]}, index=['s1', 's2'])
+
+    def counts(self):
+        return self.meta['city'].value_counts().to_frame()
+
+    def totals(self):
+        return [self.taxa.sum().to_frame(), self.meta]
+
+    def broken(self):
+        raise ValueError('broken panel')
+
+
+def statuses(records):
+    return {
+        record['name']: record['status'] for record in records if record['kind'] == 'panel'
+    }
+
+
+class TestFigureBuild(TestCase):
+    """Test suite for building figure panels."""
+
+    def test_build_and_skip(self):
+        """Test that panels are drawn in parallel, then skipped until their inputs change."""
+        figures = MockFigures()
+        with TemporaryDirectory() as out_dir:
+            records = FigureBuild(figures, out_dir, panels=PANELS, jobs=2).run()
+            self.assertEqual(
+                statuses(records), {'counts': 'built', 'totals': 'built', 'broken': 'failed'}
+            )
+            self.assertTrue(isfile(join(out_dir, 'counts.csv')))
+            self.assertTrue(isfile(join(out_dir, 'totals_1.csv')))
+
+            records = FigureBuild(figures, out_dir, panels=PANELS, jobs=2).run()
+            self.assertEqual(
+                statuses(records), {'counts': 'skipped', 'totals': 'skipped', 'broken': 'failed'}
+            )
+
+            figures.taxa.loc['s1', 'ecoli'] = 5
+            records = FigureBuild(figures, out_dir, panels=PANELS).run()
+            self.assertEqual(
+                statuses(records), {'counts': 'skipped', 'totals': 'built', 'broken': 'failed'}
+            )
+            records = FigureBuild(figures, out_dir, panels=PANELS, force=True).run()
+            self.assertEqual(statuses(records)['counts'], 'built')
+
+    def test_helper_changes(self):
+        """Test that a panel is drawn again when a helper it calls changes."""
+        with TemporaryDirectory() as tmp_dir:
+            keys = [
+                panel_hash(
+                    load_figures(tmp_dir, name, factor), 'counts', {'meta': 'x'}, panels=PANELS
+                )
+                for name, factor in [('figs_a', 1), ('figs_b', 1), ('figs_c', 2)]
+            ]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
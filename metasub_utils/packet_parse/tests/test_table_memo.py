@@ -0,0 +1,46 @@
+"""Test suite for memoized tables."""
+
+import pandas as pd
+from unittest import TestCase
+
+from metasub_utils.packet_parse.table_memo import TableMemo, memoized_table, table_bytes
+
+
+class Tables:
+
+    def __init__(self, max_bytes):
+        self.table_memo = TableMemo(max_bytes=max_bytes)
+
+    @memoized_table
+    def base(self):
+        return pd.DataFrame({'a': range(1000)})
+
+    @memoized_table
+    def derived(self):
+        return self.base / self.base.sum()
+
+
+class TestTableMemo(TestCase):
+    """Test suite for TableMemo."""
+
+    def test_build_once(self):
+        """Test that each table is built once however often it is used."""
+        tables = Tables(max_bytes=10 ** 9)
+        for _ in range(3):
+            tables.derived
+            tables.base
+        self.assertEqual(tables.table_memo.builds, {'base': 1, 'derived': 1})
+        tables.table_memo.invalidate('base')
+        tables.derived
+        self.assertEqual(tables.table_memo.builds['base'], 1)
+        tables.base
+        self.assertEqual(tables.table_memo.builds['base'], 2)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used table is evicted to stay in budget."""
+        one_table = table_bytes(pd.DataFrame({'a': range(1000)}))
+        tables = Tables(max_bytes=int(1.5 * one_table))
+        tables.derived
+        self.assertNotIn('base', tables.table_memo)
+        self.assertIn('derived', tables.table_memo)
+        self.assertLessEqual(tables.table_memo.n_bytes, int(1.5 * one_table))
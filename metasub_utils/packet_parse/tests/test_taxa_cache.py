@@ -0,0 +1,34 @@
+"""Test suite for the binary taxa table cache."""
+
+import numpy as np
+import pandas as pd
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from metasub_utils.packet_parse.taxa_cache import load_table, save_table
+
+
+def random_table(n_samples=20, n_taxa=50):
+    values = np.random.rand(n_samples, n_taxa)
+    values[values < 0.5] = 0
+    return pd.DataFrame(
+        values,
+        index=pd.Index([f'sample_{i}' for i in range(n_samples)], name='sample'),
+        columns=[f'taxon {j}' for j in range(n_taxa)],
+    )
+
+
+class TestTaxaCache(TestCase):
+    """Test suite for the binary taxa table cache."""
+
+    def test_round_trip(self):
+        """Test that a cached table loads identical and writes do not reach the file."""
+        tbl = random_table()
+        with TemporaryDirectory() as tmp_dir:
+            prefix = join(tmp_dir, 'cached_taxa_table')
+            save_table(tbl, prefix)
+            loaded = load_table(prefix)
+            pd.testing.assert_frame_equal(loaded, tbl)
+            loaded.iloc[0, 0] = -1
+            pd.testing.assert_frame_equal(load_table(prefix), tbl)
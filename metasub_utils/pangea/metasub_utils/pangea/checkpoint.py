@@ -0,0 +1,60 @@
+"""Local record of what already exists in Pangea so uploads can be resumed."""
+
+import sqlite3
+from os import environ, makedirs
+from os.path import dirname, abspath, expanduser, join
+from threading import Lock
+
+CHECKPOINT_PATH = environ.get(
+    'METASUB_PANGEA_CHECKPOINT',
+    join(expanduser('~'), '.metasub', 'pangea_checkpoint.sqlite')
+)
+SAMPLE = 'sample'
+GROUP_MEMBER = 'group_member'
+RESULT = 'result'
+FIELD = 'field'
+
+
+class CheckpointStore:
+    """Record the UUIDs of samples, results and fields created in Pangea.
+
+    Each object is keyed by its kind, the UUID of its parent (the library
+    of a sample, the sample of a result, the result of a field, the group
+    a sample was added to) and its name.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        makedirs(dirname(abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS objects ('
+                'kind TEXT, parent TEXT, name TEXT, uuid TEXT, '
+                'PRIMARY KEY (kind, parent, name))'
+            )
+
+    def get(self, kind, parent, name):
+        """Return the UUID recorded for an object or None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT uuid FROM objects WHERE kind = ? AND parent = ? AND name = ?',
+                (kind, parent, name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, kind, parent, name, uuid):
+        self.put_many(kind, parent, [(name, uuid)])
+
+    def put_many(self, kind, parent, names_uuids):
+        """Record many (name, uuid) pairs of one kind and parent."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+                [(kind, parent, name, uuid) for name, uuid in names_uuids]
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
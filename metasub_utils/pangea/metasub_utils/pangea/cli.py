@@ -2,12 +2,14 @@
 
 import click
 import pandas as pd
-from json import dumps, loads
 from metasub_utils.wasabi.public_files import nonhuman_reads
 from metasub_utils.metadata import get_complete_metadata
 from capalyzer.packet_parser.normalize import proportions
 
-from .knex import Knex
+from .checkpoint import CheckpointStore, CHECKPOINT_PATH
+from .ingest import BulkIngest, SampleUpload
+from .knex import Knex, POOL_SIZE
+from .payloads import metadata_records, TaxaPayloads
 
 
 @click.group()
@@ -15,21 +17,6 @@ def pangea():
     pass
 
 
-def s3uri(url):
-    return {
-        '__type__': 's3',
-        'endpoint_url': 'https://s3.wasabisys.com',
-        'uri': url,
-    }
-
-
-def floatif(val):
-    try:
-        return float(val)
-    except ValueError:
-        return val
-
-
 def titlecase(el):
     tkns = el.split()
     tkns = [tkn[0].upper() + tkn[1:].lower() for tkn in tkns]
@@ -39,33 +26,34 @@ def titlecase(el):
 @pangea.command('create-samples')
 @click.option('-c', '--city-name', default=None)
 @click.option('-t', '--taxa-table', default=None)
+@click.option('-w', '--workers', default=8, help='Number of samples to create at once.')
+@click.option('--checkpoint-path', default=CHECKPOINT_PATH,
+              help='Local record of what has been created, used to resume uploads.')
 @click.argument('username')
 @click.argument('password')
-def cli_create_samples(city_name, taxa_table, username, password):
-    """List unassembled data in the wasabi bucket."""
-    knex = Knex().login(username, password)
+def cli_create_samples(city_name, taxa_table, workers, checkpoint_path, username, password):
+    """Create samples with their reads and taxa in Pangea."""
+    knex = Knex(pool_size=max(workers, POOL_SIZE)).login(username, password)
+    group_uuid = None
     if city_name:
         group_name = f'MetaSUB {titlecase(city_name)}'
         group_desc = f'MetaSUB samples from {titlecase(city_name)}'
         group_uuid = knex.get_or_add_sample_group(group_name, group_desc)
-    metadata = get_complete_metadata()
+    samples = nonhuman_reads(city_name=city_name)
+    metadata = metadata_records(get_complete_metadata().loc[list(samples)])
     if taxa_table:
-        taxa_table = proportions(pd.read_csv(taxa_table, index_col=0))
-    for sample_name, reads in nonhuman_reads(city_name=city_name).items():
-        click.echo(sample_name, err=True)
-        sample_metadata = loads(dumps({
-            k: floatif(v)
-            for k, v in metadata.loc[sample_name].to_dict().items()
-            if str(v).lower() != 'nan'
-        }))
-        sample = knex.add_sample(sample_name, metadata=sample_metadata)
-        if city_name:
-            knex.add_sample_to_sample_group(sample['uuid'], group_uuid)
-        result = knex.add_sample_result(sample['uuid'], 'nonhuman_reads')
-        knex.add_sample_result_field(result['uuid'], 'read_1', s3uri(reads[0]))
-        knex.add_sample_result_field(result['uuid'], 'read_2', s3uri(reads[1]))
-        if taxa_table is not None:
-            taxa_result = knex.add_sample_result(sample['uuid'], 'krakenuniq_taxonomy')
-            taxa = taxa_table.loc[sample_name]
-            taxa = {k: v for k, v in taxa.to_dict().items() if v > 0}
-            knex.add_sample_result_field(taxa_result['uuid'], 'relative_abundance', taxa)
+        taxa_table = TaxaPayloads(proportions(pd.read_csv(taxa_table, index_col=0)))
+    uploads = (
+        SampleUpload(
+            sample_name, metadata[sample_name], reads,
+            taxa=taxa_table[sample_name] if taxa_table is not None else None,
+        )
+        for sample_name, reads in samples.items()
+    )
+    ingest = BulkIngest(
+        knex, workers=workers, group_uuid=group_uuid, checkpoint=CheckpointStore(checkpoint_path)
+    )
+    ingest.prefetch()
+    ingest.run(uploads, n_samples=len(samples))
+    for line in ingest.report():
+        click.echo(line, err=True)
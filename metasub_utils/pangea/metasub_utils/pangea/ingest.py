@@ -0,0 +1,233 @@
+"""Create many samples in Pangea at once."""
+
+import click
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from sys import stderr
+from threading import Lock
+from time import time
+
+from .checkpoint import CheckpointStore, SAMPLE, GROUP_MEMBER, RESULT, FIELD
+
+ADD_SAMPLE = 'add_sample'
+ADD_TO_GROUP = 'add_to_group'
+ADD_READS = 'add_reads'
+ADD_TAXA = 'add_taxa'
+STAGES = [ADD_SAMPLE, ADD_TO_GROUP, ADD_READS, ADD_TAXA]
+
+
+def s3uri(url):
+    return {
+        '__type__': 's3',
+        'endpoint_url': 'https://s3.wasabisys.com',
+        'uri': url,
+    }
+
+
+class StageTimer:
+    """Collect how long the requests of each stage took, from many threads."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds.setdefault(stage, []).append(seconds)
+
+    def report(self):
+        """Return a line per stage with the count, mean, median and 95th percentile of its requests."""
+        lines = []
+        for stage in STAGES:
+            times = sorted(self.seconds.get(stage, []))
+            if not times:
+                continue
+            mean = sum(times) / len(times)
+            median = times[len(times) // 2]
+            p95 = times[min(len(times) - 1, int(0.95 * len(times)))]
+            lines.append(
+                f'{stage}\tn={len(times)}\tmean={1000 * mean:.0f}ms\t'
+                f'p50={1000 * median:.0f}ms\tp95={1000 * p95:.0f}ms'
+            )
+        return lines
+
+
+class SampleUpload:
+    """Everything needed to create one sample: its metadata, reads and taxa."""
+
+    def __init__(self, sample_name, metadata, reads, taxa=None):
+        self.name = sample_name
+        self.metadata = metadata
+        self.reads = reads
+        self.taxa = taxa
+
+
+class BulkIngest:
+    """Create samples in Pangea with a pool of worker threads.
+
+    Each worker runs every stage of one sample in turn. All workers share
+    one Knex, whose session retries rate limited requests with backoff.
+    At most 2 * workers samples are held in memory at once. A sample that
+    fails is reported and the rest carry on.
+
+    Samples, results and fields are only created if they are not already
+    in the CheckpointStore, which records everything created and, after
+    `prefetch`, every sample already in the library. Before adding a
+    sample to the group, or creating a result of a sample or a field of a
+    result which this run did not create, the members, results or fields
+    already in Pangea are listed into the checkpoint. Rerunning
+    an interrupted upload only creates what is missing, even without its
+    checkpoint.
+    """
+
+    def __init__(self, knex, workers=8, group_uuid=None, checkpoint=None):
+        self.knex = knex
+        self.workers = workers
+        self.group_uuid = group_uuid
+        self.checkpoint = checkpoint or CheckpointStore(':memory:')
+        self.timer = StageTimer()
+        self.lock = Lock()
+        self.failures = []
+        self.listed = set()  # UUIDs of objects whose members, results or fields are all recorded
+        self.listing = {}  # a lock for each object whose children are being listed
+        self.n_done, self.n_existing, self.seconds = 0, 0, 0
+
+    def prefetch(self):
+        """Record the samples already in the library with one paginated listing."""
+        library_uuid = self.knex.metasub_uuid
+        samples = [
+            (sample['name'], sample['uuid'])
+            for sample in self.knex.iter_samples(library_uuid, prefetch=True)
+        ]
+        self.checkpoint.put_many(SAMPLE, library_uuid, samples)
+        return len(samples)
+
+    def _list_children(self, kind, parent):
+        """Record the members of a group, results of a sample or fields of a result in Pangea.
+
+        A parent counts as listed only once its children are in the
+        checkpoint, so a failed listing is tried again.
+        """
+        with self.lock:
+            if parent in self.listed:
+                return
+            parent_lock = self.listing.setdefault(parent, Lock())
+        with parent_lock:
+            if parent in self.listed:
+                return
+            if kind == GROUP_MEMBER:
+                children = [
+                    (sample['uuid'], parent) for sample in self.knex.iter_group_samples(parent)
+                ]
+            elif kind == RESULT:
+                children = [
+                    (result['module_name'], result['uuid'])
+                    for result in self.knex.iter_sample_results(parent)
+                ]
+            else:
+                children = [
+                    (field['name'], field['uuid'])
+                    for field in self.knex.iter_result_fields(parent)
+                ]
+            self.checkpoint.put_many(kind, parent, children)
+            with self.lock:
+                self.listed.add(parent)
+                del self.listing[parent]
+
+    def _get_or_create(self, stage, kind, parent, name, create):
+        """Return the UUID of an object from the checkpoint or Pangea, creating it if missing."""
+        uuid = self.checkpoint.get(kind, parent, name)
+        if uuid is None and kind in (GROUP_MEMBER, RESULT, FIELD):
+            self._list_children(kind, parent)
+            uuid = self.checkpoint.get(kind, parent, name)
+        if uuid is not None:
+            return uuid
+        start = time()
+        uuid = create()['uuid']
+        self.timer.add(stage, time() - start)
+        self.checkpoint.put(kind, parent, name, uuid)
+        if kind != GROUP_MEMBER:
+            with self.lock:
+                self.listed.add(uuid)
+        return uuid
+
+    def _add_result(self, stage, sample_uuid, module_name, fields):
+        knex = self.knex
+        result_uuid = self._get_or_create(
+            stage, RESULT, sample_uuid, module_name,
+            lambda: knex.add_sample_result(sample_uuid, module_name),
+        )
+        for field_name, data in fields.items():
+            self._get_or_create(
+                stage, FIELD, result_uuid, field_name,
+                lambda: knex.add_sample_result_field(result_uuid, field_name, data),
+            )
+
+    def add_sample(self, upload):
+        """Create a sample and its results unless they exist. Return the sample UUID."""
+        knex, library_uuid = self.knex, self.knex.metasub_uuid
+        if self.checkpoint.get(SAMPLE, library_uuid, upload.name) is not None:
+            with self.lock:
+                self.n_existing += 1
+        sample_uuid = self._get_or_create(
+            ADD_SAMPLE, SAMPLE, library_uuid, upload.name,
+            lambda: knex.add_sample(upload.name, metadata=upload.metadata),
+        )
+        if self.group_uuid:
+            self._get_or_create(
+                ADD_TO_GROUP, GROUP_MEMBER, self.group_uuid, sample_uuid,
+                lambda: dict(
+                    knex.add_sample_to_sample_group(sample_uuid, self.group_uuid),
+                    uuid=self.group_uuid,
+                ),
+            )
+        self._add_result(ADD_READS, sample_uuid, 'nonhuman_reads', {
+            'read_1': s3uri(upload.reads[0]),
+            'read_2': s3uri(upload.reads[1]),
+        })
+        if upload.taxa is not None:
+            self._add_result(ADD_TAXA, sample_uuid, 'krakenuniq_taxonomy', {
+                'relative_abundance': upload.taxa,
+            })
+        return sample_uuid
+
+    def run(self, uploads, n_samples=None):
+        """Create every SampleUpload in uploads and return the number created.
+
+        n_samples is the length of the progress bar, by default len(uploads).
+        """
+        n_samples = len(uploads) if n_samples is None else n_samples
+        start = time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                click.progressbar(length=n_samples, label='Samples', file=stderr) as progress:
+            pending = {}
+
+            def collect(return_when):
+                done, _ = wait(pending, return_when=return_when)
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        future.result()
+                        self.n_done += 1
+                    except Exception as exc:
+                        click.echo(f'PANGEA FAILED {name} {exc}', err=True)
+                        self.failures.append((name, exc))
+                    progress.update(1)
+
+            for upload in uploads:
+                if len(pending) >= 2 * self.workers:
+                    collect(FIRST_COMPLETED)
+                pending[executor.submit(self.add_sample, upload)] = upload.name
+            collect(ALL_COMPLETED)
+        self.seconds = time() - start
+        return self.n_done
+
+    def report(self):
+        """Return a list of lines summarizing throughput and per stage latency."""
+        rate = self.n_done / self.seconds if self.seconds else 0
+        summary = (
+            f'{self.n_done} samples ({self.n_existing} already existed), '
+            f'{len(self.failures)} failed, '
+            f'in {self.seconds:.1f}s ({rate:.1f} samples/s) with {self.workers} workers'
+        )
+        return [summary] + self.timer.report()
+
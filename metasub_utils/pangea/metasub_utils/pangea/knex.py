@@ -1,7 +1,17 @@
 
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 ENDPOINT = 'https://pangea.gimmebio.com/api'
+POOL_SIZE = 16
+RETRIES = 5
+BACKOFF = 0.5
+RATE_LIMITED = 429
+RETRY_STATUSES = (RATE_LIMITED, 502, 503, 504)
+METASUB_LIBRARY = 'MetaSUB'
+METASUB_ORG = 'MetaSUB Consortium'
 
 
 class TokenAuth(requests.auth.AuthBase):
@@ -20,144 +30,249 @@ class TokenAuth(requests.auth.AuthBase):
         return self.token
 
 
+class RateLimitRetry(Retry):
+    """Retry which retries rate limited requests of any method.
+
+    Other statuses are only retried for `allowed_methods`. A rate limited
+    request was refused before the server acted on it, so even a POST can
+    be repeated.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == RATE_LIMITED and status_code in (self.status_forcelist or ()):
+            return True
+        return super().is_retry(method, status_code, has_retry_after=has_retry_after)
+
+
+def make_session(pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF):
+    """Return a keep-alive requests.Session with a pool of `pool_size` connections.
+
+    Failed connections and rate limited responses are retried with
+    exponential backoff, honouring Retry-After, as are unavailable
+    responses to idempotent methods. Read errors are not retried, and
+    neither are unavailable responses to a POST, so a POST is never
+    repeated after the server may have acted on it.
+    """
+    retry = RateLimitRetry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        backoff_factor=backoff,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 class Knex:
+    """Client for the Pangea API.
 
-    def __init__(self):
-        self.url = ENDPOINT
+    All requests go through one pooled session, so connections are reused
+    and the instance can be shared between threads. Listings are paginated
+    iterators. UUIDs of organizations, sample groups and samples looked up
+    by name are kept in an index until `invalidate`.
+    """
+
+    def __init__(self, endpoint=ENDPOINT, pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF):
+        self.url = endpoint
         self.auth = None
         self.headers = {'Accept': 'application/json'}
+        self.session = make_session(pool_size=pool_size, retries=retries, backoff=backoff)
+        self.session.headers.update(self.headers)
+        self.uuids = {}
+        self.indexed = set()
 
-    def login(self, username, password):
-        response = requests.post(
-            f'{ENDPOINT}/auth/token/login',
-            headers=self.headers,
-            json={
-                'email': username,
-                'password': password,
-            }
-        )
+    def get(self, path):
+        response = self.session.get(f'{self.url}/{path}', auth=self.auth)
         response.raise_for_status()
-        self.auth = TokenAuth(response.json()['auth_token'])
-        return self
+        return response.json()
 
-    def add_org(self, org_name):
-        response = requests.post(
-            f'{ENDPOINT}/organizations',
-            headers=self.headers,
-            auth=self.auth,
-            json={
-                'name': org_name,
-            }
-        )
+    def post(self, path, json):
+        response = self.session.post(f'{self.url}/{path}', auth=self.auth, json=json)
         response.raise_for_status()
         return response.json()
 
+    def invalidate(self, kind=None, name=None):
+        """Forget cached UUIDs, optionally only those of one kind or name.
+
+        Kinds which are listed in a scope, like samples keyed by
+        ('sample', library_uuid), match their bare kind. Any kind with a
+        name forgotten is listed again on its next miss.
+        """
+
+        def matches(index_kind):
+            scope = index_kind[0] if isinstance(index_kind, tuple) else index_kind
+            return kind is None or kind in (index_kind, scope)
+
+        self.uuids = {
+            key: uuid for key, uuid in self.uuids.items()
+            if not matches(key[0]) or (name is not None and key[1] != name)
+        }
+        self.indexed = {done for done in self.indexed if not matches(done)}
+
+    def login(self, username, password):
+        response = self.post('auth/token/login', {
+            'email': username,
+            'password': password,
+        })
+        self.auth = TokenAuth(response['auth_token'])
+        self.invalidate()
+        return self
+
+    def add_org(self, org_name):
+        org = self.post('organizations', {
+            'name': org_name,
+        })
+        self.uuids[('organization', org_name)] = org['uuid']
+        return org
+
     def get_or_add_sample_group(self, group_name, desc):
-        groups = self.list_sample_groups()
-        grp = [grp for grp in groups if grp['name'] == group_name]
-        if grp:
-            return grp[0]['uuid']
-        return self.add_sample_group(group_name, desc)['uuid']
+        try:
+            return self.get_sample_group_uuid(group_name)
+        except KeyError:
+            return self.add_sample_group(group_name, desc)['uuid']
 
     def add_sample_group(self, group_name, desc):
-        response = requests.post(
-            f'{ENDPOINT}/sample_groups',
-            headers=self.headers,
-            auth=self.auth,
-            json={
-                'name': group_name,
-                'organization': self.metasub_org_uuid,
-                'description': desc,
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        group = self.post('sample_groups', {
+            'name': group_name,
+            'organization': self.metasub_org_uuid,
+            'description': desc,
+        })
+        self.uuids[('sample_group', group_name)] = group['uuid']
+        return group
 
     def add_sample_to_sample_group(self, sample_uuid, group_uuid):
-        response = requests.post(
-            f'{ENDPOINT}/sample_groups/{group_uuid}/samples',
-            headers=self.headers,
-            auth=self.auth,
-            json={
-                'sample_uuid': sample_uuid,
-            }
-        )
+        return self.post(f'sample_groups/{group_uuid}/samples', {
+            'sample_uuid': sample_uuid,
+        })
+
+    def get_page(self, url):
+        response = self.session.get(url, auth=self.auth)
         response.raise_for_status()
         return response.json()
 
+    def iter_pages(self, path, prefetch=False):
+        """Yield the results of a paginated listing, fetching pages only as they are needed.
+
+        With prefetch the next page is requested in a background thread
+        while the results of the current one are being consumed.
+        """
+        url = f'{self.url}/{path}'
+        if not prefetch:
+            while url:
+                page = self.get_page(url)
+                yield from page['results']
+                url = page.get('next')
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.get_page, url)
+            while future is not None:
+                page = future.result()
+                url = page.get('next')
+                future = executor.submit(self.get_page, url) if url else None
+                yield from page['results']
+
+    def iter_sample_groups(self, prefetch=False):
+        return self.iter_pages('sample_groups?format=json', prefetch=prefetch)
+
+    def iter_organizations(self, prefetch=False):
+        return self.iter_pages('organizations?format=json', prefetch=prefetch)
+
+    def iter_samples(self, library_uuid=None, prefetch=False):
+        """Yield every sample, or every sample in a library."""
+        query = f'library_uuid={library_uuid}&' if library_uuid else ''
+        return self.iter_pages(f'samples?{query}format=json', prefetch=prefetch)
+
+    def iter_sample_results(self, sample_uuid=None, prefetch=False):
+        """Yield every sample analysis result, or every result of one sample."""
+        query = f'sample_uuid={sample_uuid}&' if sample_uuid else ''
+        return self.iter_pages(f'sample_ars?{query}format=json', prefetch=prefetch)
+
+    def iter_group_samples(self, group_uuid, prefetch=False):
+        """Yield every sample in a sample group."""
+        return self.iter_pages(f'sample_groups/{group_uuid}/samples?format=json', prefetch=prefetch)
+
+    def iter_result_fields(self, result_uuid=None, prefetch=False):
+        """Yield every analysis result field, or every field of one result."""
+        query = f'analysis_result_uuid={result_uuid}&' if result_uuid else ''
+        return self.iter_pages(f'sample_ar_fields?{query}format=json', prefetch=prefetch)
+
     def list_sample_groups(self):
-        response = requests.get(
-            f'{ENDPOINT}/sample_groups?format=json',
-            headers=self.headers,
-            auth=self.auth,
-        )
-        response.raise_for_status()
-        return response.json()['results']
+        return list(self.iter_sample_groups())
 
     def list_organizations(self):
-        response = requests.get(
-            f'{ENDPOINT}/organizations?format=json',
-            headers=self.headers,
-            auth=self.auth,
-        )
-        response.raise_for_status()
-        return response.json()['results']
+        return list(self.iter_organizations())
 
     def add_sample(self, sample_name, metadata={}):
-        response = requests.post(
-            f'{ENDPOINT}/samples',
-            headers=self.headers,
-            auth=self.auth,
-            json={
-                'name': sample_name,
-                'metadata': metadata,
-                'library': self.metasub_uuid,
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return self.post('samples', {
+            'name': sample_name,
+            'metadata': metadata,
+            'library': self.metasub_uuid,
+        })
 
     def add_sample_result(self, sample_uuid, module_name):
-        response = requests.post(
-            f'{ENDPOINT}/sample_ars',
-            headers=self.headers,
-            auth=self.auth,
-            json={
-                'sample': sample_uuid,
-                'module_name': module_name,
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return self.post('sample_ars', {
+            'sample': sample_uuid,
+            'module_name': module_name,
+        })
 
     def add_sample_result_field(self, ar_uuid, field_name, data):
-        response = requests.post(
-            f'{ENDPOINT}/sample_ar_fields',
-            headers=self.headers,
-            auth=self.auth,
-            json={
-                'analysis_result': ar_uuid,
-                'name': field_name,
-                'stored_data': data,
-            }
+        return self.post('sample_ar_fields', {
+            'analysis_result': ar_uuid,
+            'name': field_name,
+            'stored_data': data,
+        })
+
+    def _lookup_uuid(self, kind, name, iter_func):
+        """Return the UUID of a named object from the name index.
+
+        On a miss pages are listed, and every object seen indexed, until
+        name turns up. Once a listing has been read to the end misses
+        are answered without listing again, until `invalidate`.
+        """
+        key = (kind, name)
+        if key not in self.uuids and kind not in self.indexed:
+            for obj in iter_func():
+                self.uuids.setdefault((kind, obj['name']), obj['uuid'])
+                if obj['name'] == name:
+                    break
+            else:
+                self.indexed.add(kind)
+        if key not in self.uuids:
+            raise KeyError(f'No {kind} named {name}')
+        return self.uuids[key]
+
+    def get_sample_group_uuid(self, group_name):
+        return self._lookup_uuid('sample_group', group_name, self.iter_sample_groups)
+
+    def get_org_uuid(self, org_name):
+        return self._lookup_uuid('organization', org_name, self.iter_organizations)
+
+    def get_sample_uuid(self, sample_name, library_uuid=None):
+        """Return the UUID of a sample in a library, by default the MetaSUB library."""
+        library_uuid = library_uuid or self.metasub_uuid
+        return self._lookup_uuid(
+            ('sample', library_uuid), sample_name,
+            lambda: self.iter_samples(library_uuid, prefetch=True),
         )
-        response.raise_for_status()
-        return response.json()
 
     @property
     def metasub_uuid(self):
         return self.get_metasub_library_uuid()
 
     def get_metasub_library_uuid(self):
-        groups = self.list_sample_groups()
-        metasub = [grp for grp in groups if grp['name'] == 'MetaSUB'][0]
-        return metasub['uuid']
+        return self.get_sample_group_uuid(METASUB_LIBRARY)
 
     @property
     def metasub_org_uuid(self):
         return self.get_metasub_org_uuid()
 
     def get_metasub_org_uuid(self):
-        orgs = self.list_organizations()
-        metasub = [org for org in orgs if org['name'] == 'MetaSUB Consortium'][0]
-        return metasub['uuid']
+        return self.get_org_uuid(METASUB_ORG)
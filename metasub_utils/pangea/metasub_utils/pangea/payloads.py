@@ -0,0 +1,56 @@
+"""Turn whole metadata and taxa tables into per sample API payloads at once."""
+
+import numpy as np
+import pandas as pd
+
+
+def metadata_records(metadata):
+    """Return a dict of sample name to a JSON ready dict of its metadata.
+
+    Values which parse as numbers become floats and the rest stay strings.
+    Missing values and 'nan' are dropped, as they were row by row before.
+    """
+    values = metadata.astype(object)
+    numeric = values.apply(pd.to_numeric, errors='coerce').astype(float)
+    converted = numeric.astype(object).where(numeric.notna(), values).to_numpy()
+    keep = values.notna().to_numpy()
+    keep &= (values.astype(str).apply(lambda column: column.str.lower()) != 'nan').to_numpy()
+    columns = np.array([str(column) for column in metadata.columns], dtype=object)
+    return {
+        sample_name: dict(zip(columns[row_keep].tolist(), row[row_keep].tolist()))
+        for sample_name, row, row_keep in zip(metadata.index, converted, keep)
+    }
+
+
+class TaxaPayloads:
+    """Sparse rows of a samples by taxa table, as dicts of the taxa with non zero values.
+
+    The table is converted to compressed sparse rows once so looking up a
+    sample only slices arrays and builds its dict.
+    """
+
+    def __init__(self, taxa_table):
+        values = taxa_table.to_numpy(dtype=float)
+        rows, cols = np.nonzero(values > 0)
+        self.data = values[rows, cols]
+        self.indices = cols
+        self.indptr = np.searchsorted(rows, np.arange(values.shape[0] + 1))
+        self.taxa = np.array([str(taxon) for taxon in taxa_table.columns], dtype=object)
+        self.rows = {sample_name: i for i, sample_name in enumerate(taxa_table.index)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, sample_name):
+        return sample_name in self.rows
+
+    def __getitem__(self, sample_name):
+        row = self.rows[sample_name]
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return dict(zip(
+            self.taxa[self.indices[start:end]].tolist(), self.data[start:end].tolist()
+        ))
+
+    def items(self):
+        for sample_name in self.rows:
+            yield sample_name, self[sample_name]
@@ -0,0 +1,279 @@
+"""Test suite for pangea."""
+
+import json
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from requests.exceptions import HTTPError
+from os.path import join
+from threading import Thread, Lock
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from metasub_utils.pangea.checkpoint import CheckpointStore, RESULT
+from metasub_utils.pangea.ingest import BulkIngest, SampleUpload
+from metasub_utils.pangea.knex import Knex
+from metasub_utils.pangea.payloads import metadata_records, TaxaPayloads
+
+
+class MockPangea(BaseHTTPRequestHandler):
+    """A minimal Pangea API which rate limits samples ending in 0 once.
+
+    Samples ending in `unavailable` are created but answered with a 503.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    lock = Lock()
+    uuids = count()
+    requests = []
+    objects = {}
+
+    def respond(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.lock:
+            self.requests.append(('GET', self.path))
+        if self.path.startswith('/api/samples'):
+            return self.list_objects('/api/samples')
+        if self.path.startswith('/api/sample_ars?'):
+            return self.list_objects('/api/sample_ars', 'sample_uuid', 'sample')
+        if self.path.startswith('/api/sample_ar_fields?'):
+            return self.list_objects(
+                '/api/sample_ar_fields', 'analysis_result_uuid', 'analysis_result'
+            )
+        if self.path.startswith('/api/sample_groups/group/samples?'):
+            return self.list_objects('/api/sample_groups/group/samples')
+        if self.path.startswith('/api/sample_groups'):
+            return self.respond(200, {'results': [{'name': 'MetaSUB', 'uuid': 'library'}]})
+        return self.respond(200, {'results': [{'name': 'MetaSUB Consortium', 'uuid': 'org'}]})
+
+    def list_objects(self, path, param=None, parent_key=None, page_size=5):
+        """Return a page of the objects created at path so far, like a paginated listing.
+
+        If the query has `param` only objects whose `parent_key` matches it are listed.
+        """
+        query = dict(item.split('=') for item in self.path.split('?')[1].split('&'))
+        page = int(query.get('page', 0))
+        with self.lock:
+            objs = [
+                obj[1] for obj in self.objects.values()
+                if obj and obj[0] == path
+                and (param is None or obj[1][parent_key] == query.get(param))
+            ]
+        start = page * page_size
+        next_url = None
+        if start + page_size < len(objs):
+            port = self.server.server_port
+            next_url = f'http://localhost:{port}{self.path.split("&page=")[0]}&page={page + 1}'
+        self.respond(200, {'results': objs[start:start + page_size], 'next': next_url})
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.lock:
+            self.requests.append(('POST', self.path))
+            if self.path == '/api/samples' and data['name'].endswith('0'):
+                if data['name'] not in self.objects:
+                    self.objects[data['name']] = None
+                    return self.respond(429, {})
+            if self.path == '/api/auth/token/login':
+                return self.respond(200, {'auth_token': 'token'})
+            key = str(next(self.uuids))
+            obj = dict(data, uuid=data.get('sample_uuid', key))  # group members list as samples
+            self.objects[key] = (self.path, obj)
+            if self.path == '/api/samples' and data['name'].endswith('unavailable'):
+                return self.respond(503, {})
+        return self.respond(201, obj)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPangea(TestCase):
+    """Test suite for creating samples against a local mock server."""
+
+    def setUp(self):
+        MockPangea.requests, MockPangea.objects = [], {}
+        self.server = ThreadingHTTPServer(('localhost', 0), MockPangea)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        endpoint = f'http://localhost:{self.server.server_port}/api'
+        self.knex = Knex(endpoint=endpoint, backoff=0).login('user', 'password')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_lookups_cached(self):
+        """Test that the library is only looked up once."""
+        for name in ['sample_1', 'sample_2']:
+            self.assertEqual(self.knex.add_sample(name)['library'], 'library')
+        self.assertEqual(MockPangea.requests.count(('GET', '/api/sample_groups?format=json')), 1)
+        self.knex.invalidate()
+        self.knex.add_sample('sample_3')
+        self.assertEqual(MockPangea.requests.count(('GET', '/api/sample_groups?format=json')), 2)
+
+    def test_post_not_repeated(self):
+        """Test that a POST is retried when rate limited but not when the server is unavailable."""
+        self.knex.add_sample('sample_10')
+        with self.assertRaises(HTTPError):
+            self.knex.add_sample('sample_unavailable')
+        paths = [path for method, path in MockPangea.requests if method == 'POST']
+        self.assertEqual(paths.count('/api/samples'), 3)
+
+    def test_bulk_ingest(self):
+        """Test that every sample and result is created despite rate limiting."""
+        uploads = [
+            SampleUpload(f'sample_{i}', {'city': 'paris'}, ['r1', 'r2'], taxa={'E. coli': 0.5})
+            for i in range(40)
+        ]
+        ingest = BulkIngest(self.knex, workers=8, group_uuid='group')
+        self.assertEqual(ingest.run(uploads), 40)
+        self.assertFalse(ingest.failures)
+        paths = [path for method, path in MockPangea.requests if method == 'POST']
+        self.assertEqual(paths.count('/api/samples'), 44)
+        self.assertEqual(paths.count('/api/sample_groups/group/samples'), 40)
+        self.assertEqual(paths.count('/api/sample_ars'), 80)
+        self.assertEqual(paths.count('/api/sample_ar_fields'), 120)
+        report = ingest.report()
+        self.assertTrue(report[0].startswith('40 samples (0 already existed), 0 failed'))
+        self.assertEqual(len(report), 5)
+
+    def test_resume(self):
+        """Test that rerunning an interrupted upload only creates what is missing."""
+        uploads = [SampleUpload(f'sample_{i}', {}, ['r1', 'r2']) for i in range(1, 10)]
+        self.knex.add_sample('sample_1')
+        with TemporaryDirectory() as tmp_dir:
+            checkpoint = CheckpointStore(join(tmp_dir, 'checkpoint.sqlite'))
+            ingest = BulkIngest(self.knex, workers=4, checkpoint=checkpoint)
+            self.assertEqual(ingest.prefetch(), 1)
+            ingest.run(uploads[:5])
+            checkpoint.close()
+            n_requests = len(MockPangea.requests)
+
+            checkpoint = CheckpointStore(join(tmp_dir, 'checkpoint.sqlite'))
+            ingest = BulkIngest(self.knex, workers=4, checkpoint=checkpoint)
+            self.assertEqual(ingest.prefetch(), 5)
+            self.assertEqual(ingest.run(uploads), 9)
+            self.assertEqual(ingest.n_existing, 5)
+            posts = [path for method, path in MockPangea.requests[n_requests:] if method == 'POST']
+            self.assertEqual(posts.count('/api/samples'), 4)
+            self.assertEqual(posts.count('/api/sample_ars'), 4)
+            self.assertEqual(posts.count('/api/sample_ar_fields'), 8)
+
+    def test_lost_checkpoint(self):
+        """Test that group members, results and fields of existing samples are not created again."""
+        uploads = [SampleUpload(f'sample_{i}', {}, ['r1', 'r2']) for i in range(1, 10)]
+        BulkIngest(self.knex, workers=4, group_uuid='group').run(uploads[:5])
+        n_requests = len(MockPangea.requests)
+
+        ingest = BulkIngest(self.knex, workers=4, group_uuid='group')
+        self.assertEqual(ingest.prefetch(), 5)
+        self.assertEqual(ingest.run(uploads), 9)
+        posts = [path for method, path in MockPangea.requests[n_requests:] if method == 'POST']
+        self.assertEqual(posts.count('/api/samples'), 4)
+        self.assertEqual(posts.count('/api/sample_groups/group/samples'), 4)
+        self.assertEqual(posts.count('/api/sample_ars'), 4)
+        self.assertEqual(posts.count('/api/sample_ar_fields'), 8)
+
+    def test_failed_listing(self):
+        """Test that a parent whose listing failed is listed again."""
+        ingest = BulkIngest(self.knex)
+
+        def fail(*args, **kwargs):
+            raise HTTPError('listing failed')
+
+        self.knex.iter_sample_results = fail
+        with self.assertRaises(HTTPError):
+            ingest._list_children(RESULT, 'sample')
+        self.assertNotIn('sample', ingest.listed)
+        del self.knex.iter_sample_results
+        ingest._list_children(RESULT, 'sample')
+        self.assertIn('sample', ingest.listed)
+
+    def test_invalidate(self):
+        """Test that invalidating a name or kind lists it again on the next lookup."""
+        sample_uuid = self.knex.add_sample('sample_1')['uuid']
+        with self.assertRaises(KeyError):
+            self.knex.get_sample_uuid('missing')
+        self.knex.invalidate('sample', 'sample_1')
+        self.assertEqual(self.knex.get_sample_uuid('sample_1'), sample_uuid)
+
+        self.assertEqual(self.knex.get_or_add_sample_group('MetaSUB', ''), 'library')
+        self.knex.invalidate('sample_group', 'MetaSUB')
+        self.assertEqual(self.knex.get_or_add_sample_group('MetaSUB', ''), 'library')
+        posts = [path for method, path in MockPangea.requests if method == 'POST']
+        self.assertNotIn('/api/sample_groups', posts)
+
+        self.knex.invalidate('sample')
+        self.assertFalse([key for key in self.knex.uuids if key[0][0] == 'sample'])
+
+    def test_paginated_lookup(self):
+        """Test that sample lookups read pages lazily and answer repeats from the index."""
+        uuids = {f'sample_{i}': self.knex.add_sample(f'sample_{i}')['uuid'] for i in range(1, 13)}
+        self.assertEqual(len(list(self.knex.iter_samples('library', prefetch=True))), 12)
+        self.assertEqual(len(list(self.knex.iter_samples('library'))), 12)
+
+        def n_listed():
+            return sum(1 for method, path in MockPangea.requests
+                       if method == 'GET' and path.startswith('/api/samples'))
+
+        n_before = n_listed()
+        self.assertEqual(self.knex.get_sample_uuid('sample_7'), uuids['sample_7'])
+        self.assertLessEqual(n_listed() - n_before, 3)
+        n_before = n_listed()
+        self.assertEqual(self.knex.get_sample_uuid('sample_2'), uuids['sample_2'])
+        self.assertEqual(n_listed(), n_before)
+        with self.assertRaises(KeyError):
+            self.knex.get_sample_uuid('missing')
+        n_before = n_listed()
+        with self.assertRaises(KeyError):
+            self.knex.get_sample_uuid('missing')
+        self.assertEqual(n_listed(), n_before)
+
+
+class TestPayloads(TestCase):
+    """Test suite for building sample payloads from whole tables."""
+
+    def test_metadata_records(self):
+        """Test that records match converting each row on its own."""
+        metadata = pd.DataFrame({
+            'city': ['paris', 'oslo', None],
+            'latitude': ['48.85', 'NaN', '1e3'],
+            'surface': ['seat', 'nan', '12'],
+        }, index=['s1', 's2', 's3'], dtype=str)
+
+        def floatif(val):
+            try:
+                return float(val)
+            except ValueError:
+                return val
+
+        expected = {
+            sample_name: json.loads(json.dumps({
+                k: floatif(v) for k, v in row.to_dict().items() if str(v).lower() != 'nan'
+            }))
+            for sample_name, row in metadata.iterrows()
+        }
+        self.assertEqual(metadata_records(metadata), expected)
+
+    def test_taxa_payloads(self):
+        """Test that each sample gets the taxa with non zero abundance."""
+        taxa = pd.DataFrame(
+            [[0.5, 0, 0.5], [0, 0, 0], [0.1, np.nan, 0.9]],
+            index=['s1', 's2', 's3'], columns=['a', 'b', 'c'],
+        )
+        payloads = TaxaPayloads(taxa)
+        for sample_name in taxa.index:
+            row = taxa.loc[sample_name]
+            self.assertEqual(payloads[sample_name], {k: v for k, v in row.to_dict().items() if v > 0})
+        self.assertEqual(len(dict(payloads.items())), 3)
+        with self.assertRaises(KeyError):
+            payloads['missing']
@@ -1,3 +1,4 @@
 
 from .cli import wasabi
 from .wasabi_bucket import WasabiBucket
+from .async_bucket import AsyncWasabiBucket
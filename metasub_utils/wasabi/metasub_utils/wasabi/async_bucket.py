@@ -0,0 +1,170 @@
+"""A WasabiBucket which keeps many small transfers in flight on an event loop."""
+
+import asyncio
+import hashlib
+from contextlib import AsyncExitStack
+from os import rename, remove
+from os.path import getsize
+from sys import stderr
+from threading import Thread, Condition
+from time import time
+
+from .constants import ENDPOINT_URL
+from .download import PART_SUFFIX, ChecksumError
+from .transfer import TransferSummary, MB
+from .wasabi_bucket import WasabiBucket
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import AioSession
+except ImportError:
+    AioSession = None
+
+
+class AsyncWasabiBucket(WasabiBucket):
+    """A WasabiBucket which moves files with asyncio instead of a pool of threads.
+
+    Every transfer of an object up to the profile's `chunk_size` is a
+    single GET or PUT. Up to `max_requests` of them are in flight at once
+    on an event loop running in a background thread, far more than one
+    thread per transfer can sustain when objects are small, such as the
+    CAP results. Larger objects, such as read files, are moved as
+    WasabiBucket moves them, in parts and resuming partial downloads, on
+    threads. Every transfer shares the profile's `max_bandwidth`. Callers
+    block once `max_pending` transfers are waiting. Listing, the indices
+    and the upload and download methods are those of WasabiBucket.
+
+    Requires aiobotocore (`pip install metasub_utils.wasabi[async]`).
+    """
+
+    def __init__(self, profile_name=None, max_requests=256, max_pending=4096,
+                 retries=3, backoff=1, endpoint_url=ENDPOINT_URL, **kwargs):
+        super().__init__(profile_name=profile_name, endpoint_url=endpoint_url, **kwargs)
+        self.max_requests = max_requests
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+        self.n_pending = 0
+        self.pending = Condition()
+        self.n_done, self.n_bytes, self.failures = 0, 0, []
+        self.start_time = None
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.client = self._call(self._open_client(profile_name, endpoint_url))
+
+    def _call(self, coro):
+        """Run coro on the event loop and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _open_client(self, profile_name, endpoint_url):
+        self.semaphore = asyncio.Semaphore(self.max_requests)
+        self.exit_stack = AsyncExitStack()
+        if AioSession is None:
+            raise ImportError('AsyncWasabiBucket requires aiobotocore, pip install aiobotocore')
+        config = AioConfig(
+            max_pool_connections=self.max_requests,
+            retries={'max_attempts': 5, 'mode': 'standard'},
+        )
+        session = AioSession(profile=profile_name)
+        return await self.exit_stack.enter_async_context(
+            session.create_client('s3', endpoint_url=endpoint_url, config=config)
+        )
+
+    def add_job(self, job, size=0, name=None):
+        """Schedule a coroutine function moving `size` bytes, blocking while too many are waiting."""
+        assert not self.closed
+        if self.start_time is None:
+            self.start_time = time()
+        with self.pending:
+            self.pending.wait_for(lambda: self.n_pending < self.max_pending)
+            self.n_pending += 1
+        future = asyncio.run_coroutine_threadsafe(self._run(job, size, name), self.loop)
+        future.add_done_callback(self._job_done)
+
+    def _job_done(self, future):
+        with self.pending:
+            self.n_pending -= 1
+            self.pending.notify_all()
+
+    async def _run(self, job, size, name):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    moved = await job()
+            except Exception as exc:
+                if attempt == self.retries:
+                    print(f'WASABI FAILED {name} {exc}', file=stderr)
+                    self.failures.append((name, exc))
+                    return
+                print(f'WASABI RETRYING {name} {exc}', file=stderr)
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+            else:
+                self.n_done += 1
+                self.n_bytes += size if moved is None else moved
+                return
+
+    def close(self):
+        """Wait for scheduled transfers to finish, shut the event loop and return a TransferSummary."""
+        if not self.closed:
+            self.closed = True
+            with self.pending:
+                self.pending.wait_for(lambda: self.n_pending == 0)
+            self._call(self.exit_stack.aclose())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+        seconds = time() - self.start_time if self.start_time else 0
+        return TransferSummary(
+            self.n_done + len(self.failures), self.n_bytes, seconds, self.failures
+        )
+
+    async def _throttle(self, n_bytes):
+        if self.throttle:
+            wait = self.throttle.reserve(n_bytes)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def _upload_in_parts(self, local_file, remote_key):
+        """Upload a large file in parts, holding its thread to the shared bandwidth cap."""
+        self.bucket.upload_file(
+            local_file, remote_key, Config=self.transfer_config,
+            Callback=self.throttle.consume if self.throttle else None,
+        )
+        self.index.add(remote_key, getsize(local_file))
+        self._sample_index = None
+
+    async def _upload(self, local_file, remote_key):
+        size = getsize(local_file)
+        if size > self.transfer_profile.chunk_size:
+            await self.loop.run_in_executor(None, self._upload_in_parts, local_file, remote_key)
+            return size
+        with open(local_file, 'rb') as f:
+            body = f.read()
+        await self._throttle(len(body))
+        response = await self.client.put_object(Bucket=self.bucket_name, Key=remote_key, Body=body)
+        self.index.add(remote_key, len(body), etag=response['ETag'].strip('"'))
+        self._sample_index = None
+        return size
+
+    async def _download(self, key, local_path, size, etag):
+        if size is not None and size > self.transfer_profile.chunk_size:
+            return await self.loop.run_in_executor(
+                None, self.downloader.download, key, local_path, size, etag
+            )
+        response = await self.client.get_object(Bucket=self.bucket_name, Key=key)
+        size, etag = response['ContentLength'], response['ETag'].strip('"')
+        tmp_path = local_path + PART_SUFFIX
+        md5 = hashlib.md5()
+        with open(tmp_path, 'wb') as f:
+            async for chunk in response['Body'].iter_chunks(MB):
+                await self._throttle(len(chunk))
+                f.write(chunk)
+                md5.update(chunk)
+        if getsize(tmp_path) != size or ('-' not in etag and md5.hexdigest() != etag):
+            remove(tmp_path)
+            raise ChecksumError(f'{local_path} does not match {key} ETag {etag}')
+        rename(tmp_path, local_path)
+        self.journal.start(local_path, key, size, etag, size)
+        self.journal.finish(local_path)
+        return size
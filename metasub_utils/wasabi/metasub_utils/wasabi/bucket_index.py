@@ -0,0 +1,103 @@
+"""Persistent on-disk index of the objects in a Wasabi bucket."""
+
+import sqlite3
+from os import makedirs
+from os.path import dirname, abspath
+from threading import Lock
+from time import time
+
+
+def prefix_upper_bound(prefix):
+    """Return the smallest string greater than every string starting with prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class BucketIndex:
+    """Cache the listing of a bucket in a local SQLite database.
+
+    Each row records the key, size, ETag and last-modified time of one
+    object. Listings are refreshed by prefix so that updating one part of
+    the bucket does not require relisting the rest of it.
+    """
+
+    def __init__(self, path):
+        makedirs(dirname(abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS objects ('
+                'key TEXT PRIMARY KEY, size INTEGER, etag TEXT, last_modified REAL)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS prefixes (prefix TEXT PRIMARY KEY, refreshed_at REAL)'
+            )
+
+    def _range(self, prefix, column='key'):
+        """Return a SQL condition and its parameters selecting values under prefix."""
+        if not prefix:
+            return '1', ()
+        return f'{column} >= ? AND {column} < ?', (prefix, prefix_upper_bound(prefix))
+
+    def refreshed_at(self, prefix=''):
+        """Return the time prefix (or a prefix covering it) was last listed, or None."""
+        with self.lock:
+            rows = self.conn.execute('SELECT prefix, refreshed_at FROM prefixes').fetchall()
+        times = [refreshed for covering, refreshed in rows if prefix.startswith(covering)]
+        return max(times) if times else None
+
+    def refresh(self, prefix, objects):
+        """Replace every indexed object under prefix with objects.
+
+        `objects` is an iterable of (key, size, etag, last_modified) tuples.
+        """
+        condition, params = self._range(prefix)
+        with self.lock, self.conn:
+            self.conn.execute(f'DELETE FROM objects WHERE {condition}', params)
+            self.conn.executemany('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)', objects)
+            condition, params = self._range(prefix, column='prefix')
+            self.conn.execute(f'DELETE FROM prefixes WHERE {condition}', params)
+            self.conn.execute('INSERT OR REPLACE INTO prefixes VALUES (?, ?)', (prefix, time()))
+
+    def add(self, key, size, etag=None, last_modified=None):
+        """Record a single object, typically one we just uploaded."""
+        last_modified = time() if last_modified is None else last_modified
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+                (key, size, etag, last_modified)
+            )
+
+    def get(self, key):
+        """Return a (key, size, etag, last_modified) tuple for key or None."""
+        with self.lock:
+            return self.conn.execute('SELECT * FROM objects WHERE key = ?', (key,)).fetchone()
+
+    def objects(self, prefix='', batch_size=10 * 1000):
+        """Yield (key, size, etag, last_modified) tuples under prefix in key order.
+
+        Rows are fetched in batches so the index is not locked while the
+        caller consumes them.
+        """
+        condition, params = self._range(prefix)
+        last_key = ''
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f'SELECT * FROM objects WHERE {condition} AND key > ? ORDER BY key LIMIT ?',
+                    params + (last_key, batch_size)
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1][0]
+
+    def keys(self, prefix=''):
+        """Yield the keys under prefix in order."""
+        for row in self.objects(prefix):
+            yield row[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
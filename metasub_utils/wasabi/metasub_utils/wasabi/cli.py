@@ -2,13 +2,62 @@
 
 import click
 
+from .constants import INDEX_PATH
 from .wasabi_bucket import WasabiBucket
+from .async_bucket import AsyncWasabiBucket
 from .public_files import list_nonhuman_reads
+from .sample_index import READS, CONTIGS
+from .transfer import TransferProfile, MB, human_bytes
 
 
 @click.group()
-def wasabi():
-    pass
+@click.option('--refresh/--cached', default=False,
+              help='Relist the bucket instead of answering from the local index.')
+@click.option('--index-path', default=INDEX_PATH, help='Path to the local bucket index.')
+@click.pass_context
+def wasabi(ctx, refresh, index_path):
+    ctx.ensure_object(dict)
+    ctx.obj['refresh'] = refresh
+    ctx.obj['index_path'] = index_path
+
+
+def transfer_options(func):
+    """Add options controlling how files are moved to a command."""
+    options = [
+        click.option('-t', '--threads', default=1, help='Number of files to transfer at once.'),
+        click.option('--chunk-size', default=64, help='Multipart chunk size in MB.'),
+        click.option('--file-concurrency', default=8,
+                     help='Number of parts of each file to transfer at once.'),
+        click.option('--max-bandwidth', default=None, type=float,
+                     help='Cap on total bandwidth in MB/s.'),
+        click.option('--async-requests', default=None, type=int,
+                     help='Move files up to one chunk in size as up to this many concurrent '
+                          'requests on an event loop instead of threads, larger files in '
+                          'parts as usual. Suits many small files, needs aiobotocore.'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def get_bucket(profile_name, threads=1, chunk_size=64, file_concurrency=8, max_bandwidth=None,
+               async_requests=None):
+    """Return a WasabiBucket configured with the options given to `wasabi`."""
+    opts = click.get_current_context().find_object(dict) or {}
+    transfer_profile = TransferProfile(
+        chunk_size=chunk_size * MB,
+        file_concurrency=file_concurrency,
+        max_bandwidth=max_bandwidth * MB if max_bandwidth else None,
+    )
+    kwargs = dict(
+        profile_name=profile_name,
+        transfer_profile=transfer_profile,
+        refresh=opts.get('refresh', False),
+        index_path=opts.get('index_path', INDEX_PATH),
+    )
+    if async_requests:
+        return AsyncWasabiBucket(max_requests=async_requests, **kwargs)
+    return WasabiBucket(threads=threads, **kwargs)
 
 
 @wasabi.command('version')
@@ -26,11 +75,16 @@ def cli_download():
     pass
 
 
+@wasabi.group('upload')
+def cli_upload():
+    pass
+
+
 @cli_list.command('all')
 @click.argument('profile_name', default='wasabi')
 def cli_list_wasabi_files(profile_name):
     """List all files in the wasabi bucket."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name)
     for file_key in wasabi_bucket.list_files():
         print(file_key)
 
@@ -40,15 +94,9 @@ def cli_list_wasabi_files(profile_name):
 @click.option('-p', '--profile-name', default='wasabi')
 def cli_wasabi_status(verbose, profile_name):
     """Print a status report."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
-    samples_with_reads = {
-        '_'.join(raw_reads[0].split('/')[-1].split('_')[:3])
-        for raw_reads in wasabi_bucket.list_raw(grouped=True)
-    }
-    samples_with_contigs = {
-        contig_file.split('/')[-2].split('.metaspades')[0]
-        for contig_file in wasabi_bucket.list_contigs()
-    }
+    sample_index = get_bucket(profile_name).sample_index
+    samples_with_reads = sample_index.names(READS)
+    samples_with_contigs = sample_index.names(CONTIGS)
     all_samples = samples_with_reads | samples_with_contigs
     samples_with_both = samples_with_reads & samples_with_contigs
     samples_with_just_reads = samples_with_reads - samples_with_both
@@ -70,7 +118,7 @@ def cli_wasabi_status(verbose, profile_name):
 @click.argument('profile_name', default='wasabi')
 def cli_list_unassembled_data(profile_name):
     """List unassembled data in the wasabi bucket."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name)
     for file_key in wasabi_bucket.list_unassembled_data():
         print(file_key)
 
@@ -83,7 +131,7 @@ def cli_list_unassembled_data(profile_name):
 @click.option('-n', '--sample-names', default=None, type=click.File('r'))
 def cli_list_raw_reads(grouped, profile_name, city_name, project_name, sample_names):
     """List unassembled data in the wasabi bucket."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name)
     if sample_names:
         sample_names = {line.strip() for line in sample_names}
     file_keys = wasabi_bucket.list_raw(
@@ -121,9 +169,11 @@ def cli_list_nonhuman_reads(grouped, profile_name, city_name, project_name, samp
 @click.option('-r', '--project-name', default=None)
 @click.option('-n', '--sample-names', default=None, type=click.File('r'))
 @click.argument('target_dir', default='data')
-def cli_download_raw_data(dryrun, profile_name, city_name, project_name, sample_names, target_dir):
+@transfer_options
+def cli_download_raw_data(dryrun, profile_name, city_name, project_name, sample_names, target_dir,
+                          **transfer_opts):
     """Download raw sequencing data, from a particular city if specified."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name, **transfer_opts)
     if sample_names:
         sample_names = {line.strip() for line in sample_names}
     wasabi_bucket.download_raw(
@@ -133,21 +183,22 @@ def cli_download_raw_data(dryrun, profile_name, city_name, project_name, sample_
         target_dir=target_dir,
         dryrun=dryrun,
     )
-    wasabi_bucket.close()
+    click.echo(wasabi_bucket.close(), err=True)
 
 
 @cli_download.command('unassembled-data')
 @click.option('-d/-w', '--dryrun/--wetrun', default=True)
 @click.option('-p', '--profile-name', default='wasabi')
 @click.argument('target_dir', default='data')
-def cli_download_unassembled_data(dryrun, profile_name, target_dir):
+@transfer_options
+def cli_download_unassembled_data(dryrun, profile_name, target_dir, **transfer_opts):
     """Download data without contig files from wasabi."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name, **transfer_opts)
     wasabi_bucket.download_unassembled_data(
         target_dir=target_dir,
         dryrun=dryrun,
     )
-    wasabi_bucket.close()
+    click.echo(wasabi_bucket.close(), err=True)
 
 
 @cli_download.command('contigs')
@@ -158,10 +209,11 @@ def cli_download_unassembled_data(dryrun, profile_name, target_dir):
 @click.option('-n', '--sample-names', default=None, type=click.File('r'))
 @click.option('-f', '--file-pattern', default='scaffolds.fasta')
 @click.argument('target_dir', default='assemblies')
+@transfer_options
 def cli_download_contig_files(dryrun, profile_name, city_name, project_name,
-                              sample_names, file_pattern, target_dir):
+                              sample_names, file_pattern, target_dir, **transfer_opts):
     """Download contig files from wasabi."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name, **transfer_opts)
     if sample_names:
         sample_names = {line.strip() for line in sample_names}
     wasabi_bucket.download_contigs(
@@ -172,7 +224,7 @@ def cli_download_contig_files(dryrun, profile_name, city_name, project_name,
         target_dir=target_dir,
         dryrun=dryrun,
     )
-    wasabi_bucket.close()
+    click.echo(wasabi_bucket.close(), err=True)
 
 
 @cli_list.command('contigs')
@@ -185,7 +237,7 @@ def cli_download_contig_files(dryrun, profile_name, city_name, project_name,
 def cli_list_contig_files(dryrun, profile_name, city_name, project_name,
                           sample_names, file_pattern):
     """List all files in the wasabi bucket."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name)
     if sample_names:
         sample_names = {line.strip() for line in sample_names}
     file_keys = wasabi_bucket.list_contigs(
@@ -203,7 +255,7 @@ def cli_list_contig_files(dryrun, profile_name, city_name, project_name,
 @click.argument('profile_name', default='wasabi')
 def cli_list_kmer_files(ext, profile_name):
     """List all files in the wasabi bucket."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name)
     for file_key in wasabi_bucket.list_kmers(ext=ext):
         print(file_key)
 
@@ -212,11 +264,65 @@ def cli_list_kmer_files(ext, profile_name):
 @click.option('-d/-w', '--dryrun/--wetrun', default=True)
 @click.option('-p', '--profile-name', default='wasabi')
 @click.argument('target_dir', default='kmers')
-def cli_download_kmer_files(dryrun, profile_name, target_dir):
+@transfer_options
+def cli_download_kmer_files(dryrun, profile_name, target_dir, **transfer_opts):
     """Download contig files from wasabi."""
-    wasabi_bucket = WasabiBucket(profile_name=profile_name)
+    wasabi_bucket = get_bucket(profile_name, **transfer_opts)
     wasabi_bucket.download_kmers(
         target_dir=target_dir,
         dryrun=dryrun,
     )
-    wasabi_bucket.close()
+    click.echo(wasabi_bucket.close(), err=True)
+
+
+def report_sync(actions, dryrun, wasabi_bucket):
+    """Print the planned uploads and, for a wetrun, how the transfers went."""
+    for action in actions:
+        click.echo(action)
+    reasons = {}
+    for action in actions:
+        reasons[action.reason] = 1 + reasons.get(action.reason, 0)
+    total = human_bytes(sum(action.size for action in actions))
+    reasons = ', '.join(f'{n} {reason}' for reason, n in sorted(reasons.items()))
+    click.echo(f'{len(actions)} files to upload ({total}) {reasons}', err=True)
+    summary = wasabi_bucket.close()
+    if not dryrun:
+        click.echo(summary, err=True)
+
+
+def upload_command(name, method, help_text):
+    """Register a command which syncs a local directory with one of the bucket prefixes."""
+
+    @cli_upload.command(name, help=help_text)
+    @click.option('-d/-w', '--dryrun/--wetrun', default=True)
+    @click.option('-p', '--profile-name', default='wasabi')
+    @click.option('--checksum/--mtime', default=False,
+                  help='Compare files of the same size by md5 instead of modification time.')
+    @click.argument('local_dir')
+    @transfer_options
+    def cli_upload_dir(dryrun, profile_name, checksum, local_dir, **transfer_opts):
+        wasabi_bucket = get_bucket(profile_name, **transfer_opts)
+        actions = getattr(wasabi_bucket, method)(local_dir, dryrun=dryrun, checksum=checksum)
+        report_sync(actions, dryrun, wasabi_bucket)
+
+    return cli_upload_dir
+
+
+upload_command('results', 'upload_results', 'Upload new or changed CAP results.')
+upload_command('contigs', 'upload_contigs', 'Upload new or changed assemblies.')
+upload_command('raw-reads', 'upload_raw_data', 'Upload new or changed raw data.')
+
+
+@cli_upload.command('sync')
+@click.option('-d/-w', '--dryrun/--wetrun', default=True)
+@click.option('-p', '--profile-name', default='wasabi')
+@click.option('--checksum/--mtime', default=False,
+              help='Compare files of the same size by md5 instead of modification time.')
+@click.argument('local_dir')
+@click.argument('remote_prefix')
+@transfer_options
+def cli_upload_sync(dryrun, profile_name, checksum, local_dir, remote_prefix, **transfer_opts):
+    """Upload new or changed files in a directory to any prefix in the bucket."""
+    wasabi_bucket = get_bucket(profile_name, **transfer_opts)
+    actions = wasabi_bucket.sync(local_dir, remote_prefix, dryrun=dryrun, checksum=checksum)
+    report_sync(actions, dryrun, wasabi_bucket)
@@ -1,4 +1,26 @@
 """Constants for working with Wasabi Cloud Storage."""
 
+from os import environ
+from os.path import expanduser, join
+
 BUCKET_NAME = 'metasub'
 ENDPOINT_URL = 'https://s3.wasabisys.com'
+
+DATA_PREFIX = 'data/'
+ASSEMBLY_PREFIX = 'assemblies/'
+KMER_PREFIX = 'kmers/'
+RESULTS_PREFIX = 'cap_analysis/'
+RESULT_DEPTH = 2  # results and assemblies are uploaded as <sample dir>/<file>
+RAW_DATA_DEPTH = 3  # raw data is uploaded as <project>/<flowcell>/<file>
+
+LIST_THREADS = 16
+
+INDEX_PATH = environ.get(
+    'METASUB_WASABI_INDEX',
+    join(expanduser('~'), '.metasub', f'{BUCKET_NAME}_wasabi_index.sqlite')
+)
+
+JOURNAL_PATH = environ.get(
+    'METASUB_WASABI_JOURNAL',
+    join(expanduser('~'), '.metasub', f'{BUCKET_NAME}_wasabi_journal.sqlite')
+)
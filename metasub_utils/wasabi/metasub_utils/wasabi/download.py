@@ -0,0 +1,175 @@
+"""Resumable, checksum verified downloads."""
+
+import hashlib
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from os import open as os_open, close, ftruncate, pwrite, rename, remove, O_RDWR, O_CREAT
+from os.path import isfile, getsize
+
+from .transfer import MB
+
+PART_SUFFIX = '.part'
+
+
+class ChecksumError(Exception):
+    """Raised when a downloaded file does not match the ETag of its object."""
+
+
+def file_md5(path, start=0, length=None, block_size=MB):
+    """Return the md5 digest of length bytes of a file starting at start."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            block = f.read(block_size if remaining is None else min(block_size, remaining))
+            if not block:
+                break
+            md5.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return md5.digest()
+
+
+def multipart_etag(part_digests):
+    """Return the ETag S3 assigns to an object uploaded in parts with these md5 digests."""
+    return f'{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}'
+
+
+class ResumableDownloader:
+    """Download objects as ranged GETs whose progress is kept in a TransferJournal.
+
+    Files are written to `<local_path>.part` and only moved into place once
+    their contents match the ETag of the object. For objects uploaded in
+    parts the ranges line up with the upload parts, so the ETag can be
+    checked from the md5 digest of each part of the file. Parts recorded in
+    the journal are only trusted while `.part` still holds their bytes.
+    """
+
+    def __init__(self, client, bucket_name, journal,
+                 chunk_size=64 * MB, file_concurrency=8, throttle=None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.journal = journal
+        self.chunk_size = chunk_size
+        self.file_concurrency = file_concurrency
+        self.throttle = throttle
+
+    def object_info(self, key):
+        """Return a tuple of (size, etag) for key."""
+        response = self.client.head_object(Bucket=self.bucket_name, Key=key)
+        return response['ContentLength'], response['ETag'].strip('"')
+
+    def part_size(self, key, size, etag):
+        """Return the size of the ranges an object should be fetched in."""
+        if '-' not in etag:
+            return self.chunk_size
+        n_parts = int(etag.split('-')[1])
+        try:
+            response = self.client.head_object(Bucket=self.bucket_name, Key=key, PartNumber=1)
+            return response['ContentLength']
+        except ClientError:
+            # Most tools upload in parts of a whole number of MB
+            return ceil(size / n_parts / MB) * MB
+
+    def is_complete(self, local_path, size, etag):
+        return (
+            isfile(local_path) and getsize(local_path) == size and
+            self.journal.is_complete(local_path, size, etag)
+        )
+
+    def _adopt(self, local_path, tmp_path, size, part_size):
+        """Record the parts of an existing, unverified file so they are not fetched again."""
+        rename(local_path, tmp_path)
+        have = min(getsize(tmp_path), size)
+        for part_number in range(have // part_size):
+            digest = file_md5(tmp_path, start=part_number * part_size, length=part_size)
+            self.journal.add_part(local_path, part_number, digest)
+        if have == size and size % part_size:
+            part_number = size // part_size
+            digest = file_md5(tmp_path, start=part_number * part_size)
+            self.journal.add_part(local_path, part_number, digest)
+
+    def _fetch_part(self, fd, key, local_path, part_number, part_size, size):
+        start = part_number * part_size
+        end = min(size, start + part_size)
+        response = self.client.get_object(
+            Bucket=self.bucket_name, Key=key, Range=f'bytes={start}-{end - 1}'
+        )
+        md5, offset = hashlib.md5(), start
+        for chunk in response['Body'].iter_chunks(MB):
+            if self.throttle:
+                self.throttle.consume(len(chunk))
+            pwrite(fd, chunk, offset)
+            md5.update(chunk)
+            offset += len(chunk)
+        if offset != end:
+            raise IOError(f'Short read for {key} bytes {start}-{end - 1}')
+        self.journal.add_part(local_path, part_number, md5.digest())
+        return end - start
+
+    def download(self, key, local_path, size=None, etag=None):
+        """Download key to local_path, fetching only missing parts. Return bytes fetched."""
+        if size is None or etag is None:
+            size, etag = self.object_info(key)
+        if self.is_complete(local_path, size, etag):
+            return 0
+        part_size = self.part_size(key, size, etag)
+        tmp_path = local_path + PART_SUFFIX
+        self.journal.start(local_path, key, size, etag, part_size)
+        if isfile(local_path):
+            self._adopt(local_path, tmp_path, size, part_size)
+        n_parts = ceil(size / part_size)
+        self._drop_lost_parts(local_path, tmp_path, size, part_size, n_parts)
+        done = self.journal.parts(local_path)
+        missing = [part_number for part_number in range(n_parts) if part_number not in done]
+
+        fd = os_open(tmp_path, O_RDWR | O_CREAT)
+        try:
+            ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=self.file_concurrency) as executor:
+                fetched = sum(executor.map(
+                    lambda part_number: self._fetch_part(
+                        fd, key, local_path, part_number, part_size, size
+                    ),
+                    missing
+                ))
+        finally:
+            close(fd)
+
+        self.verify(local_path, tmp_path, etag, n_parts, part_size)
+        rename(tmp_path, local_path)
+        self.journal.finish(local_path)
+        return fetched
+
+    def _drop_lost_parts(self, local_path, tmp_path, size, part_size, n_parts):
+        """Forget recorded parts which are not in tmp_path, e.g. if it was deleted or cut short."""
+        have = getsize(tmp_path) if isfile(tmp_path) else 0
+        if have >= size:
+            return
+        if have == 0:
+            self.journal.drop_parts(local_path)
+            return
+        lost = [
+            part_number for part_number in range(n_parts)
+            if min(size, (part_number + 1) * part_size) > have
+        ]
+        self.journal.drop_parts(local_path, lost)
+
+    def verify(self, local_path, tmp_path, etag, n_parts, part_size):
+        """Raise ChecksumError, discarding the download, if tmp_path does not match etag.
+
+        Digests are taken from the file itself, not from the journal.
+        """
+        if '-' in etag:
+            actual = multipart_etag([
+                file_md5(tmp_path, start=part_number * part_size, length=part_size)
+                for part_number in range(n_parts)
+            ])
+        else:
+            actual = file_md5(tmp_path).hex()
+        if actual != etag:
+            self.journal.reset(local_path)
+            remove(tmp_path)
+            raise ChecksumError(f'{local_path} has ETag {actual}, expected {etag}')
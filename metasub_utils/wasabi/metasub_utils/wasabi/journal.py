@@ -0,0 +1,108 @@
+"""Local journal of downloads so interrupted transfers can be resumed."""
+
+import sqlite3
+from os import makedirs
+from os.path import dirname, abspath
+from threading import Lock
+
+
+class TransferJournal:
+    """Record the progress of downloads in a local SQLite database.
+
+    For each local file the journal stores the key, size and ETag of the
+    object it came from, the size of the parts it is fetched in and the md5
+    digest of every part that has been written. A download is complete
+    once its ETag has been verified.
+    """
+
+    def __init__(self, path):
+        makedirs(dirname(abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS downloads ('
+                'local_path TEXT PRIMARY KEY, key TEXT, size INTEGER, etag TEXT, '
+                'part_size INTEGER, complete INTEGER)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS parts ('
+                'local_path TEXT, part_number INTEGER, md5 BLOB, '
+                'PRIMARY KEY (local_path, part_number))'
+            )
+
+    def get(self, local_path):
+        """Return a (local_path, key, size, etag, part_size, complete) tuple or None."""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT * FROM downloads WHERE local_path = ?', (abspath(local_path),)
+            ).fetchone()
+
+    def is_complete(self, local_path, size, etag):
+        """Return True if local_path was verified against an object with this size and ETag."""
+        entry = self.get(local_path)
+        return bool(entry and entry[5] and entry[2] == size and entry[3] == etag)
+
+    def start(self, local_path, key, size, etag, part_size):
+        """Begin or resume a download, discarding progress made against a different object."""
+        local_path = abspath(local_path)
+        entry = self.get(local_path)
+        with self.lock, self.conn:
+            if entry and (entry[1], entry[2], entry[3], entry[4]) == (key, size, etag, part_size):
+                self.conn.execute(
+                    'UPDATE downloads SET complete = 0 WHERE local_path = ?', (local_path,)
+                )
+                return
+            self.conn.execute('DELETE FROM parts WHERE local_path = ?', (local_path,))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, 0)',
+                (local_path, key, size, etag, part_size)
+            )
+
+    def parts(self, local_path):
+        """Return a dict mapping the numbers of the parts already written to their md5 digests."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT part_number, md5 FROM parts WHERE local_path = ?', (abspath(local_path),)
+            ).fetchall()
+        return dict(rows)
+
+    def add_part(self, local_path, part_number, md5):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO parts VALUES (?, ?, ?)',
+                (abspath(local_path), part_number, md5)
+            )
+
+    def drop_parts(self, local_path, part_numbers=None):
+        """Forget the given parts of a download, or all of them, so they are fetched again."""
+        local_path = abspath(local_path)
+        with self.lock, self.conn:
+            if part_numbers is None:
+                self.conn.execute('DELETE FROM parts WHERE local_path = ?', (local_path,))
+            else:
+                self.conn.executemany(
+                    'DELETE FROM parts WHERE local_path = ? AND part_number = ?',
+                    [(local_path, part_number) for part_number in part_numbers]
+                )
+
+    def finish(self, local_path):
+        """Mark a download as verified and drop its per-part records."""
+        local_path = abspath(local_path)
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM parts WHERE local_path = ?', (local_path,))
+            self.conn.execute(
+                'UPDATE downloads SET complete = 1 WHERE local_path = ?', (local_path,)
+            )
+
+    def reset(self, local_path):
+        """Forget everything about a download."""
+        local_path = abspath(local_path)
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM parts WHERE local_path = ?', (local_path,))
+            self.conn.execute('DELETE FROM downloads WHERE local_path = ?', (local_path,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,97 @@
+"""Prefix-scoped, parallel listing of the objects in a bucket.
+
+Listing a large prefix page by page is slow because every page depends on
+the continuation token of the one before it. Here each prefix is split
+into delimiter based sub-prefixes (shards) which are listed concurrently,
+pages are passed back through a bounded queue and objects are yielded as
+they arrive so memory use does not grow with the size of the bucket.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+from threading import Event
+
+DONE = object()
+
+
+def object_tuple(obj):
+    """Return a (key, size, etag, last_modified) tuple for a ListObjectsV2 entry."""
+    return obj['Key'], obj['Size'], obj['ETag'].strip('"'), obj['LastModified'].timestamp()
+
+
+def split_prefix(client, bucket_name, prefix, delimiter='/', depth=1):
+    """Return a tuple of (objects directly under prefix, sub-prefixes to list).
+
+    Sub-prefixes are found by listing with a delimiter, `depth` levels down.
+    """
+    objects, shards = [], [prefix]
+    for _ in range(depth):
+        next_shards = []
+        for shard in shards:
+            paginator = client.get_paginator('list_objects_v2')
+            pages = paginator.paginate(Bucket=bucket_name, Prefix=shard, Delimiter=delimiter)
+            for page in pages:
+                objects += [object_tuple(obj) for obj in page.get('Contents', [])]
+                next_shards += [el['Prefix'] for el in page.get('CommonPrefixes', [])]
+        shards = next_shards
+    return objects, shards
+
+
+def put_until(queue, item, stop):
+    """Put item on queue unless stop is set first. Return True if the item was queued."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def list_shard(client, bucket_name, shard, queue, stop):
+    """List every object under shard, passing one page at a time to queue."""
+    try:
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=shard):
+            if not put_until(queue, [object_tuple(obj) for obj in page.get('Contents', [])], stop):
+                return
+    except Exception as exc:
+        put_until(queue, exc, stop)
+    finally:
+        put_until(queue, DONE, stop)
+
+
+def iter_objects(client, bucket_name, prefixes, threads=8, depth=1, delimiter='/'):
+    """Yield (key, size, etag, last_modified) for every object under prefixes.
+
+    Objects from different shards are interleaved, within a shard they are
+    yielded in key order.
+    """
+    objects, shards = [], []
+    for prefix in prefixes:
+        prefix_objects, prefix_shards = split_prefix(
+            client, bucket_name, prefix, delimiter=delimiter, depth=depth
+        )
+        objects += prefix_objects
+        shards += prefix_shards
+    yield from objects
+    if not shards:
+        return
+
+    queue, stop = Queue(maxsize=2 * threads), Event()
+    executor = ThreadPoolExecutor(max_workers=threads)
+    for shard in shards:
+        executor.submit(list_shard, client, bucket_name, shard, queue, stop)
+    try:
+        remaining = len(shards)
+        while remaining:
+            page = queue.get()
+            if page is DONE:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
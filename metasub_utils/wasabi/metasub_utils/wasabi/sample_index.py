@@ -0,0 +1,98 @@
+"""Index of the files in the bucket by the sample they belong to."""
+
+from os.path import basename, dirname
+
+from metasub_utils.metadata import get_samples_from_city
+
+from .constants import DATA_PREFIX, ASSEMBLY_PREFIX, KMER_PREFIX, RESULTS_PREFIX
+
+READS = 'reads'
+CONTIGS = 'contigs'
+KMERS = 'kmers'
+RESULTS = 'results'
+KINDS = (READS, CONTIGS, KMERS, RESULTS)
+
+
+def parse_key(key):
+    """Return a tuple of (sample name, kind) for a key or (None, None) if it is not an artifact."""
+    if key.startswith(DATA_PREFIX) and key.endswith('.fastq.gz'):
+        return basename(key).split('_1.fastq.gz')[0].split('_2.fastq.gz')[0], READS
+    if key.startswith(ASSEMBLY_PREFIX) and key.count('/') >= 2:
+        return basename(dirname(key)).split('.')[0], CONTIGS
+    if key.startswith(KMER_PREFIX):
+        return basename(key).split('.')[0], KMERS
+    if key.startswith(RESULTS_PREFIX) and key.count('/') >= 2:
+        return key.split('/')[1], RESULTS
+    return None, None
+
+
+class SampleIndex:
+    """Map the HA unique ID of each sample to the keys of all of its artifacts.
+
+    Artifacts are raw reads (R1 then R2), files from the metaspades
+    assembly, kmer files and CAP results. Selecting samples by name, city
+    or project is a set of dictionary lookups.
+    """
+
+    def __init__(self):
+        self.samples = {}
+
+    @classmethod
+    def from_keys(cls, keys):
+        """Return a SampleIndex built from a single pass over keys."""
+        index = cls()
+        for key in keys:
+            sample_name, kind = parse_key(key)
+            if sample_name:
+                index.add(sample_name, kind, key)
+        for artifacts in index.samples.values():
+            for kind_keys in artifacts.values():
+                kind_keys.sort()
+        return index
+
+    def add(self, sample_name, kind, key):
+        artifacts = self.samples.setdefault(sample_name, {kind: [] for kind in KINDS})
+        artifacts[kind].append(key)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __contains__(self, sample_name):
+        return sample_name in self.samples
+
+    def __getitem__(self, sample_name):
+        return self.samples[sample_name]
+
+    def names(self, kind=None):
+        """Return the set of sample names, with at least one artifact of kind if given."""
+        if kind is None:
+            return set(self.samples)
+        return {name for name, artifacts in self.samples.items() if artifacts[kind]}
+
+    def select(self, sample_names=None, city_name=None, project_name=None):
+        """Return a sorted list of indexed sample names matching any of the filters.
+
+        If no filter is given return every indexed sample.
+        """
+        if not (sample_names or city_name or project_name):
+            return sorted(self.samples)
+        wanted = set(sample_names or [])
+        if city_name or project_name:
+            wanted |= set(get_samples_from_city(city_name, project_name=project_name))
+        return sorted(name for name in wanted if name in self.samples)
+
+    def keys(self, kind, sample_names=None, city_name=None, project_name=None, grouped=False):
+        """Return keys of the given kind for the selected samples.
+
+        If grouped is True return one list of keys per sample.
+        """
+        out = []
+        for sample_name in self.select(sample_names, city_name, project_name):
+            kind_keys = self.samples[sample_name][kind]
+            if not kind_keys:
+                continue
+            if grouped:
+                out.append(kind_keys)
+            else:
+                out += kind_keys
+        return out
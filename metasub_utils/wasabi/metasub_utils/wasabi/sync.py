@@ -0,0 +1,81 @@
+"""Work out which local files need to be uploaded to make a prefix match a directory."""
+
+from os import sep, walk
+from os.path import curdir, join, relpath, getsize, getmtime
+
+from .download import file_md5
+
+NEW = 'new'
+SIZE = 'size'
+MODIFIED = 'modified'
+CHECKSUM = 'checksum'
+
+
+class SyncAction:
+    """One local file that should be uploaded and why."""
+
+    def __init__(self, local_path, remote_key, size, reason):
+        self.local_path = local_path
+        self.remote_key = remote_key
+        self.size = size
+        self.reason = reason
+
+    def __str__(self):
+        return f'{self.reason}\t{self.local_path}\t{self.remote_key}'
+
+
+def walk_files(local_dir, depth=None):
+    """Yield (relative path, path, size, mtime) for every file under local_dir.
+
+    If depth is given only files whose relative path has that many parts
+    are yielded, e.g. depth=2 for the files matched by `local_dir/*/*`.
+    """
+    for dirpath, dirnames, filenames in walk(local_dir):
+        dirnames.sort()
+        rel_dir = relpath(dirpath, local_dir)
+        level = 1 if rel_dir == curdir else rel_dir.count(sep) + 2  # parts of a file's path
+        if depth is not None:
+            if level >= depth:
+                dirnames.clear()
+            if level != depth:
+                continue
+        for filename in sorted(filenames):
+            path = join(dirpath, filename)
+            yield relpath(path, local_dir), path, getsize(path), getmtime(path)
+
+
+def plan_sync(local_dir, remote_prefix, remote_objects, checksum=False, depth=None):
+    """Return a list of SyncActions needed to make remote_prefix match local_dir.
+
+    Files are compared by path relative to local_dir/remote_prefix and by
+    size. Files of the same size are uploaded again if, with checksum=True,
+    their md5 does not match a single part ETag or, without checksum or
+    an ETag to check against, if they were modified after the remote copy.
+    Only files `depth` directories deep are synced if depth is given.
+
+    `remote_objects` is an iterable of (key, size, etag, last_modified) tuples
+    under remote_prefix, as given by BucketIndex.objects.
+    """
+    remote = {
+        key[len(remote_prefix):]: (size, etag, last_modified)
+        for key, size, etag, last_modified in remote_objects
+    }
+    actions = []
+    for rel_path, path, size, mtime in walk_files(local_dir, depth=depth):
+        remote_key = remote_prefix + rel_path
+        if rel_path not in remote:
+            reason = NEW
+        else:
+            remote_size, etag, last_modified = remote[rel_path]
+            if remote_size != size:
+                reason = SIZE
+            elif checksum and etag and '-' not in etag:
+                if file_md5(path).hex() == etag:
+                    continue
+                reason = CHECKSUM
+            elif last_modified is not None and mtime > last_modified:
+                reason = MODIFIED
+            else:
+                continue
+        actions.append(SyncAction(path, remote_key, size, reason))
+    return actions
@@ -0,0 +1,175 @@
+"""Settings and scheduling for concurrent uploads and downloads."""
+
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from itertools import count
+from queue import PriorityQueue
+from sys import stderr
+from threading import Thread, Lock
+from time import time, sleep
+
+STOP = float('inf')
+MB = 1024 * 1024
+
+
+def human_bytes(n_bytes):
+    """Return a short human readable string for a number of bytes."""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n_bytes) < 1000:
+            return f'{n_bytes:.1f}{unit}'
+        n_bytes /= 1000
+    return f'{n_bytes:.1f}TB'
+
+
+class TransferProfile:
+    """Multipart and connection settings for moving large objects.
+
+    Each worker thread moves one file at a time, in parts of `chunk_size`
+    bytes with up to `file_concurrency` parts in flight. `max_bandwidth`
+    (bytes per second) caps the total across all worker threads.
+    """
+
+    def __init__(self, chunk_size=64 * MB, file_concurrency=8, max_bandwidth=None):
+        self.chunk_size = chunk_size
+        self.file_concurrency = file_concurrency
+        self.max_bandwidth = max_bandwidth
+
+    def transfer_config(self, threads=1):
+        """Return a boto3 TransferConfig for one of `threads` worker threads."""
+        max_bandwidth = None
+        if self.max_bandwidth:
+            max_bandwidth = max(int(self.max_bandwidth / threads), 1)
+        return TransferConfig(
+            multipart_threshold=self.chunk_size,
+            multipart_chunksize=self.chunk_size,
+            max_concurrency=self.file_concurrency,
+            use_threads=self.file_concurrency > 1,
+            max_bandwidth=max_bandwidth,
+        )
+
+    def client_config(self, threads=1, list_threads=1):
+        """Return a botocore Config with a connection pool big enough for every thread."""
+        return Config(
+            max_pool_connections=max(threads * self.file_concurrency, list_threads),
+            retries={'max_attempts': 5, 'mode': 'standard'},
+        )
+
+
+class BandwidthThrottle:
+    """Block callers so that together they consume at most `bytes_per_second`."""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self.lock = Lock()
+        self.next_time = time()
+
+    def reserve(self, n_bytes):
+        """Reserve n_bytes of the rate and return the seconds to wait before moving them."""
+        with self.lock:
+            now = time()
+            start = max(self.next_time, now)
+            self.next_time = start + n_bytes / self.rate
+        return start - now
+
+    def consume(self, n_bytes):
+        """Wait until n_bytes may be moved without going over the rate."""
+        wait = self.reserve(n_bytes)
+        if wait > 0:
+            sleep(wait)
+
+
+class TransferSummary:
+    """Totals for a batch of transfers."""
+
+    def __init__(self, n_jobs, n_bytes, seconds, failures):
+        self.n_jobs = n_jobs
+        self.n_bytes = n_bytes
+        self.seconds = seconds
+        self.failures = failures
+
+    @property
+    def bytes_per_second(self):
+        return self.n_bytes / self.seconds if self.seconds else 0
+
+    def __str__(self):
+        return (
+            f'{self.n_jobs} transfers, {len(self.failures)} failed, '
+            f'{human_bytes(self.n_bytes)} in {self.seconds:.1f}s '
+            f'({human_bytes(self.bytes_per_second)}/s)'
+        )
+
+
+class TransferScheduler:
+    """Run transfer jobs on a pool of worker threads.
+
+    Jobs wait in a bounded priority queue, largest first, so one slow
+    transfer only ties up its own worker and a caller submitting faster
+    than the workers can keep up blocks instead of buffering every job.
+    Failed jobs are retried with exponential backoff and reported as soon
+    as they run out of retries.
+    """
+
+    def __init__(self, threads=1, max_pending=1024, retries=3, backoff=1):
+        self.threads = threads
+        self.queue = PriorityQueue(maxsize=max_pending)
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = []
+        self.order = count()
+        self.lock = Lock()
+        self.n_done, self.n_bytes, self.failures = 0, 0, []
+        self.start_time = None
+
+    def _start(self):
+        self.start_time = time()
+        for _ in range(self.threads):
+            worker = Thread(target=self._work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, job, size=0, name=None):
+        """Queue job, a callable transferring `size` bytes. Block while the queue is full.
+
+        If job returns a number it is taken as the bytes actually moved,
+        for instance when part of a file was already present.
+        """
+        if not self.workers:
+            self._start()
+        self.queue.put((-size, next(self.order), job, size, name))
+
+    def _run(self, job, size, name):
+        for attempt in range(self.retries + 1):
+            try:
+                moved = job()
+            except Exception as exc:
+                if attempt == self.retries:
+                    print(f'WASABI FAILED {name} {exc}', file=stderr)
+                    with self.lock:
+                        self.failures.append((name, exc))
+                    return
+                print(f'WASABI RETRYING {name} {exc}', file=stderr)
+                sleep(self.backoff * (2 ** attempt))
+            else:
+                with self.lock:
+                    self.n_done += 1
+                    self.n_bytes += size if moved is None else moved
+                return
+
+    def _work(self):
+        while True:
+            priority, _, job, size, name = self.queue.get()
+            if priority == STOP:
+                return
+            self._run(job, size, name)
+
+    def close(self):
+        """Wait for every queued job to finish and return a TransferSummary."""
+        for _ in self.workers:
+            self.queue.put((STOP, next(self.order), None, 0, None))
+        for worker in self.workers:
+            worker.join()
+        seconds = time() - self.start_time if self.start_time else 0
+        self.workers = []
+        return TransferSummary(
+            self.n_done + len(self.failures), self.n_bytes, seconds, self.failures
+        )
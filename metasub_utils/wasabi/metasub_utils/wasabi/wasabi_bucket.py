@@ -1,98 +1,155 @@
 import boto3
-from os.path import join, dirname, basename, isfile
+from itertools import chain
+from os.path import join, dirname, basename, isfile, getsize
 from os import makedirs
-from glob import glob
-from concurrent.futures import ThreadPoolExecutor
-from sys import stderr
-
-from metasub_utils.metadata import get_samples_from_city
 
+from .bucket_index import BucketIndex
 from .constants import *
+from .download import ResumableDownloader
+from .journal import TransferJournal
+from .listing import iter_objects
+from .sample_index import SampleIndex, READS, CONTIGS
+from .sync import plan_sync
+from .transfer import TransferScheduler, TransferProfile, BandwidthThrottle
 
 
 class WasabiBucket:
     """Represents the metasub data bucket on Wasabi (an s3 clone)."""
 
-    def __init__(self, profile_name=None, threads=1):
+    def __init__(self, profile_name=None, threads=1, index_path=INDEX_PATH, refresh=False,
+                 list_threads=LIST_THREADS, transfer_profile=None, journal_path=JOURNAL_PATH,
+                 endpoint_url=ENDPOINT_URL, bucket_name=BUCKET_NAME):
+        self.transfer_profile = transfer_profile or TransferProfile()
+        self.transfer_config = self.transfer_profile.transfer_config(threads=threads)
         self.session = boto3.Session(profile_name=profile_name)
-        self.s3 = self.session.resource('s3', endpoint_url=ENDPOINT_URL)
-        self.bucket = self.s3.Bucket(BUCKET_NAME)
-        self.executor = ThreadPoolExecutor(max_workers=threads)
-        self.futures = [None] * 2 * threads
-        self.ind = 0
+        self.s3 = self.session.resource(
+            's3',
+            endpoint_url=endpoint_url,
+            config=self.transfer_profile.client_config(threads=threads, list_threads=list_threads),
+        )
+        self.bucket_name = bucket_name
+        self.bucket = self.s3.Bucket(bucket_name)
+        self.scheduler = TransferScheduler(threads=threads)
         self.closed = False
-
-    def add_job(self, job):
+        self.index = BucketIndex(index_path)
+        self.refresh = refresh
+        self.refreshed = set()
+        self.list_threads = list_threads
+        self._sample_index = None
+        self.journal = TransferJournal(journal_path)
+        self.throttle = None
+        if self.transfer_profile.max_bandwidth:
+            self.throttle = BandwidthThrottle(self.transfer_profile.max_bandwidth)
+        self.downloader = ResumableDownloader(
+            self.s3.meta.client, bucket_name, self.journal,
+            chunk_size=self.transfer_profile.chunk_size,
+            file_concurrency=self.transfer_profile.file_concurrency,
+            throttle=self.throttle,
+        )
+
+    def add_job(self, job, size=0, name=None):
+        """Schedule a transfer of `size` bytes, blocking while the transfer queue is full."""
         assert not self.closed
-        if self.futures[self.ind] is not None:
-            self.futures[self.ind].result()
-        future = self.executor.submit(job)
-        self.futures[self.ind] = future
-        self.ind = (self.ind + 1) % len(self.futures)
+        self.scheduler.submit(job, size=size, name=name)
 
     def close(self):
+        """Wait for scheduled transfers to finish and return a TransferSummary."""
         self.closed = True
-        for future in self.futures:
-            if future:
-                future.result()
+        return self.scheduler.close()
+
+    def update_index(self, prefix=''):
+        """List the objects under prefix from the bucket and store them in the index."""
+        objects = iter_objects(
+            self.s3.meta.client, self.bucket_name, [prefix], threads=self.list_threads
+        )
+        self.index.refresh(prefix, objects)
+        self.refreshed.add(prefix)
+        self._sample_index = None
+
+    def list_objects(self, prefix=''):
+        """Yield (key, size, etag, last_modified) tuples for objects under prefix.
+
+        Objects are read from the local index. The bucket itself is only
+        listed if the index has never covered prefix or if this bucket was
+        opened with refresh=True and prefix has not been relisted yet.
+        """
+        if self.refresh:
+            stale = not any(prefix.startswith(done) for done in self.refreshed)
+        else:
+            stale = self.index.refreshed_at(prefix) is None
+        if stale:
+            self.update_index(prefix)
+        return self.index.objects(prefix)
+
+    def list_keys(self, prefix=''):
+        """Yield the keys under prefix."""
+        for obj in self.list_objects(prefix):
+            yield obj[0]
 
     def list_files(self):
         """Return a list of all files in the bucket."""
-        return {key.key for key in self.bucket.objects.all()}
+        return set(self.list_keys())
+
+    @property
+    def sample_index(self):
+        """Return a SampleIndex of reads, contigs, kmers and results in the bucket."""
+        if self._sample_index is None:
+            self._sample_index = SampleIndex.from_keys(chain(
+                self.list_keys(DATA_PREFIX),
+                self.list_keys(ASSEMBLY_PREFIX),
+                self.list_keys(KMER_PREFIX),
+                self.list_keys(RESULTS_PREFIX),
+            ))
+        return self._sample_index
+
+    def _upload(self, local_file, remote_key):
+        self.bucket.upload_file(local_file, remote_key, Config=self.transfer_config)
+        self.index.add(remote_key, getsize(local_file))
+        self._sample_index = None
 
     def upload(self, local_file, remote_key, dryrun):
         if not isfile(local_file):
             return
         print(f'WASABI UPLOADING {local_file} {remote_key}')
         if not dryrun:
-            self.add_job(lambda: self.bucket.upload_file(local_file, remote_key))
+            self.add_job(
+                lambda: self._upload(local_file, remote_key),
+                size=getsize(local_file), name=local_file,
+            )
+
+    def _download(self, key, local_path, size, etag):
+        return self.downloader.download(key, local_path, size=size, etag=etag)
 
     def download(self, key, local_path, dryrun):
+        """Download key unless local_path is a verified copy of it, resuming partial downloads."""
         if type(key) is not str:
             key = key.key
+        indexed = self.index.get(key)
+        size, etag = (indexed[1], indexed[2]) if indexed else (None, None)
+        if self.downloader.is_complete(local_path, size, etag):
+            return
         print(f'WASABI DOWNLOADING {key} {local_path}')
         if not dryrun:
             makedirs(dirname(local_path), exist_ok=True)
-            self.add_job(lambda: self.bucket.download_file(key, local_path))
+            self.add_job(
+                lambda: self._download(key, local_path, size, etag),
+                size=size or 0, name=key,
+            )
 
     def list_unassembled_data(self):
-        all_assembled_keys = {
-            basename(dirname(key)).split('.')[0]
-            for key in self.list_files() if 'assemblies' in key
-        }
-        unassembled_data = {
-            key for key in self.list_files()
-            if 'data' == key.split('/')[0] and
-            '_'.join(basename(key).split('_')[:3]) not in all_assembled_keys
-        }
-        return unassembled_data
+        """Yield keys of raw data for samples which have not been assembled."""
+        assembled = self.sample_index.names(CONTIGS)
+        for key in self.list_keys(DATA_PREFIX):
+            if '_'.join(basename(key).split('_')[:3]) not in assembled:
+                yield key
 
     def list_raw(self, sample_names=None, city_name=None, project_name=None, grouped=False):
         """List raw read files, from a given city if specified."""
-        samples = set()
-        if city_name or project_name:
-            samples |= set(get_samples_from_city(city_name, project_name=project_name))
-        if sample_names:
-            samples |= set(sample_names)
-        raw_reads = {
-            key.key
-            for key in self.bucket.objects.filter(Prefix='data')
-            if key.key[-9:] == '.fastq.gz'
-        }
-        raw_read_files = {}
-        for raw_read in raw_reads:
-            sname = basename(raw_read).split('_1.fastq.gz')[0].split('_2.fastq.gz')[0]
-            if samples and sname not in samples:
-                continue
-            raw_read_files[sname] = sorted([raw_read] + raw_read_files.get(sname, []))
-
-        raw_list = []
-        for read_files in raw_read_files.values():
-            if not grouped:
-                raw_list += read_files
-            else:
-                raw_list.append(read_files)
-        return raw_list
+        return self.sample_index.keys(
+            READS,
+            sample_names=sample_names, city_name=city_name, project_name=project_name,
+            grouped=grouped,
+        )
 
     def download_raw(self,
         sample_names=None, city_name=None, project_name=None, target_dir='data', dryrun=True):
@@ -107,36 +164,22 @@ class WasabiBucket:
         """Download data without contigs."""
         for key in self.list_unassembled_data():
             local_path = target_dir + '/' + key.split('data/')[1]
-            if isfile(local_path):
-                continue
             self.download(key, local_path, dryrun)
 
     def list_contigs(self,
                      sample_names=None, city_name=None, project_name=None,
                      contig_file='scaffolds.fasta'):
         """List all the contigs."""
-        samples = set()
-        if city_name or project_name:
-            samples |= set(get_samples_from_city(city_name, project_name=project_name))
-        if sample_names:
-            samples |= set(sample_names)
-        contigs = [
-            key.key
-            for key in self.bucket.objects.all()
-            if 'assemblies' in key.key and contig_file == basename(key.key)
-        ]
-        if samples:
-            contigs = [el for el in contigs if basename(dirname(el)).split('.')[0] in samples]
-        return contigs
+        contigs = self.sample_index.keys(
+            CONTIGS, sample_names=sample_names, city_name=city_name, project_name=project_name,
+        )
+        return [key for key in contigs if contig_file == basename(key)]
 
     def list_kmers(self, ext='.jf'):
-        """List all the contigs."""
-        top_dir = 'kmers/'  # all kmer files are in this dir
-        return [
-            key.key
-            for key in self.bucket.objects.all()
-            if (key.key[:len(top_dir)] == top_dir) and (ext == key.key[-len(ext):])
-        ]
+        """Yield the keys of all kmer files."""
+        for key in self.list_keys(KMER_PREFIX):
+            if ext == key[-len(ext):]:
+                yield key
 
     def download_contigs(self,
                          sample_names=None, city_name=None, project_name=None,
@@ -144,69 +187,54 @@ class WasabiBucket:
         """Download contigs."""
         for key in self.list_contigs(sample_names=sample_names, city_name=city_name,
                                      project_name=project_name, contig_file=contig_file):
-            key_path = key.split('assemblies/')[1]
+            key_path = key.split(ASSEMBLY_PREFIX)[1]
             key_dirs = dirname(key_path)
             local_path = join(
                 target_dir,
                 key_dirs,
                 contig_file,
             )
-            if isfile(local_path):
-                continue
             self.download(key, local_path, dryrun)
 
     def download_kmers(self, target_dir='kmers', ext='.jf', dryrun=True):
         """Download kmers."""
         for key in self.list_kmers(ext=ext):
-            key_path = key.split('kmers/')[1]
-            key_dirs = dirname(key_path)
-            local_path = join(
-                target_dir,
-                key_dirs,
-                contig_file,
-            )
-            if isfile(local_path):
-                continue
+            key_path = key.split(KMER_PREFIX)[1]
+            local_path = join(target_dir, key_path)
             self.download(key, local_path, dryrun)
 
-    def upload_raw_data(self, data_dir, dryrun=True):
-        all_uploaded_results = {
-            basename(key)
-            for key in self.list_files()
-            if 'data' in key
-        }
-        for result_file in glob(f'{data_dir}/*/*/*'):
-            if basename(result_file) in all_uploaded_results:
-                continue
-            tkns = result_file.split('/')
-            remote_key = f'data/{data_dir}/{tkns[-3]}/{tkns[-2]}/{tkns[-1]}'
-            self.upload(result_file, remote_key, dryrun)
-
-    def upload_results(self, result_dir, dryrun=True):
-        all_uploaded_results = {
-            basename(key)
-            for key in self.list_files()
-            if 'cap_analysis' in key
-        }
-        for result_file in glob(f'{result_dir}/*/*'):
-            if basename(result_file) in all_uploaded_results:
-                continue
-            tkns = result_file.split('/')
-            remote_key = f'cap_analysis/{tkns[-2]}/{tkns[-1]}'
-            try:
-                self.upload(result_file, remote_key, dryrun)
-            except:
-                print(f'ERROR {result_file}', file=stderr)
-
-    def upload_contigs(self, result_dir, dryrun=True):
-        all_uploaded_results = {
-            basename(dirname(key))
-            for key in self.list_files()
-            if 'assemblies' in key
-        }
-        for result_file in glob(f'{result_dir}/**/*'):
-            if basename(dirname(result_file)) in all_uploaded_results:
-                continue
-            result_root = result_file.split(result_dir)[1]
-            remote_key = f'assemblies/{result_root}'
-            self.upload(result_file, remote_key, dryrun)
+    def sync(self, local_dir, remote_prefix, dryrun=True, checksum=False, depth=None):
+        """Upload the files under local_dir which are missing or changed under remote_prefix.
+
+        Only files `depth` directories deep are synced if depth is given.
+        Return the list of SyncActions, which is all a dryrun does.
+        """
+        if not remote_prefix.endswith('/'):
+            remote_prefix += '/'
+        actions = plan_sync(
+            local_dir, remote_prefix, self.list_objects(remote_prefix),
+            checksum=checksum, depth=depth,
+        )
+        if not dryrun:
+            for action in actions:
+                self.upload(action.local_path, action.remote_key, dryrun)
+        return actions
+
+    def upload_raw_data(self, data_dir, dryrun=True, checksum=False):
+        """Sync raw data, as <project>/<flowcell>/<file> in data_dir, to data/<data_dir>/."""
+        remote_prefix = f'{DATA_PREFIX}{data_dir.strip("/")}/'
+        return self.sync(
+            data_dir, remote_prefix, dryrun=dryrun, checksum=checksum, depth=RAW_DATA_DEPTH
+        )
+
+    def upload_results(self, result_dir, dryrun=True, checksum=False):
+        """Sync CAP results, the files of one directory per sample, to cap_analysis/."""
+        return self.sync(
+            result_dir, RESULTS_PREFIX, dryrun=dryrun, checksum=checksum, depth=RESULT_DEPTH
+        )
+
+    def upload_contigs(self, result_dir, dryrun=True, checksum=False):
+        """Sync assemblies, the files of one directory per sample, to assemblies/."""
+        return self.sync(
+            result_dir, ASSEMBLY_PREFIX, dryrun=dryrun, checksum=checksum, depth=RESULT_DEPTH
+        )
@@ -28,5 +28,6 @@ setup(
     namespace_packages=['metasub_utils'],
     packages=[microlib_name],
     install_requires=requirements,
+    extras_require={'async': ['aiobotocore']},
     package_data={microlib_name: ['metasub_public_files.txt']},
 )
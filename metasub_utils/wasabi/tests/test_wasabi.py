@@ -1,13 +1,27 @@
 """Test suite for wasabi."""
 
+import asyncio
+from contextlib import AsyncExitStack
 from unittest import TestCase
-from os import getcwd, makedirs, environ, remove
-from os.path import isfile, dirname
+from os import getcwd, makedirs, environ, remove, utime
+from os.path import isfile, dirname, join
 from random import randint
+from tempfile import TemporaryDirectory
+from time import sleep, time
 
+from datetime import datetime
 from functools import wraps
+from hashlib import md5
 
 from metasub_utils.wasabi import WasabiBucket
+from metasub_utils.wasabi.async_bucket import AsyncWasabiBucket
+from metasub_utils.wasabi.bucket_index import BucketIndex
+from metasub_utils.wasabi.download import ResumableDownloader, multipart_etag, PART_SUFFIX
+from metasub_utils.wasabi.journal import TransferJournal
+from metasub_utils.wasabi.listing import iter_objects
+from metasub_utils.wasabi.sample_index import SampleIndex
+from metasub_utils.wasabi.sync import plan_sync
+from metasub_utils.wasabi.transfer import TransferScheduler, TransferProfile
 
 
 def with_aws_credentials(func):
@@ -80,3 +94,374 @@ class TestWasabi(TestCase):
         bucket = WasabiBucket(profile_name='wasabi')
         bucket.download_raw(city_name='swansea', project_name='tigress')
         bucket.close()
+
+
+class TestBucketIndex(TestCase):
+    """Test suite for the local bucket index."""
+
+    def test_refresh_prefix(self):
+        """Test that refreshing a prefix only replaces keys under that prefix."""
+        with TemporaryDirectory() as tmp_dir:
+            index = BucketIndex(join(tmp_dir, 'index.sqlite'))
+            self.assertIsNone(index.refreshed_at('data/'))
+            index.refresh('', [
+                ('assemblies/a/scaffolds.fasta', 10, 'e1', 0),
+                ('data/a_1.fastq.gz', 20, 'e2', 0),
+                ('data/b_1.fastq.gz', 30, 'e3', 0),
+            ])
+            self.assertIsNotNone(index.refreshed_at('data/'))
+            index.refresh('data/', [('data/c_1.fastq.gz', 40, 'e4', 0)])
+            self.assertEqual(list(index.keys('data/')), ['data/c_1.fastq.gz'])
+            self.assertEqual(len(list(index.keys())), 2)
+            self.assertEqual(index.get('data/c_1.fastq.gz')[1], 40)
+            index.close()
+
+
+class FakePaginator:
+    """Mimic the ListObjectsV2 paginator of boto3 over a list of keys."""
+
+    def __init__(self, keys, page_size=2):
+        self.keys, self.page_size = sorted(keys), page_size
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        contents, prefixes = [], set()
+        for key in self.keys:
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+            else:
+                contents.append({'Key': key, 'Size': 1, 'ETag': '"x"', 'LastModified': datetime.now()})
+        for i in range(0, max(len(contents), 1), self.page_size):
+            page = {'Contents': contents[i:i + self.page_size]}
+            if i == 0:
+                page['CommonPrefixes'] = [{'Prefix': prefix} for prefix in sorted(prefixes)]
+            yield page
+
+
+class FakeClient:
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def get_paginator(self, name):
+        return FakePaginator(self.keys)
+
+
+class TestListing(TestCase):
+    """Test suite for parallel listing."""
+
+    def test_iter_objects_sharded(self):
+        """Test that a sharded listing finds every key under the prefixes exactly once."""
+        keys = [f'data/proj_{i}/flowcell/sample_{j}_1.fastq.gz' for i in range(5) for j in range(7)]
+        keys += ['data/README', 'assemblies/sample_0.metaspades/scaffolds.fasta']
+        listed = [obj[0] for obj in iter_objects(FakeClient(keys), 'metasub', ['data/'], threads=3)]
+        self.assertEqual(len(listed), len(keys) - 1)
+        self.assertEqual(set(listed), set(keys) - {'assemblies/sample_0.metaspades/scaffolds.fasta'})
+
+
+class TestSampleIndex(TestCase):
+    """Test suite for the sample keyed index."""
+
+    def test_from_keys(self):
+        """Test that artifacts are grouped by sample and reads are ordered R1, R2."""
+        sample = 'haib17KIU4866_HMCMJCCXY_SL335923'
+        index = SampleIndex.from_keys([
+            f'data/proj/flowcell/{sample}_2.fastq.gz',
+            f'data/proj/flowcell/{sample}_1.fastq.gz',
+            f'assemblies/{sample}.metaspades/scaffolds.fasta',
+            f'cap_analysis/{sample}/{sample}.krakenhll.json',
+            'data/proj/flowcell/other_1.fastq.gz',
+            'Scripts/downloadem.sh',
+        ])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index[sample]['reads'][0][-10:], '1.fastq.gz')
+        self.assertEqual(index.names('contigs'), {sample})
+        self.assertEqual(len(index.keys('reads', sample_names=[sample], grouped=True)), 1)
+        self.assertEqual(len(index.keys('reads')), 3)
+
+    def test_list_unassembled_data(self):
+        """Test that every data key of a sample without an assembly is listed."""
+        assembled = 'haib17KIU4866_HMCMJCCXY_SL335923'
+        unassembled = 'haib17KIU4866_HMCMJCCXY_SL335924'
+        keys = [
+            f'data/proj/flowcell/{assembled}_1.fastq.gz',
+            f'data/proj/flowcell/{unassembled}_1.fastq.gz',
+            f'data/proj/flowcell/{unassembled}_1.fastq.gz.md5',
+            f'assemblies/{assembled}.metaspades/scaffolds.fasta',
+        ]
+        with TemporaryDirectory() as tmp_dir:
+            bucket = WasabiBucket(
+                index_path=join(tmp_dir, 'index.sqlite'),
+                journal_path=join(tmp_dir, 'journal.sqlite'),
+            )
+            for prefix in ['data/', 'assemblies/', 'kmers/', 'cap_analysis/']:
+                bucket.index.refresh(
+                    prefix, [(key, 1, None, 0) for key in keys if key.startswith(prefix)]
+                )
+            self.assertEqual(list(bucket.list_unassembled_data()), keys[1:3])
+
+
+class TestTransferScheduler(TestCase):
+    """Test suite for the transfer scheduler."""
+
+    def test_retry_and_summary(self):
+        """Test that failing jobs are retried and that permanent failures are reported."""
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise IOError('transient')
+
+        def broken():
+            raise IOError('permanent')
+
+        scheduler = TransferScheduler(threads=2, retries=2, backoff=0)
+        scheduler.submit(flaky, size=10, name='flaky')
+        scheduler.submit(broken, size=20, name='broken')
+        summary = scheduler.close()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(summary.n_jobs, 2)
+        self.assertEqual(summary.n_bytes, 10)
+        self.assertEqual([name for name, _ in summary.failures], ['broken'])
+
+    def test_largest_first(self):
+        """Test that queued jobs run in order of decreasing size."""
+        order = []
+        scheduler = TransferScheduler(threads=1)
+        scheduler.submit(lambda: sleep(0.1), size=0, name='first')
+        for size in [1, 3, 2]:
+            scheduler.submit(lambda size=size: order.append(size), size=size)
+        scheduler.close()
+        self.assertEqual(order, [3, 2, 1])
+
+
+class TestTransferJournal(TestCase):
+    """Test suite for the download journal."""
+
+    def test_resume_same_object(self):
+        """Test that parts survive a restart unless the object changes."""
+        with TemporaryDirectory() as tmp_dir:
+            journal = TransferJournal(join(tmp_dir, 'journal.sqlite'))
+            local_path = join(tmp_dir, 'sample_1.fastq.gz')
+            journal.start(local_path, 'data/sample_1.fastq.gz', 10, 'abc-2', 5)
+            journal.add_part(local_path, 0, b'digest')
+            journal.start(local_path, 'data/sample_1.fastq.gz', 10, 'abc-2', 5)
+            self.assertEqual(journal.parts(local_path), {0: b'digest'})
+            journal.start(local_path, 'data/sample_1.fastq.gz', 10, 'def-2', 5)
+            self.assertEqual(journal.parts(local_path), {})
+            journal.finish(local_path)
+            self.assertTrue(journal.is_complete(local_path, 10, 'def-2'))
+            self.assertFalse(journal.is_complete(local_path, 10, 'abc-2'))
+            journal.close()
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+
+class FakeObjectClient:
+    """Serve one object uploaded in parts, failing ranged GETs after `fail_after` of them."""
+
+    def __init__(self, data, part_size, fail_after=None):
+        self.data, self.part_size, self.fail_after = data, part_size, fail_after
+        parts = [data[i:i + part_size] for i in range(0, len(data), part_size)]
+        self.etag = multipart_etag([md5(part).digest() for part in parts])
+        self.n_gets = 0
+
+    def head_object(self, Bucket, Key, PartNumber=None):
+        size = self.part_size if PartNumber else len(self.data)
+        return {'ContentLength': size, 'ETag': f'"{self.etag}"'}
+
+    def get_object(self, Bucket, Key, Range):
+        if self.fail_after is not None and self.n_gets >= self.fail_after:
+            raise IOError('connection lost')
+        self.n_gets += 1
+        start, end = map(int, Range[len('bytes='):].split('-'))
+        return {'Body': FakeBody(self.data[start:end + 1])}
+
+
+class TestResumableDownloader(TestCase):
+    """Test suite for resumable downloads."""
+
+    def test_lost_part_file(self):
+        """Test that parts are fetched again if the partial file is deleted between attempts."""
+        data = bytes(randint(0, 255) for _ in range(1000))
+        with TemporaryDirectory() as tmp_dir:
+            journal = TransferJournal(join(tmp_dir, 'journal.sqlite'))
+            local_path = join(tmp_dir, 'sample_1.fastq.gz')
+            client = FakeObjectClient(data, 300, fail_after=2)
+            downloader = ResumableDownloader(client, 'metasub', journal, file_concurrency=1)
+            with self.assertRaises(IOError):
+                downloader.download('data/sample_1.fastq.gz', local_path)
+            self.assertEqual(len(journal.parts(local_path)), 2)
+            remove(local_path + PART_SUFFIX)
+
+            client.fail_after = None
+            downloader.download('data/sample_1.fastq.gz', local_path)
+            with open(local_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            journal.close()
+
+
+class StubAsyncBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    async def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+
+class StubAsyncClient:
+    """Keep objects PUT in a dict and serve them back, like an aiobotocore S3 client."""
+
+    def __init__(self):
+        self.objects = {}
+
+    async def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+        return {'ETag': f'"{md5(Body).hexdigest()}"'}
+
+    async def get_object(self, Bucket, Key):
+        data = self.objects[Key]
+        return {
+            'ContentLength': len(data),
+            'ETag': f'"{md5(data).hexdigest()}"',
+            'Body': StubAsyncBody(data),
+        }
+
+
+class StubBucketResource:
+    """Record files uploaded in parts through a boto3 Bucket."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, local_file, remote_key, Config=None, Callback=None):
+        with open(local_file, 'rb') as f:
+            self.objects[remote_key] = f.read()
+        if Callback:
+            Callback(len(self.objects[remote_key]))
+
+
+class StubAsyncBucket(AsyncWasabiBucket):
+
+    async def _open_client(self, profile_name, endpoint_url):
+        self.semaphore = asyncio.Semaphore(self.max_requests)
+        self.exit_stack = AsyncExitStack()
+        return StubAsyncClient()
+
+
+class TestAsyncWasabiBucket(TestCase):
+    """Test suite for moving files on an event loop."""
+
+    def test_small_and_large_files(self):
+        """Test that small files are single requests, large ones go in parts, both throttled."""
+        small, large = b'a' * 500, bytes(randint(0, 255) for _ in range(1500))
+        with TemporaryDirectory() as tmp_dir:
+            kwargs = dict(
+                index_path=join(tmp_dir, 'index.sqlite'),
+                journal_path=join(tmp_dir, 'journal.sqlite'),
+                transfer_profile=TransferProfile(chunk_size=1000, max_bandwidth=20000),
+            )
+            for name, data in [('small', small), ('large', large)]:
+                with open(join(tmp_dir, name), 'wb') as f:
+                    f.write(data)
+            start = time()
+            bucket = StubAsyncBucket(**kwargs)
+            bucket.bucket = StubBucketResource()
+            bucket.upload(join(tmp_dir, 'small'), 'cap_analysis/s1/small', False)
+            bucket.upload(join(tmp_dir, 'large'), 'data/large', False)
+            summary = bucket.close()
+            self.assertFalse(summary.failures)
+            self.assertEqual(set(bucket.client.objects), {'cap_analysis/s1/small'})
+            self.assertEqual(bucket.bucket.objects, {'data/large': large})
+
+            client = bucket.client
+            bucket = StubAsyncBucket(**kwargs)
+            bucket.client = client
+            bucket.downloader = ResumableDownloader(
+                FakeObjectClient(large, 300), 'metasub', bucket.journal,
+                file_concurrency=1, throttle=bucket.throttle,
+            )
+            bucket.download('cap_analysis/s1/small', join(tmp_dir, 'out', 'small'), False)
+            bucket.download('data/large', join(tmp_dir, 'out', 'large'), False)
+            summary = bucket.close()
+            self.assertFalse(summary.failures)
+            for name, data in [('small', small), ('large', large)]:
+                with open(join(tmp_dir, 'out', name), 'rb') as f:
+                    self.assertEqual(f.read(), data)
+            self.assertGreaterEqual(time() - start, 2 * (500 + 1500) / 20000 - 0.05)
+
+
+class TestSync(TestCase):
+    """Test suite for planning uploads."""
+
+    def test_plan_sync(self):
+        """Test that only new, resized or modified files are uploaded."""
+        with TemporaryDirectory() as tmp_dir:
+            makedirs(join(tmp_dir, 'sample_1'))
+            for name, contents in [('same', 'abc'), ('resized', 'abcd'), ('modified', 'abc'),
+                                   ('new', 'abc'), ('unhashed', 'abc')]:
+                with open(join(tmp_dir, 'sample_1', name), 'w') as f:
+                    f.write(contents)
+                utime(join(tmp_dir, 'sample_1', name), (100, 100))
+            for name in ['modified', 'unhashed']:
+                utime(join(tmp_dir, 'sample_1', name), (300, 300))
+            remote = [
+                ('results/sample_1/same', 3, '900150983cd24fb0d6963f7d28e17f72', 200),
+                ('results/sample_1/resized', 3, None, 200),
+                ('results/sample_1/modified', 3, 'bad', 200),
+                ('results/sample_1/unhashed', 3, None, 200),
+            ]
+            actions = plan_sync(tmp_dir, 'results/', remote)
+            self.assertEqual(
+                {(action.remote_key, action.reason) for action in actions},
+                {('results/sample_1/resized', 'size'), ('results/sample_1/modified', 'modified'),
+                 ('results/sample_1/new', 'new'), ('results/sample_1/unhashed', 'modified')}
+            )
+            actions = plan_sync(tmp_dir, 'results/', remote, checksum=True)
+            self.assertEqual(
+                {(action.remote_key, action.reason) for action in actions},
+                {('results/sample_1/resized', 'size'), ('results/sample_1/modified', 'checksum'),
+                 ('results/sample_1/new', 'new'), ('results/sample_1/unhashed', 'modified')}
+            )
+
+    def test_plan_sync_depth(self):
+        """Test that only files at the given depth are synced."""
+        with TemporaryDirectory() as tmp_dir:
+            makedirs(join(tmp_dir, 'sample_1', 'nested'))
+            for path in ['top', 'sample_1/result', 'sample_1/nested/deep']:
+                open(join(tmp_dir, path), 'w').close()
+            actions = plan_sync(tmp_dir, 'results/', [], depth=2)
+            self.assertEqual([action.remote_key for action in actions], ['results/sample_1/result'])
+            self.assertEqual(len(plan_sync(tmp_dir, 'results/', [])), 3)
+
+    def test_upload_raw_data_depth(self):
+        """Test that only files in <project>/<flowcell> directories are uploaded as raw data."""
+        with TemporaryDirectory() as tmp_dir:
+            data_dir = join(tmp_dir, 'raw')
+            makedirs(join(data_dir, 'proj', 'flowcell', 'nested'))
+            for path in ['proj/notes', 'proj/flowcell/s1_1.fastq.gz',
+                         'proj/flowcell/nested/s1_1.fastq.gz']:
+                open(join(data_dir, path), 'w').close()
+            bucket = WasabiBucket(
+                index_path=join(tmp_dir, 'index.sqlite'),
+                journal_path=join(tmp_dir, 'journal.sqlite'),
+            )
+            bucket.index.refresh('data/', [])
+            actions = bucket.upload_raw_data(data_dir)
+            self.assertEqual(
+                [action.remote_key for action in actions],
+                [f'data/{data_dir.strip("/")}/proj/flowcell/s1_1.fastq.gz'],
+            )
@@ -0,0 +1,144 @@
+"""Benchmark cleaning release metadata row by row and with column operations.
+
+Makes a random raw metadata table with controls, duplicates and the
+columns clean_metadata_table reads, then times the old row by row
+implementation, kept here for reference, against clean_metadata_table
+and checks that both return the same tables.
+"""
+
+import click
+import numpy as np
+import pandas as pd
+from time import time
+
+from metasub_utils.data_packet.clean_metadata import (
+    add_surface_ontology,
+    clean_metadata_table,
+    contains_pattern,
+    lab_controls,
+)
+
+
+def random_metadata(n_rows):
+    choice = np.random.choice
+    barcodes = [samples[0] for (_, _, col), samples in lab_controls.items() if col == 'barcode']
+    ha_ids = np.array([f'5080-CEM-{i:04d}' for i in range(n_rows)], dtype=object)
+    ha_ids[np.random.rand(n_rows) < 0.05] = '5080-CEM-0079'
+    ha_ids[np.random.rand(n_rows) < 0.1] = ha_ids[choice(n_rows, 1)][0]
+    ha_ids[np.random.rand(n_rows) < 0.05] = None
+    tbl = pd.DataFrame({
+        'uuid': [f'sample_{i}' for i in range(n_rows)],
+        'ha_id': ha_ids,
+        'barcode': np.where(
+            np.random.rand(n_rows) < 0.01, choice(barcodes, n_rows),
+            [str(235000000 + i) for i in range(n_rows)],
+        ),
+        'metasub_name': choice(['CSD16-BCN-132', 'positive ctrl', 'copan swab', 'CSD16-NYC-1'], n_rows),
+        'surface_material': choice(['Steel', 'air', 'wood', None, 'concrete'], n_rows),
+        'city': choice(['new_york', 'antarctica', 'neg_control', 'pos_control', None], n_rows),
+        'project': choice(['CSD16', 'CSD17', 'CSD17_AIR', 'PILOT'], n_rows),
+        'control_type': choice(['ctrl cities', 'poszymo', 'dry tube', None], n_rows),
+        'coastal_city': choice(['yes', 'no'], n_rows),
+        'city_elevation_meters': choice(['10', '2240', None], n_rows),
+    })
+    return tbl.astype(str).where(tbl.notna())
+
+
+def rowwise_clean_metadata_table(tbl):
+
+    def normalize_control(row):
+        ctrl = row['control_type']
+        if not ctrl:
+            return None
+        if ctrl in ['ctrl cities']:
+            return 'background_control'
+        if ctrl in ['positive_control', 'poszymo']:
+            return 'positive_control'
+        if ctrl in ['negative_control', 'dry tube', 'dry tube & swab', 'tube & rna/dna out', 'tube & rna/dna out & swab']:
+            return 'lab_negative_control'
+        return None
+
+    def id_control(row, col):
+        if isinstance(row[col], str):  # newer pandas stores the missing Nones as NaN
+            return row[col]
+        msub_name = row['metasub_name']
+        if contains_pattern(msub_name, 'positive'):
+            return 'positive_control'
+        elif contains_pattern(msub_name, 'control', 'copan'):
+            return 'background_control'
+        if contains_pattern(row['surface_material'], 'negative_control', 'air'):
+            return 'background_control'
+        if contains_pattern(row['city'], 'neg_control'):
+            return 'background_control'
+        if contains_pattern(row['city'], 'pos_control'):
+            return 'positive_control'
+
+    def add_lab_controls_fine(row):
+        for (fine, coarse, col), samples in lab_controls.items():
+            if contains_pattern(row[col], *samples):
+                return fine
+
+    def add_lab_controls_coarse(row):
+        for (fine, coarse, col), samples in lab_controls.items():
+            if contains_pattern(row[col], *samples):
+                return coarse
+
+    def coastal(row):
+        if row['coastal_city'] == 'yes':
+            return ('coastal', 'coastal')
+        if float(row['city_elevation_meters']) > 1000:
+            return ('high_altitude', 'not_coastal')
+        return ('low_altitude', 'not_coastal')
+
+    def deduper(row, mems, col='ha_id'):
+        if row[col] and isinstance(row[col], str) and (row[col] in mems):
+            return False
+        mems.add(row[col])
+        return True
+
+    tbl = tbl.query('project != "CSD17_AIR"').copy()
+    tbl['city'] = tbl['city'].map(lambda val: 'honolulu' if val == 'antarctica' else val)
+    tbl['control_type_fine'] = tbl.apply(add_lab_controls_fine, axis=1)
+    tbl['control_type_coarse'] = tbl.apply(add_lab_controls_coarse, axis=1)
+    tbl['control_type_fine'] = tbl.apply(lambda r: id_control(r, 'control_type_fine'), axis=1)
+    tbl['control_type_coarse'] = tbl.apply(lambda r: id_control(r, 'control_type_coarse'), axis=1)
+    tbl['control_type_coarse'] = tbl.apply(normalize_control, axis=1)
+    tbl = add_surface_ontology(tbl)
+    tbl['coastal'] = tbl.apply(lambda r: coastal(r)[1], axis=1)
+    tbl['city_elevation'] = tbl.apply(lambda r: coastal(r)[0], axis=1)
+
+    mems = set()
+    deduped = tbl.loc[tbl.apply(lambda r: deduper(r, mems), axis=1)]
+    cntrls = deduped.loc[~deduped['control_type_coarse'].isna()]
+    mems = set()
+    dupes = tbl.loc[tbl.apply(lambda r: not deduper(r, mems), axis=1)]
+    dupe_primary = deduped.loc[deduped['ha_id'].isin(dupes['ha_id'])]
+    dupe_map = dupe_primary[['uuid', 'ha_id']].join(
+        dupes[['uuid', 'ha_id']].set_index('ha_id'),
+        on='ha_id', how='outer', lsuffix='_primary', rsuffix='_secondary'
+    )
+    dupes = pd.concat([dupe_primary, dupes])
+    dupe_map = dupe_map[['uuid_primary', 'uuid_secondary', 'ha_id']]
+    return deduped, cntrls, dupes, dupe_map
+
+
+@click.command()
+@click.option('-n', '--n-rows', default=100 * 1000)
+@click.option('--rowwise/--no-rowwise', default=True, help='Also time the old row by row method.')
+def main(n_rows, rowwise):
+    """Print the time taken to clean a raw metadata table."""
+    tbl = random_metadata(n_rows)
+    start = time()
+    tables = clean_metadata_table(tbl)
+    click.echo(f'vectorized\t{time() - start:.2f}s')
+    if rowwise:
+        start = time()
+        expected = rowwise_clean_metadata_table(tbl)
+        click.echo(f'rowwise\t{time() - start:.2f}s')
+        for table, expected_table in zip(tables, expected):
+            pd.testing.assert_frame_equal(table.astype(object), expected_table.astype(object))
+        click.echo('tables match')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Benchmark grouping co-abundant pathways, densely with networkx and sparsely with scipy.
+
+Makes a random samples by pathways table in which pathways come in
+groups driven by a shared signal, then times collapsing correlated
+pathways the way build_functional_groups used to (a dense correlation
+matrix, melted, with a networkx graph built row by row) and with
+coabundance, and checks that both give the same table.
+"""
+
+import click
+import networkx as nx
+import numpy as np
+import pandas as pd
+import warnings
+from time import time
+
+from metasub_utils.packet_parse.coabundance import correlated_groups, collapse_groups
+
+
+def random_pathways(n_samples, n_paths, group_size, noise):
+    signals = np.random.rand(n_samples, n_paths // group_size + 1)
+    values = signals[:, np.arange(n_paths) // group_size]
+    values = values * (np.random.rand(n_paths) < 0.5)  # half the pathways are not grouped
+    values = values + noise * np.random.rand(n_samples, n_paths)
+    return pd.DataFrame(values, columns=[f'PWY-{i}: pathway {i}' for i in range(n_paths)])
+
+
+def dense_groups(mypaths, threshold):
+    warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+    co = mypaths.corr()
+    co['path_1'] = co.index
+    co = co.melt(id_vars=['path_1'])
+    co.columns = ['path_1', 'path_2', 'value']
+    co = co.query('value >= @threshold')
+    G = nx.Graph()
+    for _, row in co.iterrows():
+        G.add_edge(row['path_1'], row['path_2'])
+    comps = [comp for comp in nx.connected_components(G) if len(comp) > 1]
+    for i, comp in enumerate(comps):
+        comp = [path for path in mypaths.columns if path in comp]
+        these_paths = mypaths[comp].sum(axis=1)
+        mypaths = mypaths.drop(columns=comp)
+        mypaths[f'COMP_{i}'] = these_paths
+    return mypaths
+
+
+def sparse_groups(mypaths, threshold):
+    groups = correlated_groups(mypaths, threshold)
+    return collapse_groups(mypaths, groups, [f'COMP_{i}' for i in range(len(groups))])
+
+
+@click.command()
+@click.option('-s', '--n-samples', default=4000)
+@click.option('-p', '--n-paths', default=5000)
+@click.option('-g', '--group-size', default=20)
+@click.option('-n', '--noise', default=0.2)
+@click.option('--dense/--no-dense', default=True, help='Also time the old dense method.')
+def main(n_samples, n_paths, group_size, noise, dense):
+    """Print the time taken to collapse co-abundant pathways."""
+    mypaths = random_pathways(n_samples, n_paths, group_size, noise)
+    start = time()
+    sparse = sparse_groups(mypaths, 0.75)
+    click.echo(f'sparse\t{time() - start:.2f}s\t{sparse.shape[1]} columns')
+    if dense:
+        start = time()
+        reference = dense_groups(mypaths, 0.75)
+        click.echo(f'dense\t{time() - start:.2f}s\t{reference.shape[1]} columns')
+        pd.testing.assert_frame_equal(sparse, reference)
+        click.echo('tables match')
+
+
+if __name__ == '__main__':
+    main()
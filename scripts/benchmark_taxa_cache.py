@@ -0,0 +1,68 @@
+"""Benchmark loading the cached taxa table from CSV and from the binary cache.
+
+Writes a random samples by species table both as the old CSV cache and
+as the memory mapped binary cache, then times loading each of them and
+summing the loaded table (which forces the memory map to be read).
+"""
+
+import click
+import numpy as np
+import pandas as pd
+from os.path import join, getsize
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from metasub_utils.packet_parse.taxa_cache import save_table, load_table, cache_paths
+
+
+def timed(func, repeats):
+    """Return the best time of `repeats` calls to func."""
+    best = None
+    for _ in range(repeats):
+        start = time()
+        func()
+        seconds = time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+@click.command()
+@click.option('-s', '--n-samples', default=2000)
+@click.option('-t', '--n-taxa', default=10000)
+@click.option('-d', '--density', default=0.1, help='Fraction of non zero values.')
+@click.option('-r', '--repeats', default=3)
+def main(n_samples, n_taxa, density, repeats):
+    """Print load times of the CSV and binary taxa table caches."""
+    values = np.random.rand(n_samples, n_taxa)
+    values[values > density] = 0
+    tbl = pd.DataFrame(
+        values,
+        index=[f'sample_{i}' for i in range(n_samples)],
+        columns=[f'taxon_{j}' for j in range(n_taxa)],
+    )
+    tmp_dir = mkdtemp()
+    try:
+        csv_path = join(tmp_dir, 'cached_taxa_table.csv')
+        prefix = join(tmp_dir, 'cached_taxa_table')
+        tbl.to_csv(csv_path)
+        save_table(tbl, prefix)
+        binary_size = sum(getsize(path) for path in cache_paths(prefix))
+        click.echo(f'csv\t{getsize(csv_path) / 1e6:.1f}MB')
+        click.echo(f'binary\t{binary_size / 1e6:.1f}MB')
+
+        def read_csv():
+            return pd.read_csv(csv_path, header=0, index_col=0)
+
+        click.echo(f'csv load\t{timed(read_csv, repeats):.3f}s')
+        click.echo(f'binary load\t{timed(lambda: load_table(prefix), repeats):.3f}s')
+        click.echo(f'csv load+sum\t{timed(lambda: read_csv().sum().sum(), repeats):.3f}s')
+        click.echo(
+            f'binary load+sum\t{timed(lambda: load_table(prefix).sum().sum(), repeats):.3f}s'
+        )
+    finally:
+        rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark small object throughput of WasabiBucket and AsyncWasabiBucket.
+
+Starts a moto S3 server on localhost (`pip install moto[server]`), then
+uploads and downloads a set of small random files, like the CAP results,
+once with the threaded WasabiBucket and once with AsyncWasabiBucket
+(`pip install aiobotocore`), printing objects and bytes per second.
+"""
+
+import click
+import logging
+from contextlib import redirect_stdout
+from os import environ, urandom, makedirs, devnull
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from moto.server import ThreadedMotoServer
+
+from metasub_utils.wasabi import WasabiBucket, AsyncWasabiBucket
+
+
+def run_transfers(bucket, local_dir, n_files, upload):
+    for i in range(n_files):
+        local_path = join(local_dir, f'sample_{i}', 'output.json')
+        remote_key = f'cap_analysis/sample_{i}/output.json'
+        if upload:
+            bucket.upload(local_path, remote_key, False)
+        else:
+            bucket.download(remote_key, local_path, False)
+    return bucket.close()
+
+
+@click.command()
+@click.option('-n', '--n-files', default=5000)
+@click.option('-s', '--file-size', default=4, help='Size of each file in KB.')
+@click.option('-t', '--threads', default=32, help='Worker threads for WasabiBucket.')
+@click.option('-r', '--max-requests', default=256,
+              help='Concurrent requests for AsyncWasabiBucket.')
+@click.option('--port', default=5124)
+def main(n_files, file_size, threads, max_requests, port):
+    """Print small object upload and download throughput for each engine."""
+    environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    tmp_dir = mkdtemp()
+    try:
+        endpoint_url = f'http://localhost:{port}'
+        upload_dir = join(tmp_dir, 'upload')
+        for i in range(n_files):
+            makedirs(join(upload_dir, f'sample_{i}'))
+            with open(join(upload_dir, f'sample_{i}', 'output.json'), 'wb') as f:
+                f.write(urandom(file_size * 1024))
+        engines = [
+            ('threads', WasabiBucket, {'threads': threads}),
+            ('async', AsyncWasabiBucket, {'max_requests': max_requests}),
+        ]
+        for engine, bucket_class, kwargs in engines:
+            engine_dir = join(tmp_dir, engine)
+            bucket_kwargs = dict(
+                endpoint_url=endpoint_url,
+                bucket_name=engine,
+                index_path=join(engine_dir, 'index.sqlite'),
+                journal_path=join(engine_dir, 'journal.sqlite'),
+            )
+            WasabiBucket(**bucket_kwargs).bucket.create()
+            for upload in [True, False]:
+                local_dir = upload_dir if upload else join(engine_dir, 'download')
+                bucket = bucket_class(**bucket_kwargs, **kwargs)
+                with open(devnull, 'w') as log, redirect_stdout(log):
+                    summary = run_transfers(bucket, local_dir, n_files, upload)
+                direction = 'upload' if upload else 'download'
+                rate = summary.n_jobs / summary.seconds if summary.seconds else 0
+                click.echo(f'{direction}\t{engine}\t{rate:.0f} objects/s\t{summary}')
+    finally:
+        server.stop()
+        rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark WasabiBucket transfer throughput against a local S3 stand-in.
+
+Starts a moto S3 server on localhost (`pip install moto[server]`), uploads
+a set of random files through WasabiBucket and downloads them again with
+different numbers of worker threads, printing throughput for each.
+"""
+
+import click
+import logging
+from os import environ, urandom, makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from moto.server import ThreadedMotoServer
+
+from metasub_utils.wasabi import WasabiBucket
+from metasub_utils.wasabi.transfer import TransferProfile, MB
+
+
+def run_transfers(endpoint_url, index_path, journal_path, local_dir, n_files, threads, profile,
+                  upload):
+    bucket = WasabiBucket(
+        threads=threads,
+        transfer_profile=profile,
+        endpoint_url=endpoint_url,
+        bucket_name='benchmark',
+        index_path=index_path,
+        journal_path=journal_path,
+    )
+    for i in range(n_files):
+        local_path = join(local_dir, f'sample_{i}_1.fastq.gz')
+        remote_key = f'data/benchmark/sample_{i}_1.fastq.gz'
+        if upload:
+            bucket.upload(local_path, remote_key, False)
+        else:
+            bucket.download(remote_key, local_path, False)
+    return bucket.close()
+
+
+@click.command()
+@click.option('-n', '--n-files', default=32)
+@click.option('-s', '--file-size', default=64, help='Size of each file in MB.')
+@click.option('--chunk-size', default=8, help='Multipart chunk size in MB.')
+@click.option('--file-concurrency', default=4)
+@click.option('--port', default=5123)
+@click.argument('workers', nargs=-1, type=int)
+def main(n_files, file_size, chunk_size, file_concurrency, port, workers):
+    """Print upload and download throughput for each number of WORKERS (default 1 8 32)."""
+    environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    workers = workers or (1, 8, 32)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    tmp_dir = mkdtemp()
+    try:
+        endpoint_url = f'http://localhost:{port}'
+        profile = TransferProfile(chunk_size=chunk_size * MB, file_concurrency=file_concurrency)
+        index_path = join(tmp_dir, 'index.sqlite')
+        journal_path = join(tmp_dir, 'journal.sqlite')
+        upload_dir, download_dir = join(tmp_dir, 'upload'), join(tmp_dir, 'download')
+        makedirs(upload_dir)
+        for i in range(n_files):
+            with open(join(upload_dir, f'sample_{i}_1.fastq.gz'), 'wb') as f:
+                f.write(urandom(file_size * MB))
+        WasabiBucket(
+            endpoint_url=endpoint_url, bucket_name='benchmark',
+            index_path=index_path, journal_path=journal_path,
+        ).bucket.create()
+
+        for threads in workers:
+            summary = run_transfers(
+                endpoint_url, index_path, journal_path, upload_dir, n_files, threads, profile, True
+            )
+            click.echo(f'upload\t{threads} workers\t{summary}')
+            summary = run_transfers(
+                endpoint_url, index_path, journal_path, download_dir, n_files, threads, profile, False
+            )
+            click.echo(f'download\t{threads} workers\t{summary}')
+            rmtree(download_dir)
+    finally:
+        server.stop()
+        rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
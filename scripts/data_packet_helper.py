@@ -1,45 +1,47 @@
 
 import click
 from glob import glob
+from os import makedirs
 from os.path import join, dirname, basename
-from subprocess import check_call
-
-
-def city_packet(sample_filename, long_taxa, wide_taxa, base_taxa):
-    print(sample_filename)
-    city_packet_dir = dirname(sample_filename)
-    # city_long = f'{city_packet_dir}/taxonomy/{basename(long_taxa)}'[:-3]
-    # cmd = (
-    #     f'gunzip -c {long_taxa} | head -1 > {city_long} '
-    #     f'&& gunzip -c {long_taxa} | grep -Ff {sample_filename} >> {city_long} '
-    #     f'&& gzip {city_long}'
-    # )
-    #  check_call(cmd, shell=True)
-
-    # city_wide = f'{city_packet_dir}/taxonomy/{basename(wide_taxa)}'
-    # cmd = (
-    #     f'cat {wide_taxa} | head -4 > {city_wide} '
-    #     f'&& cat {wide_taxa} | grep -Ff {sample_filename} >> {city_wide} '
-    # )
-    # check_call(cmd, shell=True)
-
-    city_base_taxa = f'{city_packet_dir}/taxonomy/{basename(base_taxa)}'
-    cmd = (
-        f'cat {base_taxa} | head -4 > {city_base_taxa} '
-        f'&& cat {base_taxa} | grep -Ff {sample_filename} >> {city_base_taxa} '
-    )
-    check_call(cmd, shell=True)
+
+from metasub_utils.data_packet.compression import find_table
+from metasub_utils.data_packet.filter_data_packet import filter_table, read_sample_names
+from metasub_utils.data_packet.packet_manifest import PacketManifest, packet_samples
 
 
 @click.command()
 @click.argument('packet_dir')
 def main(packet_dir):
-    wide_taxa = f'{packet_dir}/taxonomy/refseq.krakenhll_wide.read_counts.csv'
-    long_taxa = f'{packet_dir}/taxonomy/refseq.krakenhll_longform.csv.gz'
-    base_taxa = f'{packet_dir}/taxonomy/refseq.krakenhll_species.csv'
+    """Rebuild the taxonomy tables of each city packet from its list of sample names.
+
+    Tables may be plain, gzip or zstd compressed and each city packet table
+    is compressed as its source is. Every city is written in one pass over
+    each table. Whether samples are rows or columns, and how many header
+    lines there are, is read from the packet manifest.
+    """
+    tables = [
+        find_table(f'{packet_dir}/taxonomy/refseq.krakenhll_species.csv'),
+        find_table(f'{packet_dir}/taxonomy/refseq.krakenhll_longform.csv'),
+    ]
     sample_filenames = glob(f'{packet_dir}/city_packets/*/*_sample_names.txt')
+    city_samples = {}
     for sample_filename in sample_filenames:
-        city_packet(sample_filename, long_taxa, wide_taxa, base_taxa)
+        print(sample_filename)
+        city_packet_dir = dirname(sample_filename)
+        makedirs(join(city_packet_dir, 'taxonomy'), exist_ok=True)
+        city_samples[city_packet_dir] = read_sample_names(sample_filename)
+
+    manifest = PacketManifest(packet_dir)
+    known_samples = packet_samples(packet_dir).union(*city_samples.values())
+    for table in tables:
+        if table is None:
+            continue
+        sinks = [
+            (join(city_packet_dir, 'taxonomy', basename(table)), sample_names)
+            for city_packet_dir, sample_names in city_samples.items()
+        ]
+        filter_table(table, sinks, layout=manifest.layout(table, known_samples))
+    manifest.save()
 
 
 if __name__ == '__main__':